@@ -0,0 +1,256 @@
+## Library API and local HTTP/JSON service of the audit. An Auditor loads the closure and the pattern tables of a release
+## once and then answers queries about single concepts or concept-pairs, including hypothetical edits: adding or
+## removing a relation, or adding a new concept. Queries return the suggestions of suggest_inconsistencies for the
+## concept-pairs involved, before the removal of redundant suggestions (which depends on all the other suggestions).
+## Hypothetical edits recompute the closure of the edited concept only; the closures of its descendants and the
+## pattern tables of the release are used as they are.
+
+import argparse
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import suggest_inconsistencies
+import Transitive_closure
+from suggest_inconsistencies import (DIFFERENCE_TABLES, SUGGESTION_HEADERS, PatternPrefilter, WordIndex, check_concept_pair,
+                                     encode_concept, generate_pattern_tables, inconsistency_row)
+from Transitive_closure import CLOSURE_RELATIONS, Concept, ancestors_from_parents, compute_closure
+
+DEFAULT_PORT = 8765
+
+
+# an error in a query (unknown concept, invalid relation, ...), reported to HTTP clients with status 400 or 404
+class QueryError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Auditor:
+    def __init__(self, labels_file, relations_file, pos_tag_file, snapshot_dir=None, difference_table='counted', workers=1):
+        concept_dict = compute_closure(labels_file, relations_file, pos_tag_file, snapshot_dir=snapshot_dir)
+        suggest_inconsistencies.closure_concept_dict = concept_dict
+        self.concept_dict = concept_dict
+        self.pattern_dict, self.replacement_candidate_dict = generate_pattern_tables(workers, difference_table)
+        self.all_concepts = list(concept_dict.values())
+        self.word_index = WordIndex(self.all_concepts, self.pattern_dict)
+        self.prefilter = PatternPrefilter(self.pattern_dict)
+
+    def concept(self, con_id):
+        if not isinstance(con_id, str):
+            raise QueryError('Concept ids must be strings')
+        con = self.concept_dict.get(con_id)
+        if con is None:
+            raise QueryError('Unknown concept: ' + str(con_id), 404)
+        return con
+
+    # the suggestion for the ordered concept-pair (con1 as the descendant), as a dict keyed by SUGGESTION_HEADERS, or None
+    def suggestion(self, con1, con2):
+        inconsistency = check_concept_pair(con1, con2, self.pattern_dict, self.replacement_candidate_dict, prefilter=self.prefilter)
+        if inconsistency is None:
+            return None
+        return {header: value if isinstance(value, (int, str)) else str(value) for header, value in zip(SUGGESTION_HEADERS, inconsistency_row(inconsistency))}
+
+    # suggestions for the pair of concepts, in both directions
+    def check_pair(self, con_id_1, con_id_2):
+        con1, con2 = self.concept(con_id_1), self.concept(con_id_2)
+        return [suggestion for suggestion in (self.suggestion(con1, con2), self.suggestion(con2, con1)) if suggestion is not None]
+
+    # suggestions with the concept (a Concept, which need not be in the release) as the descendant or as the ancestor
+    def concept_suggestions(self, con):
+        suggestions = []
+        for j in sorted(self.word_index.concept_partners(con)):
+            suggestion = self.suggestion(con, self.all_concepts[j])
+            if suggestion is not None:
+                suggestions.append(suggestion)
+        for i in sorted(self.word_index.concept_descendants(con)):
+            suggestion = self.suggestion(self.all_concepts[i], con)
+            if suggestion is not None:
+                suggestions.append(suggestion)
+        return suggestions
+
+    def suggestions_for_concept(self, con_id):
+        return self.concept_suggestions(self.concept(con_id))
+
+    # the suggestions of a concept after adding (add=True) or removing a relation to a parent, compared with its current
+    # suggestions: a dict with the suggestions after the edit, and the suggestions added and resolved by it
+    def edit_relation(self, child_id, rel, parent_id, add=True):
+        child = self.concept(child_id)
+        self.concept(parent_id)
+        if not isinstance(rel, str) or rel not in CLOSURE_RELATIONS:
+            raise QueryError('Unknown relation: ' + str(rel))
+        parents = {parent_rel: set(rel_parents) for parent_rel, rel_parents in child.parents.items()}
+        if add:
+            parents.setdefault(rel, set()).add(parent_id)
+        elif parent_id not in parents.get(rel, ()):
+            raise QueryError('No relation ' + child_id + ' ' + rel + ' ' + parent_id)
+        else:
+            parents[rel].discard(parent_id)
+
+        edited = self.hypothetical_concept(child_id, child.label, child.pos_tags, parents)
+        before, after = self.concept_suggestions(child), self.concept_suggestions(edited)
+        return {'suggestions': after, 'added': difference(after, before), 'resolved': difference(before, after)}
+
+    # the suggestions of a new concept with the given label, part-of-speech tags (one per word of the label) and
+    # direct parents (a list of (relation, parent id))
+    def new_concept(self, con_id, label, pos_tags, parents):
+        if not isinstance(con_id, str) or not isinstance(label, str):
+            raise QueryError('The id and the label of a concept must be strings')
+        if con_id in self.concept_dict:
+            raise QueryError('Concept already exists: ' + con_id)
+        if not isinstance(pos_tags, (list, tuple)) or not all(isinstance(tag, str) for tag in pos_tags):
+            raise QueryError('Part-of-speech tags must be given as a list of strings')
+        if not isinstance(parents, (list, tuple)):
+            raise QueryError('Parents must be given as a list of (relation, parent id)')
+        if len(pos_tags) != len(label.strip().split(' ')):
+            raise QueryError('A part-of-speech tag is needed for every word of the label')
+        parent_sets = {}
+        for parent in parents:
+            if not isinstance(parent, (list, tuple)) or len(parent) != 2:
+                raise QueryError('Parents must be given as (relation, parent id)')
+            rel, parent_id = parent
+            self.concept(parent_id)
+            if not isinstance(rel, str) or rel not in CLOSURE_RELATIONS:
+                raise QueryError('Unknown relation: ' + str(rel))
+            parent_sets.setdefault(rel, set()).add(parent_id)
+        return {'suggestions': self.concept_suggestions(self.hypothetical_concept(con_id, label, list(pos_tags), parent_sets))}
+
+    # a Concept with the given direct parents, whose ancestors are computed from the closure of the release.
+    # The concept is not added to the release.
+    def hypothetical_concept(self, con_id, label, pos_tags, parents):
+        con = Concept(con_id, label)
+        con.pos_tags = pos_tags
+        con.parents = parents
+        Transitive_closure.concept_dict = self.concept_dict
+        for rel in CLOSURE_RELATIONS:   # is_a first, and negatively_regulates before positively_regulates
+            con.ancestors[rel] = ancestors_from_parents(con, rel)
+        con.find_all_ancs()
+        if con_id in con.all_ancestors:
+            raise QueryError('The relations of ' + con_id + ' would create a cycle')
+
+        is_a_parents = sorted(parents.get('is_a', ()))
+        con.root = self.concept_dict[is_a_parents[0]].root if is_a_parents else con_id
+        return encode_concept(con)
+
+    def summary(self):
+        return {'concepts': len(self.concept_dict), 'lexical_patterns': len(self.pattern_dict),
+                'difference_patterns': len(self.replacement_candidate_dict)}
+
+
+def difference(suggestions, other_suggestions):
+    other_edges = {(s['Descendant'], s['Relation'], s['Ancestor']) for s in other_suggestions}
+    return [s for s in suggestions if (s['Descendant'], s['Relation'], s['Ancestor']) not in other_edges]
+
+
+## HTTP/JSON service. Queries are answered one at a time, since an Auditor is not thread-safe.
+##   GET  /summary                                  numbers of concepts and patterns of the release
+##   GET  /concept?id=GO:...                        suggestions of a concept
+##   GET  /pair?id1=GO:...&id2=GO:...               suggestions of a concept-pair (in both directions)
+##   POST /relation {"child", "relation", "parent", "action": "add" or "remove"}
+##   POST /new-concept {"id", "label", "pos_tags": [...], "parents": [[relation, parent id], ...]}
+class AuditRequestHandler(BaseHTTPRequestHandler):
+    auditor = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/summary':
+            self.respond(lambda: self.auditor.summary())
+        elif url.path == '/concept':
+            self.respond(lambda: {'suggestions': self.auditor.suggestions_for_concept(required(query, 'id'))})
+        elif url.path == '/pair':
+            self.respond(lambda: {'suggestions': self.auditor.check_pair(required(query, 'id1'), required(query, 'id2'))})
+        else:
+            self.send_json(404, {'error': 'Unknown path: ' + url.path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': 'Invalid JSON body'})
+            return
+        if not isinstance(body, dict):
+            self.send_json(400, {'error': 'The JSON body must be an object'})
+            return
+        if url.path == '/relation':
+            self.respond(lambda: self.auditor.edit_relation(required(body, 'child'), required(body, 'relation'), required(body, 'parent'),
+                                                            add=relation_action(body) == 'add'))
+        elif url.path == '/new-concept':
+            self.respond(lambda: self.auditor.new_concept(required(body, 'id'), required(body, 'label'), body.get('pos_tags'),
+                                                          body.get('parents', [])))
+        else:
+            self.send_json(404, {'error': 'Unknown path: ' + url.path})
+
+    def respond(self, query):
+        try:
+            result = query()
+        except QueryError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:     # reported to the client instead of dropping the connection
+            self.log_error('Error answering %s: %r', self.path, e)
+            self.send_json(500, {'error': 'Internal error: ' + str(e)})
+            return
+        self.send_json(200, result)
+
+    def send_json(self, status, result):
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# the value of a required string parameter
+def required(params, name):
+    if name not in params:
+        raise QueryError('Missing parameter: ' + name)
+    if not isinstance(params[name], str):
+        raise QueryError('Parameter ' + name + ' must be a string')
+    return params[name]
+
+
+def relation_action(body):
+    action = body.get('action', 'add')
+    if action not in ('add', 'remove'):
+        raise QueryError("Action must be 'add' or 'remove': " + str(action))
+    return action
+
+
+def serve(auditor, host='127.0.0.1', port=DEFAULT_PORT):
+    AuditRequestHandler.auditor = auditor
+    server = HTTPServer((host, port), AuditRequestHandler)
+    print('Serving audit queries on http://{0}:{1}'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Serve queries about the suggestions of single concepts and concept-pairs')
+    parser.add_argument('labels_file')
+    parser.add_argument('relations_file')
+    parser.add_argument('pos_tag_file')
+    parser.add_argument('--host', default='127.0.0.1', help='address the server listens on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port of the server (default {0})'.format(DEFAULT_PORT))
+    parser.add_argument('--snapshot-dir', help='directory of the closure snapshot, reused while the input files are unchanged (requires NumPy)')
+    parser.add_argument('--difference-table', choices=DIFFERENCE_TABLES, default='counted',
+                        help='how the relation-pairs of the difference patterns are stored (default counted)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes for the difference patterns')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    auditor = Auditor(args.labels_file, args.relations_file, args.pos_tag_file, args.snapshot_dir, args.difference_table, args.workers)
+    serve(auditor, args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+## Benchmark suite of suggest_inconsistencies: runs the script on synthetic ontologies and on deterministic subsamples of
+## the GO input files, and reports the wall-clock time and peak memory of each stage (from the --report of each run).
+## The inconsistencies found on each dataset are checked against a golden output, so a change that makes the audit
+## faster cannot silently change its findings. Golden outputs are written by the first run on a dataset (or with
+## --update-golden).
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+from collections import defaultdict
+
+from Transitive_closure import read_labels, read_pos_tags, read_relations
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LABELS_FILE = os.path.join(SCRIPT_DIR, 'inputs', 'GO_labels_2021_12_15.txt')
+DEFAULT_RELATIONS_FILE = os.path.join(SCRIPT_DIR, 'inputs', 'GO_all_relations_2021_12_15.txt')
+DEFAULT_POS_TAG_FILE = os.path.join(SCRIPT_DIR, 'inputs', 'pos_tags_2021_12_15.csv')
+
+STAGES = ('compute_closure', 'generate_patterns_existing_rels', 'generate_difference_patterns', 'search', 'remove_redundant_relations')
+FINDING_COLUMNS = (0, 1, 2, 3, 4, 6, 7)    # columns of the output compared with the golden output (not the example relations)
+DEFAULT_RELATION_MIX = 'is_a=0.75,part_of=0.15,regulates=0.05,positively_regulates=0.025,negatively_regulates=0.025'
+DATASET_VERSION = 1    # version of the dataset generators, part of the settings of the datasets so they are created again when it changes
+SYLLABLES = ('ba', 'ke', 'li', 'mo', 'nu', 'ra', 'se', 'ti', 'vo', 'zu')
+
+
+# the i-th word of the synthetic vocabulary (a made-up word of syllables)
+def synthetic_word(i):
+    word = ''
+    while True:
+        word += SYLLABLES[i % len(SYLLABLES)]
+        i //= len(SYLLABLES)
+        if i == 0:
+            return word + 'n'
+
+
+# 'is_a=0.8,part_of=0.2' -> {'is_a': 0.8, 'part_of': 0.2}
+def parse_relation_mix(relation_mix):
+    weights = {}
+    for item in relation_mix.split(','):
+        rel, weight = item.split('=')
+        weights[rel.strip()] = float(weight)
+    return weights
+
+
+## Synthetic ontology, made of base concepts and concepts derived from them by label templates, like GO. Base concepts
+## have labels of one to three words of the vocabulary and are related to a parent base concept by a relation drawn from
+## the relation mix. A template adds a prefix to the label of a base concept X and relates the derived concept to X by
+## the (fixed) relation of the template. Templates come in groups applied together, like 'regulation of X', 'positive
+## regulation of X' and 'negative regulation of X'. Templates are applied along the hierarchy: T(X) is related to T(P)
+## like X is related to its parent P ('negative regulation of X' is_a 'negative regulation of P'), and the templates of
+## P are applied to its children with probability propagation. With probability missing_rate, such a relation between
+## derived concepts is left out, which the audit should find as a missing relation.
+def generate_synthetic_ontology(out_dir, num_concepts, depth=8, relation_mix=DEFAULT_RELATION_MIX, vocabulary_size=2000,
+                                num_template_groups=8, num_roots=3, propagation=0.5, missing_rate=0.05, seed=0):
+    rng = random.Random(seed)
+    rel_weights = parse_relation_mix(relation_mix)
+    vocabulary = [synthetic_word(i) for i in range(vocabulary_size)]
+    word_weights = [1 / (rank + 1) for rank in range(vocabulary_size)]    # Zipf-like word frequencies, as in GO labels
+    pos_tag = {word: 'ADJ' if i % 3 == 0 else 'NOUN' for i, word in enumerate(vocabulary)}
+
+    def random_relation():
+        return rng.choices(list(rel_weights), list(rel_weights.values()))[0]
+
+    # each group of templates is '<noun> of X', '<adjective> <noun> of X' and '<other adjective> <noun> of X'
+    modifiers = rng.sample(vocabulary, 3 * num_template_groups)
+    template_groups = []    # list of lists of (prefix, relation); prefixes are tuples of (word, POS tag)
+    for noun, adjective_1, adjective_2 in zip(*[iter(modifiers)] * 3):
+        prefix = ((noun, 'NOUN'), ('of', 'ADP'))
+        template_groups.append([(prefix, random_relation()), (((adjective_1, 'ADJ'),) + prefix, random_relation()),
+                                (((adjective_2, 'ADJ'),) + prefix, random_relation())])
+
+    labels = {}     # key = concept id, value = list of (word, POS tag)
+    used_labels = set()
+    relations = []
+    is_a_parent = {}    # key = concept id, value = its is_a parent (None for roots)
+
+    def new_concept(words):
+        label = ' '.join(word for word, _ in words)
+        if label in used_labels:
+            return None
+        con_id = 'GO:{0:07d}'.format(len(labels) + 1)
+        labels[con_id] = words
+        used_labels.add(label)
+        return con_id
+
+    # relates con to parent by rel. A concept related to its parent by another relation than is_a (or whose relation
+    # is left out) still needs an is_a parent, as in GO.
+    def add_relations(con, rel, parent, fallback_is_a_parent):
+        if parent is not None:
+            relations.append((con, rel, parent))
+        if rel == 'is_a' and parent is not None:
+            is_a_parent[con] = parent
+        else:
+            is_a_parent[con] = fallback_is_a_parent
+            relations.append((con, 'is_a', fallback_is_a_parent))
+
+    roots = []
+    while len(roots) < num_roots:
+        word = rng.choices(vocabulary, word_weights)[0]
+        root = new_concept([(word, 'NOUN')]) if word not in modifiers else None
+        if root is not None:
+            roots.append(root)
+            is_a_parent[root] = None
+
+    template_roots = {}     # key = template prefix, value = the concept '<prefix> <first root>', is_a parent of the derived concepts without one
+    base_depth = {root: 0 for root in roots}
+    derived = defaultdict(dict)     # key = base concept id, value = dict: key = template prefix, value = concept derived by the template
+    expandable = list(roots)    # base concepts above the maximum depth
+    attempts = 0
+    while len(labels) < num_concepts and attempts < 100 * num_concepts:
+        attempts += 1
+        parent = rng.choice(expandable)
+        words = [(word, pos_tag[word]) for word in rng.choices(vocabulary, word_weights, k=rng.randint(1, 3)) if word not in modifiers]
+        if not words or words[-1][1] != 'NOUN':
+            continue
+        con = new_concept(words)
+        if con is None:
+            continue
+        rel = random_relation()
+        add_relations(con, rel, parent, is_a_parent[parent] or parent)
+        base_depth[con] = base_depth[parent] + 1
+        if base_depth[con] < depth:
+            expandable.append(con)
+
+        for group in template_groups:
+            group_of_parent = any(prefix in derived[parent] for prefix, _ in group)
+            if rng.random() >= (propagation if group_of_parent else propagation / 20):
+                continue
+            for prefix, template_rel in group:
+                derived_con = new_concept(list(prefix) + labels[con])
+                if derived_con is None:
+                    continue
+                derived[con][prefix] = derived_con
+                if prefix not in template_roots:
+                    template_roots[prefix] = new_concept(list(prefix) + labels[roots[0]])
+                    relations.append((template_roots[prefix], 'is_a', roots[0]))
+                    is_a_parent[template_roots[prefix]] = roots[0]
+                relations.append((derived_con, template_rel, con))
+                parent_derived = derived[parent].get(prefix)
+                if parent_derived is not None and rng.random() < missing_rate:
+                    parent_derived = None   # the relation left out
+                add_relations(derived_con, rel, parent_derived, template_roots[prefix])
+
+    return write_dataset(out_dir, {con: ' '.join(w for w, _ in words) for con, words in labels.items()}, relations,
+                         {con: [tag for _, tag in words] for con, words in labels.items()})
+
+
+## Deterministic subsample of the input files: concepts are taken in an order given by a hash of their ids (and the
+## seed), each with all of its ancestors, until there are num_concepts concepts. As every concept comes with its
+## ancestors, the closure of a concept in the sample is the same as in the complete ontology. The samples of the same
+## seed are nested: a smaller sample is contained in a larger one.
+def sample_inputs(out_dir, num_concepts, labels_file, relations_file, pos_tag_file, seed=0):
+    labels = dict(read_labels(labels_file))
+    parents = defaultdict(set)
+    all_relations = []
+    for con, rel, parent in read_relations(relations_file):
+        all_relations.append((con, rel, parent))
+        parents[con].add(parent)
+    pos_tags = {con: tags for con, _, tags in read_pos_tags(pos_tag_file)}
+
+    def sample_order(con):
+        return hashlib.sha256((str(seed) + con).encode()).hexdigest()
+
+    sample = set()
+    for con in sorted(labels, key=sample_order):
+        if len(sample) >= num_concepts:
+            break
+        stack = [con]
+        while stack:
+            con = stack.pop()
+            if con not in sample:
+                sample.add(con)
+                stack.extend(parents[con])
+
+    relations = [(con, rel, parent) for con, rel, parent in all_relations if con in sample and parent in sample]
+    return write_dataset(out_dir, {con: label for con, label in labels.items() if con in sample}, relations,
+                         {con: tags for con, tags in pos_tags.items() if con in sample})
+
+
+# writes the labels, relations and part-of-speech tags files of a dataset in the formats of the input files
+def write_dataset(out_dir, labels, relations, pos_tags):
+    os.makedirs(out_dir, exist_ok=True)
+    files = dataset_files(out_dir)
+    with open(files[0], 'w') as f:
+        for con, label in labels.items():
+            f.write(con + '\t' + label + '\n')
+    with open(files[1], 'w') as f:
+        for relation in relations:
+            f.write('\t'.join(relation) + '\n')
+    with open(files[2], 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('', 'ID', 'label', 'POS tags'))
+        for i, (con, tags) in enumerate(pos_tags.items()):
+            writer.writerow((i, con, labels[con], ' | '.join(tags)))
+    return files
+
+
+def dataset_files(dataset_dir):
+    return tuple(os.path.join(dataset_dir, name) for name in ('labels.txt', 'relations.txt', 'pos_tags.csv'))
+
+
+# the datasets of the benchmark, as (name, settings, function creating the dataset files in a directory)
+def benchmark_datasets(args):
+    datasets = []
+    for num_concepts in args.synthetic:
+        name = 'synthetic_{0}_depth{1}_seed{2}'.format(num_concepts, args.depth, args.seed)
+        settings = dict(num_concepts=num_concepts, depth=args.depth, relation_mix=args.relation_mix,
+                        vocabulary_size=args.vocabulary_size, propagation=args.propagation, missing_rate=args.missing_rate, seed=args.seed)
+        datasets.append((name, settings, lambda out_dir, settings=settings: generate_synthetic_ontology(out_dir, **settings)))
+    for num_concepts in args.sample:
+        name = 'sample_{0}_seed{1}'.format(num_concepts, args.seed)
+        settings = dict(num_concepts=num_concepts, seed=args.seed, input_files=[args.labels_file, args.relations_file, args.pos_tag_file])
+        datasets.append((name, settings, lambda out_dir, num_concepts=num_concepts: sample_inputs(
+            out_dir, num_concepts, args.labels_file, args.relations_file, args.pos_tag_file, args.seed)))
+    return datasets
+
+
+# the dataset files in benchmark_dir/datasets/name, created again when missing or created with other settings, and a
+# hash of the settings, which keys the golden output of the dataset
+def prepare_dataset(benchmark_dir, name, settings, create):
+    dataset_dir = os.path.join(benchmark_dir, 'datasets', name)
+    settings_file = os.path.join(dataset_dir, 'settings.json')
+    settings = dict(settings, version=DATASET_VERSION)
+    files = dataset_files(dataset_dir)
+    settings_key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+    try:
+        with open(settings_file) as f:
+            if json.load(f) == settings and all(os.path.exists(file) for file in files):
+                return files, settings_key
+    except (OSError, ValueError):
+        pass
+    print('Creating dataset ' + name + '..')
+    create(dataset_dir)
+    with open(settings_file, 'w') as f:
+        json.dump(settings, f)
+    return files, settings_key
+
+
+# runs suggest_inconsistencies on a dataset and returns its report. PYTHONHASHSEED is fixed, so the runs (including
+# their example relations) are reproducible.
+def run_audit(files, output_file, report_file, workers, options):
+    command = [sys.executable, os.path.join(SCRIPT_DIR, 'suggest_inconsistencies.py'), *files, output_file,
+               '--report', report_file, '--workers', str(workers), *options]
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode != 0:
+        print(result.stdout[-5000:])
+        raise RuntimeError('suggest_inconsistencies failed on ' + files[0])
+    with open(report_file) as f:
+        return json.load(f)
+
+
+def read_findings(output_file):
+    with open(output_file, newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    return sorted(tuple(row[i] for i in FINDING_COLUMNS) for row in rows)
+
+
+# compares the findings of output_file with the golden output of the dataset (and its settings), which is written if it
+# does not exist (or update is set). Returns True, False (differences are printed) or None when the golden output was written.
+def check_golden(golden_dir, name, settings_key, output_file, update=False):
+    golden_file = os.path.join(golden_dir, name + '_' + settings_key + '.csv')
+    if update or not os.path.exists(golden_file):
+        os.makedirs(golden_dir, exist_ok=True)
+        with open(output_file, 'rb') as fi, open(golden_file, 'wb') as fo:
+            fo.write(fi.read())
+        print('Golden output written to ' + golden_file)
+        return None
+
+    findings, golden = read_findings(output_file), read_findings(golden_file)
+    if findings == golden:
+        return True
+    missing, extra = set(golden).difference(findings), set(findings).difference(golden)
+    print('{0}: {1} findings differ from the golden output ({2} missing, {3} new)'.format(name, len(missing) + len(extra), len(missing), len(extra)))
+    for row in sorted(missing)[:5]:
+        print('  missing: ' + ' | '.join(row))
+    for row in sorted(extra)[:5]:
+        print('  new: ' + ' | '.join(row))
+    return False
+
+
+# the stages of the fastest of the repeated runs of a dataset
+def summarize_runs(reports):
+    fastest = min(reports, key=lambda report: report['total_seconds'])
+    stages = {stage['stage']: stage for stage in fastest['stages']}
+    return {'total_seconds': fastest['total_seconds'], 'peak_rss_mb': fastest['peak_rss_mb'], 'peak_worker_rss_mb': fastest['peak_worker_rss_mb'],
+            'all_total_seconds': [report['total_seconds'] for report in reports], 'stages': stages, 'counters': fastest['counters']}
+
+
+def print_summary(name, summary, baseline=None):
+    print('\n' + name + ': {0} inconsistencies, {1} pairs enumerated'.format(
+          summary['counters'].get('inconsistencies'), summary['counters'].get('pairs_enumerated')))
+    print('  {0:<34}{1:>10}{2:>14}{3:>14}{4:>10}'.format('stage', 'seconds', 'peak MB', 'workers MB', 'baseline'))
+    rows = [(stage, summary['stages'][stage]) for stage in STAGES if stage in summary['stages']]
+    rows.append(('total', summary))
+    for stage, measures in rows:
+        seconds = measures.get('seconds', measures.get('total_seconds'))
+        relative = ''
+        if baseline is not None:
+            base = baseline['stages'].get(stage, {}).get('seconds') if stage != 'total' else baseline['total_seconds']
+            if base:
+                relative = '{0:.2f}x'.format(seconds / base)
+        print('  {0:<34}{1:>10.2f}{2:>14}{3:>14}{4:>10}'.format(stage, seconds, format_mb(measures['peak_rss_mb']),
+                                                              format_mb(measures['peak_worker_rss_mb']), relative))
+
+
+def format_mb(mb):
+    return 'n/a' if mb is None else '{0:.0f}'.format(mb)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Benchmark suggest_inconsistencies on synthetic and sampled GO datasets')
+    parser.add_argument('benchmark_dir', help='directory of the datasets, the golden outputs and the results of the benchmark')
+    parser.add_argument('--synthetic', nargs='*', type=int, default=[5000], metavar='N',
+                        help='numbers of concepts of the synthetic ontologies (default 5000)')
+    parser.add_argument('--depth', type=int, default=8, help='maximum depth of the synthetic ontologies (default 8)')
+    parser.add_argument('--relation-mix', default=DEFAULT_RELATION_MIX,
+                        help='relative frequencies of the relation types of the synthetic ontologies, as rel=weight,...')
+    parser.add_argument('--vocabulary-size', type=int, default=2000, help='number of words of the labels of the synthetic ontologies (default 2000)')
+    parser.add_argument('--propagation', type=float, default=0.5,
+                        help='probability that a template applied to a concept is applied to its is_a children in the synthetic ontologies (default 0.5)')
+    parser.add_argument('--missing-rate', type=float, default=0.05,
+                        help='fraction of the relations between derived concepts of the synthetic ontologies left out, to be found by the audit (default 0.05)')
+    parser.add_argument('--sample', nargs='*', type=int, default=[5000], metavar='N',
+                        help='numbers of concepts of the subsamples of the input files (default 5000)')
+    parser.add_argument('--labels-file', default=DEFAULT_LABELS_FILE, help='labels file subsampled by --sample')
+    parser.add_argument('--relations-file', default=DEFAULT_RELATIONS_FILE, help='relations file subsampled by --sample')
+    parser.add_argument('--pos-tag-file', default=DEFAULT_POS_TAG_FILE, help='part-of-speech tags file subsampled by --sample')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic ontologies and of the subsamples (default 0)')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs per dataset; the fastest is reported (default 1)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes of each run (default 1)')
+    parser.add_argument('--options', default='', help='other options passed to suggest_inconsistencies, e.g. "--difference-table counted"')
+    parser.add_argument('--golden-dir', help='directory of the golden outputs (default <benchmark_dir>/golden)')
+    parser.add_argument('--update-golden', action='store_true', help='replace the golden outputs with the outputs of this benchmark')
+    parser.add_argument('--baseline', metavar='FILE', help='results of an earlier benchmark, to which the times of this one are compared')
+    parser.add_argument('--results', metavar='FILE', help='file the results are written to (default <benchmark_dir>/results.json)')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    golden_dir = args.golden_dir or os.path.join(args.benchmark_dir, 'golden')
+    runs_dir = os.path.join(args.benchmark_dir, 'runs')
+    os.makedirs(runs_dir, exist_ok=True)
+    options = shlex.split(args.options)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['datasets']
+
+    results = {'options': vars(args), 'datasets': {}}
+    all_match = True
+    for name, settings, create in benchmark_datasets(args):
+        files, settings_key = prepare_dataset(args.benchmark_dir, name, settings, create)
+        output_file = os.path.join(runs_dir, name + '.csv')
+        reports = []
+        for i in range(args.repeat):
+            print('Running {0} ({1}/{2})..'.format(name, i + 1, args.repeat))
+            reports.append(run_audit(files, output_file, os.path.join(runs_dir, name + '_report.json'), args.workers, options))
+        summary = summarize_runs(reports)
+        summary['golden'] = check_golden(golden_dir, name, settings_key, output_file, args.update_golden)
+        all_match = all_match and summary['golden'] is not False
+        results['datasets'][name] = summary
+        print_summary(name, summary, baseline.get(name) if baseline is not None else None)
+
+    results_file = args.results or os.path.join(args.benchmark_dir, 'results.json')
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('\nResults written to ' + results_file)
+    if not all_match:
+        print('The findings differ from the golden outputs!')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
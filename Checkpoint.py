@@ -0,0 +1,137 @@
+## Checkpoints of long runs of suggest_inconsistencies: the inconsistencies found in each searched shard of the search and
+## the predictions already checked by remove_redundant_relations. Both are appended to log files, which are written at
+## regular intervals. A run resumed from a checkpoint skips the work recorded in it.
+## A checkpoint is keyed by a hash of the input files and the settings of the run, so it is never resumed by another run.
+
+import hashlib
+import json
+import os
+import pickle
+import time
+
+CHECKPOINT_VERSION = 1
+MANIFEST_FILE = 'checkpoint.json'
+SEARCH_LOG = 'search.log'
+REDUNDANCY_LOG = 'redundancy.log'
+CHECKPOINT_FILES = (MANIFEST_FILE, SEARCH_LOG, REDUNDANCY_LOG)  # the files of a checkpoint, the only ones removed when it is replaced
+CHECKPOINT_INTERVAL = 60    # seconds between writes of a checkpoint log
+
+
+# hash of the contents of the input files and of the settings (a dict) of a run
+def run_key(input_files, settings):
+    sha = hashlib.sha256(('checkpoint version ' + str(CHECKPOINT_VERSION) + json.dumps(settings, sort_keys=True)).encode())
+    for input_file in input_files:
+        sha.update(b'\0')
+        with open(input_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+# append-only log of pickled records. Records are buffered and written (and synced to disk) once interval seconds have
+# passed since the last write. A record cut off by an interruption is dropped when the log is read again.
+class CheckpointLog:
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.records = []
+        if os.path.exists(path):
+            self.records = self.read_records()
+        self.file = open(path, 'ab')
+        self.pending = []
+        self.last_write = time.time()
+
+    # the complete records of the log; the log is truncated after the last of them
+    def read_records(self):
+        records = []
+        with open(self.path, 'rb+') as f:
+            end = 0
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                    break
+                end = f.tell()
+            f.truncate(end)
+        return records
+
+    def append(self, record):
+        self.pending.append(record)
+        if time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        for record in self.pending:
+            pickle.dump(record, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.pending = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_write = time.time()
+
+    def close(self):
+        self.write()
+        self.file.close()
+
+
+# prepares checkpoint_dir for a new checkpoint: removes the files of an earlier checkpoint in it. A directory holding
+# other files and no checkpoint is refused, so that a mistyped --checkpoint-dir does not delete anything else.
+def clear_checkpoint_dir(checkpoint_dir):
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+        return
+    if not os.path.exists(os.path.join(checkpoint_dir, MANIFEST_FILE)) and len(os.listdir(checkpoint_dir)) > 0:
+        raise ValueError(checkpoint_dir + ' is not empty and holds no checkpoint: choose another checkpoint directory')
+    for name in CHECKPOINT_FILES:
+        try:
+            os.remove(os.path.join(checkpoint_dir, name))
+        except FileNotFoundError:
+            pass
+
+
+class RunCheckpoint:
+    def __init__(self, checkpoint_dir, key, resume=False, interval=CHECKPOINT_INTERVAL):
+        manifest_file = os.path.join(checkpoint_dir, MANIFEST_FILE)
+        if resume:
+            try:
+                with open(manifest_file) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                raise ValueError('No checkpoint to resume in ' + checkpoint_dir)
+            if manifest.get('key') != key:
+                raise ValueError('Checkpoint in ' + checkpoint_dir + ' was written by a run with other input files or settings')
+        else:
+            clear_checkpoint_dir(checkpoint_dir)
+            with open(manifest_file, 'w') as f:
+                json.dump({'version': CHECKPOINT_VERSION, 'key': key}, f)
+
+        self.search_log = CheckpointLog(os.path.join(checkpoint_dir, SEARCH_LOG), interval)
+        self.redundancy_log = CheckpointLog(os.path.join(checkpoint_dir, REDUNDANCY_LOG), interval)
+
+        self.searched_shards = {}   # key = shard index, value = list of inconsistencies found in the shard
+        self.search_complete = False
+        for record in self.search_log.records:
+            if record[0] == 'shard':
+                self.searched_shards[record[1]] = record[2]
+            else:
+                self.search_complete = True
+        self.checked_predictions = dict(self.redundancy_log.records)  # key = (child id, relation, parent id), value = redundant or not
+        if resume:
+            print('Resuming from checkpoint: {0} shards searched{1}, {2} predictions checked for redundancy'.format(
+                  len(self.searched_shards), ' (search complete)' if self.search_complete else '', len(self.checked_predictions)))
+
+    def record_shard(self, shard_index, inconsistencies):
+        self.searched_shards[shard_index] = inconsistencies
+        self.search_log.append(('shard', shard_index, inconsistencies))
+
+    def record_search_complete(self):
+        self.search_complete = True
+        self.search_log.append(('complete',))
+        self.search_log.write()
+
+    def record_prediction(self, edge, redundant):
+        self.checked_predictions[edge] = redundant
+        self.redundancy_log.append((edge, redundant))
+
+    def close(self):
+        self.search_log.close()
+        self.redundancy_log.close()
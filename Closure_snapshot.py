@@ -0,0 +1,164 @@
+## On-disk snapshot of the computed closure, the tokenized labels and the part-of-speech tags.
+## The snapshot is keyed by a hash of the input files: a snapshot built from other inputs (or by another snapshot
+## version) is stale and is rebuilt. Arrays are stored as .npy files and memory-mapped when the snapshot is loaded.
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import Transitive_closure
+from Compact_closure import CLOSURE_RELATIONS, CompactClosure, to_csr
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+# hash of the contents of the input files (and of the snapshot version)
+def input_hash(*input_files):
+    sha = hashlib.sha256(('snapshot version ' + str(SNAPSHOT_VERSION)).encode())
+    for input_file in input_files:
+        sha.update(b'\0')
+        with open(input_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+def read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(snapshot_dir, key):
+    manifest = read_manifest(snapshot_dir)
+    return manifest is not None and manifest.get('version') == SNAPSHOT_VERSION and manifest.get('input_hash') == key
+
+
+# raises ValueError if snapshot_dir is a non-empty directory without a snapshot, which a snapshot must not replace
+def check_snapshot_dir(snapshot_dir):
+    if os.path.isdir(snapshot_dir) and len(os.listdir(snapshot_dir)) > 0 and not os.path.exists(os.path.join(snapshot_dir, MANIFEST_FILE)):
+        raise ValueError(snapshot_dir + ' is not empty and holds no snapshot: choose another snapshot directory')
+
+
+# encodes sequences of strings as a CSR pair over a vocabulary
+def encode_sequences(sequences, vocabulary, vocabulary_index):
+    rows = []
+    for seq in sequences:
+        row = []
+        for token in seq:
+            if token not in vocabulary_index:
+                vocabulary_index[token] = len(vocabulary)
+                vocabulary.append(token)
+            row.append(vocabulary_index[token])
+        rows.append(np.array(row, dtype=np.int32))
+    return to_csr(rows)
+
+
+def save_csr(snapshot_dir, name, csr):
+    np.save(os.path.join(snapshot_dir, name + '_indptr.npy'), csr[0])
+    np.save(os.path.join(snapshot_dir, name + '_indices.npy'), csr[1])
+
+
+def load_csr(snapshot_dir, name):
+    return (np.load(os.path.join(snapshot_dir, name + '_indptr.npy'), mmap_mode='r'),
+            np.load(os.path.join(snapshot_dir, name + '_indices.npy'), mmap_mode='r'))
+
+
+# writes the snapshot of a computed closure. It is written to a temporary directory which then replaces snapshot_dir,
+# so an interrupted write never leaves a snapshot that looks current. The old snapshot is renamed aside before it is
+# deleted, so there is always a complete snapshot on disk. A non-empty snapshot_dir without a snapshot is refused,
+# so that a mistyped --snapshot-dir does not delete anything else.
+def write_snapshot(snapshot_dir, key, concept_dict):
+    check_snapshot_dir(snapshot_dir)
+
+    tmp_dir = snapshot_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    concepts = list(concept_dict.values())
+    index = {con.id: i for i, con in enumerate(concepts)}
+    closure = CompactClosure.from_concepts(concept_dict)
+    for rel in CLOSURE_RELATIONS:
+        save_csr(tmp_dir, 'closure_' + rel, closure.closures[rel])
+    save_csr(tmp_dir, 'all_ancestors', closure.all_ancestors)
+
+    words = []
+    save_csr(tmp_dir, 'words', encode_sequences([con.get_sequence_of_words() for con in concepts], words, {}))
+    pos_tags = []
+    save_csr(tmp_dir, 'pos_tags', encode_sequences([con.pos_tags or () for con in concepts], pos_tags, {}))
+    np.save(os.path.join(tmp_dir, 'has_pos_tags.npy'), np.array([con.pos_tags is not None for con in concepts], dtype=bool))
+    np.save(os.path.join(tmp_dir, 'roots.npy'), np.array([index[con.root] for con in concepts], dtype=np.int32))
+
+    relations = sorted(set(rel for con in concepts for rel in con.parents))
+    direct_rels = [(i, relations.index(rel), index[parent_id]) for i, con in enumerate(concepts)
+                   for rel, parent_ids in con.parents.items() for parent_id in parent_ids]
+    np.save(os.path.join(tmp_dir, 'direct_relations.npy'), np.array(direct_rels, dtype=np.int32).reshape(-1, 3))
+
+    with open(os.path.join(tmp_dir, 'concepts.json'), 'w') as f:
+        json.dump({'ids': [con.id for con in concepts], 'labels': [con.label for con in concepts],
+                   'words': words, 'pos_tags': pos_tags, 'relations': relations}, f)
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({'version': SNAPSHOT_VERSION, 'input_hash': key, 'num_concepts': len(concepts)}, f)
+
+    old_dir = snapshot_dir.rstrip(os.sep) + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(snapshot_dir) and len(os.listdir(snapshot_dir)) > 0:
+        os.replace(snapshot_dir, old_dir)
+    os.replace(tmp_dir, snapshot_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+# loads a snapshot as Concept instances whose ancestors are views on the memory-mapped closure arrays. The words and
+# part-of-speech tags of each concept are read from slices of the memory-mapped arrays, which are not copied.
+def load_snapshot(snapshot_dir):
+    with open(os.path.join(snapshot_dir, 'concepts.json')) as f:
+        tables = json.load(f)
+
+    ids = tables['ids']
+    closure = CompactClosure(ids, {rel: load_csr(snapshot_dir, 'closure_' + rel) for rel in CLOSURE_RELATIONS},
+                             load_csr(snapshot_dir, 'all_ancestors'))
+
+    words_indptr, words_indices = load_csr(snapshot_dir, 'words')
+    pos_indptr, pos_indices = load_csr(snapshot_dir, 'pos_tags')
+    has_pos_tags = np.load(os.path.join(snapshot_dir, 'has_pos_tags.npy'), mmap_mode='r')
+    roots = np.load(os.path.join(snapshot_dir, 'roots.npy'), mmap_mode='r')
+    vocabulary, pos_vocabulary = tables['words'], tables['pos_tags']
+
+    concept_dict = {}
+    for i, (con_id, label) in enumerate(zip(ids, tables['labels'])):
+        con = Transitive_closure.Concept(con_id, label)
+        con.sequence_of_words = [vocabulary[t] for t in words_indices[words_indptr[i]:words_indptr[i + 1]].tolist()]
+        if has_pos_tags[i]:
+            con.pos_tags = [pos_vocabulary[t] for t in pos_indices[pos_indptr[i]:pos_indptr[i + 1]].tolist()]
+        con.root = ids[roots[i]]
+        concept_dict[con_id] = con
+
+    relations = tables['relations']
+    for child, rel, parent in np.load(os.path.join(snapshot_dir, 'direct_relations.npy')).tolist():
+        concept_dict[ids[child]].parents.setdefault(relations[rel], set()).add(ids[parent])
+
+    closure.attach(concept_dict)
+    Transitive_closure.concept_dict = concept_dict
+    return concept_dict
+
+
+# loads the snapshot in snapshot_dir if it was built from the same input files, otherwise computes the closure and
+# (re)builds the snapshot first
+def load_or_build(snapshot_dir, labels_file, all_rels_file, pos_tags_file):
+    key = input_hash(labels_file, all_rels_file, pos_tags_file)
+
+    if not is_current(snapshot_dir, key):
+        if read_manifest(snapshot_dir) is not None:
+            print('Closure snapshot is stale. Rebuilding it...')
+        check_snapshot_dir(snapshot_dir)    # before computing the closure
+        concept_dict = Transitive_closure.compute_closure(labels_file, all_rels_file, pos_tags_file)
+        write_snapshot(snapshot_dir, key, concept_dict)
+
+    print('Loading closure snapshot...')
+    return load_snapshot(snapshot_dir)
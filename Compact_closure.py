@@ -0,0 +1,182 @@
+## Compact transitive closure: GO ids are mapped to dense integers and the ancestors of each relation are stored as a CSR array
+## (one sorted int32 array per relation, indexed by concept), instead of one Python set per concept and relation.
+## The composition rules are the same as the ones of Transitive_closure.Concept.
+
+from collections.abc import Set
+
+import numpy as np
+
+import Transitive_closure
+
+CLOSURE_RELATIONS = ('is_a', 'part_of', 'has_part', 'regulates', 'negatively_regulates', 'positively_regulates')
+
+EMPTY_ROW = np.zeros(0, dtype=np.int32)
+
+
+# read-only, set-like view of the ancestors of one concept. Ancestors are given and returned as GO ids.
+# Views are created for every concept and relation, so they only keep a reference to the CSR array and the concept index.
+class AncestorView(Set):
+    __slots__ = ('closure', 'csr', 'i')
+
+    def __init__(self, closure, csr, i):
+        self.closure = closure
+        self.csr = csr  # (indptr, indices) of a relation
+        self.i = i  # concept index
+
+    def row(self):
+        indptr, indices = self.csr
+        return indices[indptr[self.i]:indptr[self.i + 1]]
+
+    def __contains__(self, con_id):
+        j = self.closure.index.get(con_id)
+        if j is None:
+            return False
+        row = self.row()
+        k = np.searchsorted(row, j)
+        return k < len(row) and row[k] == j
+
+    def __iter__(self):
+        ids = self.closure.ids
+        for j in self.row().tolist():
+            yield ids[j]
+
+    def __len__(self):
+        indptr = self.csr[0]
+        return int(indptr[self.i + 1] - indptr[self.i])
+
+
+# the direct parents (by rel) of each concept, as lists of concept indices
+def direct_parent_lists(concept_dict, index, rel):
+    parent_lists = []
+    for con in concept_dict.values():
+        parent_lists.append([index[parent_id] for parent_id in con.parents.get(rel, ())])
+    return parent_lists
+
+
+def union_of_rows(parts):
+    if len(parts) == 0:
+        return EMPTY_ROW
+    if len(parts) == 1:
+        return parts[0]
+    return np.unique(np.concatenate(parts))
+
+
+# packs a list of sorted rows into a CSR (indptr, indices) pair
+def to_csr(rows):
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=indptr[1:])
+    indices = np.concatenate(rows).astype(np.int32) if len(rows) > 0 else EMPTY_ROW
+    return indptr, indices
+
+
+class CompactClosure:
+    def __init__(self, ids, closures, all_ancestors):
+        self.ids = ids   # key = concept index, value = GO id
+        self.index = {con_id: i for i, con_id in enumerate(self.ids)}
+        self.closures = closures  # key = relation, value = (indptr, indices)
+        self.all_ancestors = all_ancestors   # (indptr, indices) of the ancestors connected by any relation
+
+    # computes the closure from the direct parents of the concepts
+    @staticmethod
+    def compute(concept_dict):
+        ids = list(concept_dict)
+        index = {con_id: i for i, con_id in enumerate(ids)}
+
+        isa_parents = direct_parent_lists(concept_dict, index, 'is_a')
+        isa_rows = CompactClosure.close_relation(isa_parents, isa_parents, None, transitive=True)
+        rows = {'is_a': isa_rows}
+
+        for rel in ('part_of', 'has_part', 'regulates'):
+            rows[rel] = CompactClosure.close_relation(isa_parents, direct_parent_lists(concept_dict, index, rel), isa_rows, transitive=True)
+
+        # negatively_regulates ancestors of negatively_regulates parents are not inherited
+        rows['negatively_regulates'] = CompactClosure.close_relation(isa_parents, direct_parent_lists(concept_dict, index, 'negatively_regulates'),
+                                                                     isa_rows, transitive=False)
+
+        # negatively_regulates ancestors of negatively_regulates ancestors are positively_regulates ancestors
+        neg_rows = rows['negatively_regulates']
+        double_negative_rows = [union_of_rows([neg_rows[a] for a in neg_rows[c].tolist()]) for c in range(len(ids))]
+        rows['positively_regulates'] = CompactClosure.close_relation(isa_parents, direct_parent_lists(concept_dict, index, 'positively_regulates'),
+                                                                     isa_rows, transitive=True, extra_rows=double_negative_rows)
+
+        closures = {rel: to_csr(rows[rel]) for rel in CLOSURE_RELATIONS}
+        all_ancestors = to_csr([union_of_rows([rows[rel][c] for rel in CLOSURE_RELATIONS if len(rows[rel][c]) > 0]) for c in range(len(ids))])
+        return CompactClosure(ids, closures, all_ancestors)
+
+    # packs the ancestors already computed for the concepts (e.g. by Transitive_closure.compute_closure)
+    @staticmethod
+    def from_concepts(concept_dict):
+        ids = list(concept_dict)
+        index = {con_id: i for i, con_id in enumerate(ids)}
+
+        def packed_row(ancs):
+            return np.array(sorted(index[anc_id] for anc_id in ancs), dtype=np.int32)
+
+        closures = {rel: to_csr([packed_row(con.ancestors.get(rel, ())) for con in concept_dict.values()]) for rel in CLOSURE_RELATIONS}
+        all_ancestors = to_csr([packed_row(con.all_ancestors) for con in concept_dict.values()])
+        return CompactClosure(ids, closures, all_ancestors)
+
+    # ancestors of each concept by a relation rel, given the direct is_a and rel parents:
+    #   rel ancestors of is_a parents, rel parents, is_a ancestors of rel parents and (if transitive) rel ancestors of rel parents
+    # For rel = is_a, rel_parents is isa_parents and isa_rows is None. Computed over the strongly connected components of
+    # the dependencies, parents before children, like Transitive_closure.close_relation.
+    @staticmethod
+    def close_relation(isa_parents, rel_parents, isa_rows, transitive, extra_rows=None):
+        rows = [None] * len(rel_parents)
+        inherits_rel = transitive and rel_parents is not isa_parents
+
+        if inherits_rel:
+            dependencies = lambda c: isa_parents[c] + rel_parents[c]
+        else:
+            dependencies = lambda c: isa_parents[c]
+
+        for component in Transitive_closure.strongly_connected_components(range(len(rel_parents)), dependencies):
+            on_cycle = len(component) > 1 or component[0] in dependencies(component[0])
+            cycle_members = set(component) if on_cycle else ()
+
+            parts = []
+            for c in component:
+                parts.extend(rows[p] for p in isa_parents[c] if p not in cycle_members and len(rows[p]) > 0)
+                if len(rel_parents[c]) > 0:
+                    parts.append(np.array(sorted(rel_parents[c]), dtype=np.int32))
+                    for p in rel_parents[c]:
+                        if inherits_rel and p not in cycle_members and len(rows[p]) > 0:
+                            parts.append(rows[p])
+                        if isa_rows is not None and len(isa_rows[p]) > 0:
+                            parts.append(isa_rows[p])
+                if extra_rows is not None and len(extra_rows[c]) > 0:
+                    parts.append(extra_rows[c])
+
+            if on_cycle and (rel_parents is isa_parents or any(cycle_members.intersection(rel_parents[c]) for c in component)):
+                parts.append(np.array(sorted(cycle_members), dtype=np.int32))   # the members of the cycle are connected to each other by rel
+
+            row = union_of_rows(parts)
+            for c in component:
+                rows[c] = row
+
+        return rows
+
+    # replaces the ancestor sets of the concepts by views on the compact closure
+    def attach(self, concept_dict):
+        for i, con_id in enumerate(self.ids):
+            con = concept_dict[con_id]
+            con.ancestors = {rel: AncestorView(self, self.closures[rel], i) for rel in CLOSURE_RELATIONS}
+            con.all_ancestors = AncestorView(self, self.all_ancestors, i)
+
+    def nbytes(self):
+        return sum(indptr.nbytes + indices.nbytes for indptr, indices in list(self.closures.values()) + [self.all_ancestors])
+
+
+# same as Transitive_closure.compute_closure, with the ancestors stored in a CompactClosure
+def compute_compact_closure(labels_file, all_rels_file, pos_tags_file):
+    concept_dict = Transitive_closure.get_ont_with_direct_rels(labels_file, all_rels_file, pos_tags_file)
+
+    compact_closure = CompactClosure.compute(concept_dict)
+    compact_closure.attach(concept_dict)
+
+    roots = set()
+    for con in concept_dict.values():
+        roots.add(con.find_root())
+    print(roots)
+
+    return concept_dict
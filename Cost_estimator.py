@@ -0,0 +1,241 @@
+## Cost estimator and work budget of a run of suggest_inconsistencies. Once the closure is computed and the lexical
+## patterns of existing relations are generated (both are linear in the size of the closure), the estimator projects the
+## cost of the stages that can grow much faster: the difference pattern table of each --difference-table (quadratic in
+## the number of relations of a lexical pattern) and the search (the concept-pairs enumerated by the search mode).
+## The sizes of the tables are counted exactly from the lexical patterns; their time and memory per relation-pair are
+## measured by building the tables of a sample of lexical patterns. The concept-pairs of the search and their time are
+## extrapolated from a sample of descendant concepts (or of usable lexical patterns in the 'pattern' mode).
+## A budget of concept-pairs and of memory selects the cheaper modes of a run when the requested ones would exceed it,
+## and the search stops with partial results when it has enumerated the budget of concept-pairs.
+
+import contextlib
+import gc
+import io
+import random
+import time
+import tracemalloc
+from collections import Counter
+
+import Instrumentation
+import suggest_inconsistencies
+from suggest_inconsistencies import (DIFFERENCE_TABLES, PatternPrefilter, PatternTemplateIndex, WordIndex, check_concept_pair,
+                                     encode_concept, generate_difference_patterns, pattern_string)
+
+CALIBRATION_PAIRS = 20000   # relation-pairs of the sampled lexical patterns whose difference tables are built to measure their cost
+CALIBRATION_SECONDS = 5     # time spent checking the concept-pairs of sampled descendants (or patterns) to measure the search
+MAX_SEARCH_SAMPLE = 2000    # at most this many descendant concepts (or usable lexical patterns) are sampled for the search
+MB = 1024 * 1024
+
+
+# while the cost of a stage is measured on a sample, its output is not shown. A full garbage collection is run first, so
+# that a collection of the whole closure does not fall in a short measurement, which is extrapolated to the whole stage.
+@contextlib.contextmanager
+def quiet():
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+# the number of relation-pairs of a lexical pattern enumerated by the 'full' and 'sampled' difference tables, and the
+# number of pairs of groups of relations with the same difference pattern enumerated by the 'counted' table (which is
+# also an upper bound of the number of entries the pattern adds to the compact tables)
+def pattern_pair_counts(pattern_obj):
+    relation_pairs = group_pairs = 0
+    for rel_obj_set in pattern_obj.exhibiting_relations.values():
+        relation_pairs += len(rel_obj_set) * (len(rel_obj_set) - 1)
+        groups = Counter(rel_obj.get_difference_pattern_id() for rel_obj in rel_obj_set)
+        group_pairs += len(groups) * (len(groups) - 1) + sum(1 for size in groups.values() if size > 1)
+    return relation_pairs, group_pairs
+
+
+# the time (in seconds) and memory (in bytes) of building the difference table of the lexical patterns in pattern_dict
+def measure_difference_table(pattern_dict, difference_table):
+    with quiet():
+        start_time = time.perf_counter()
+        table = generate_difference_patterns(pattern_dict, 1, difference_table)
+        seconds = time.perf_counter() - start_time
+        del table
+        gc.collect()
+        tracemalloc.start()
+        try:
+            table = generate_difference_patterns(pattern_dict, 1, difference_table)
+            num_bytes = tracemalloc.get_traced_memory()[0]
+            del table
+        finally:
+            tracemalloc.stop()
+    return seconds, num_bytes
+
+
+# projected relation-pairs, entries, time and memory of each difference table. The difference patterns of the relations
+# are computed here, so the run does not compute them again.
+def estimate_difference_tables(pattern_dict, rng):
+    start_time = time.perf_counter()
+    pair_counts = {pattern_id: pattern_pair_counts(pattern_obj) for pattern_id, pattern_obj in pattern_dict.items()}
+    difference_ids_seconds = time.perf_counter() - start_time
+    relation_pairs = sum(counts[0] for counts in pair_counts.values())
+    group_pairs = sum(counts[1] for counts in pair_counts.values())
+
+    # a sample of lexical patterns with about CALIBRATION_PAIRS relation-pairs in all (in an order that does not depend on
+    # the hash seed)
+    pattern_ids = sorted(pattern_dict, key=pattern_string)
+    rng.shuffle(pattern_ids)
+    sample, sample_relation_pairs, sample_group_pairs = {}, 0, 0
+    for pattern_id in pattern_ids:
+        pattern_relation_pairs, pattern_group_pairs = pair_counts[pattern_id]
+        if pattern_group_pairs == 0 or sample_relation_pairs + pattern_relation_pairs > CALIBRATION_PAIRS:
+            continue
+        sample[pattern_id] = pattern_dict[pattern_id]
+        sample_relation_pairs += pattern_relation_pairs
+        sample_group_pairs += pattern_group_pairs
+        if sample_relation_pairs >= CALIBRATION_PAIRS // 2:
+            break
+
+    tables = {}
+    for difference_table in DIFFERENCE_TABLES:
+        seconds, num_bytes = measure_difference_table(sample, difference_table) if sample else (0, 0)
+        if difference_table == 'counted':     # the relation-pairs are counted by groups of relations
+            enumerated, sample_enumerated = group_pairs, sample_group_pairs
+        else:
+            enumerated, sample_enumerated = relation_pairs, sample_relation_pairs
+        stored, sample_stored = (relation_pairs, sample_relation_pairs) if difference_table == 'full' else (group_pairs, sample_group_pairs)
+        tables[difference_table] = {'pairs': enumerated,
+                                    'seconds': seconds * enumerated / sample_enumerated if sample_enumerated else 0,
+                                    'memory_mb': num_bytes * stored / sample_stored / MB if sample_stored else 0}
+
+    return {'relation_pairs': relation_pairs, 'max_compact_entries': group_pairs, 'difference_ids_seconds': difference_ids_seconds,
+            'calibration_patterns': len(sample), 'tables': tables}
+
+
+# projected concept-pairs enumerated by the search mode, and its time (with one process) and the memory of its index
+def estimate_search(pattern_dict, search_mode, rng):
+    all_concepts = list(suggest_inconsistencies.closure_concept_dict.values())
+    for con in all_concepts:
+        encode_concept(con)
+    prefilter = PatternPrefilter(pattern_dict)
+
+    tracemalloc.start()
+    try:
+        if search_mode == 'index':
+            index = WordIndex(all_concepts, pattern_dict)
+        elif search_mode == 'pattern':
+            index = PatternTemplateIndex(all_concepts)
+        else:
+            index = None
+        index_bytes = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # units: the descendant concepts, or the usable lexical patterns in the 'pattern' mode
+    if search_mode == 'pattern':
+        units = sorted((pattern_id for pattern_id, pattern_obj in pattern_dict.items() if len(pattern_obj.exhibiting_relations) == 1),
+                       key=pattern_string)
+    else:
+        units = list(range(len(all_concepts)))
+    sample = rng.sample(units, min(len(units), MAX_SEARCH_SAMPLE))
+
+    num_sampled = num_pairs = 0
+    gc.collect()    # see quiet()
+    start_time = time.perf_counter()
+    for unit in sample:
+        if search_mode == 'pattern':
+            pairs = index.candidate_pairs(unit)
+        elif search_mode == 'index':
+            pairs = ((unit, j) for j in index.candidate_partners(unit))
+        else:
+            pairs = ((unit, j) for j in range(len(all_concepts)))
+        for i, j in pairs:
+            num_pairs += 1
+            # without difference patterns: the few concept-pairs matching a lexical pattern are not checked further
+            check_concept_pair(all_concepts[i], all_concepts[j], pattern_dict, {}, prefilter=prefilter)
+        num_sampled += 1
+        if time.perf_counter() - start_time > CALIBRATION_SECONDS:
+            break
+    seconds = time.perf_counter() - start_time
+
+    scale = len(units) / num_sampled if num_sampled else 0
+    return {'units': len(units), 'sampled_units': num_sampled, 'pairs': round(num_pairs * scale), 'seconds': seconds * scale,
+            'index_mb': index_bytes / MB}
+
+
+# estimates the cost of the run from the closure (suggest_inconsistencies.closure_concept_dict) and its lexical patterns.
+# The cost of the search is estimated for each of search_modes. Returns a dict, which is also added to the run report.
+def estimate_run(pattern_dict, search_modes=('index',), workers=1, seed=0):
+    rng = random.Random(seed)
+    concept_dict = suggest_inconsistencies.closure_concept_dict
+    closure_stages = [stage for stage in Instrumentation.run_report.stages if stage['stage'] == 'compute_closure']
+
+    print('Estimating the cost of the run...')
+    estimate = {'concepts': len(concept_dict),
+                'relations': sum(len(ancs) for con in concept_dict.values() for ancs in con.ancestors.values()),
+                'lexical_patterns': len(pattern_dict),
+                'usable_patterns': sum(1 for pattern_obj in pattern_dict.values() if len(pattern_obj.exhibiting_relations) == 1),
+                'pattern_table_relations': sum(len(rel_obj_set) for pattern_obj in pattern_dict.values()
+                                               for rel_obj_set in pattern_obj.exhibiting_relations.values()),
+                'closure_mb': closure_stages[-1]['peak_rss_mb'] if closure_stages else None,
+                'workers': workers}
+    estimate['difference_patterns'] = estimate_difference_tables(pattern_dict, rng)
+    estimate['peak_rss_mb'] = Instrumentation.peak_rss_mb()[0]     # with the difference patterns of the relations
+    estimate['search'] = {search_mode: estimate_search(pattern_dict, search_mode, rng) for search_mode in search_modes}
+    return estimate
+
+
+# projected time (in seconds) of the difference table and the search, and peak memory (in MB) of the run with them
+def projected_cost(estimate, difference_table, search_mode):
+    table = estimate['difference_patterns']['tables'][difference_table]
+    search = estimate['search'][search_mode]
+    seconds = table['seconds'] + search['seconds'] / max(1, estimate['workers'])
+    return seconds, (estimate['peak_rss_mb'] or 0) + table['memory_mb'] + search['index_mb']
+
+
+def print_estimate(estimate):
+    difference = estimate['difference_patterns']
+    print('{0} concepts, {1} relations in the closure (peak memory so far {2:.0f} MB)'.format(
+        estimate['concepts'], estimate['relations'], estimate['peak_rss_mb'] or 0))
+    print('Lexical patterns: {0} ({1} usable), exhibited by {2} relations'.format(
+        estimate['lexical_patterns'], estimate['usable_patterns'], estimate['pattern_table_relations']))
+    print('Difference patterns: {0} relation-pairs, at most {1} entries in the sampled and counted tables'.format(
+        difference['relation_pairs'], difference['max_compact_entries']))
+    for difference_table, table in difference['tables'].items():
+        print('  --difference-table {0}: {1} pairs enumerated, {2:.1f} s, {3:.0f} MB'.format(
+            difference_table, table['pairs'], table['seconds'], table['memory_mb']))
+    for search_mode, search in estimate['search'].items():
+        print('Search ({0}): {1} concept-pairs, {2:.1f} s with one process (from {3} of {4} {5}), index {6:.0f} MB'.format(
+            search_mode, search['pairs'], search['seconds'], search['sampled_units'], search['units'],
+            'patterns' if search_mode == 'pattern' else 'descendants', search['index_mb']))
+    for difference_table in difference['tables']:
+        for search_mode in estimate['search']:
+            seconds, memory_mb = projected_cost(estimate, difference_table, search_mode)
+            print('Difference patterns and search with --difference-table {0} --search-mode {1}: {2:.1f} mins, peak memory {3:.0f} MB'.format(
+                difference_table, search_mode, seconds / 60, memory_mb))
+
+
+# the difference table and search mode of a run within the budget of concept-pairs enumerated by the search and of peak
+# memory (in MB), given the estimate of the run. The requested modes are kept if they fit. Otherwise the 'index' search
+# mode is used instead of 'pairwise', and a compact difference table ('counted', else 'sampled') instead of a table
+# exceeding the memory budget, unless keep_difference_table (audit states need the 'full' table). Returns (difference
+# table, search mode, whether the search is projected to reach the budget of pairs and stop with partial results), or
+# None if no difference table fits the memory budget.
+def fit_budget(estimate, difference_table, search_mode, max_pairs=None, max_memory=None, keep_difference_table=False):
+    searches = estimate['search']
+    if max_pairs is not None and search_mode == 'pairwise' and 'index' in searches and searches['pairwise']['pairs'] > max_pairs:
+        print('Search mode: index instead of pairwise, which is projected to enumerate more than {0} concept-pairs'.format(max_pairs))
+        search_mode = 'index'
+
+    def fits(table):
+        return max_memory is None or projected_cost(estimate, table, search_mode)[1] <= max_memory
+
+    if not fits(difference_table):
+        fallbacks = [] if keep_difference_table else [table for table in ('counted', 'sampled') if table != difference_table and fits(table)]
+        if len(fallbacks) == 0:
+            closure_mb = estimate['closure_mb']
+            if closure_mb is not None and closure_mb > max_memory / 2:
+                print('The closure alone takes {0:.0f} MB: --closure-backend compact or --snapshot-dir use less memory'.format(closure_mb))
+            return None
+        print('Difference table: {0} instead of {1}, which is projected to exceed {2:.0f} MB'.format(fallbacks[0], difference_table, max_memory))
+        difference_table = fallbacks[0]
+
+    partial = max_pairs is not None and searches[search_mode]['pairs'] > max_pairs
+    if partial:
+        print('The search is projected to enumerate {0} concept-pairs: it will stop after {1} and the results will be partial'.format(
+            searches[search_mode]['pairs'], max_pairs))
+    return difference_table, search_mode, partial
@@ -0,0 +1,242 @@
+## Distributed audit: the search for inconsistencies is split into jobs that run independently, on any number of nodes
+## sharing a directory, and their suggestions are merged before redundant suggestions are removed once.
+##   plan:   copies the input files to the shared directory, builds the closure snapshot there (see Closure_snapshot)
+##           and writes the jobs: the concept-pairs within each top-level subhierarchy (BP, MF, CC), optionally split
+##           by relation type, and the concept-pairs across subhierarchies, split into blocks of descendant concepts
+##           (see suggest_inconsistencies.SearchScope). The jobs partition the concept-pairs of the search.
+##   run:    claims the jobs not claimed yet (by creating a claim file, so that nodes running at the same time take
+##           different jobs) and writes the suggestions of each job to a result file, renamed when complete.
+##   merge:  checks that every job has a result, deduplicates the suggestions and removes redundant suggestions.
+## Nodes are only coordinated through the shared directory. A job whose node failed keeps its claim; it can be run
+## again with run --job.
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+
+import Instrumentation
+import suggest_inconsistencies
+from suggest_inconsistencies import (DIFFERENCE_TABLES, SEARCH_MODES, SUGGESTION_HEADERS, InconsistencyWriter,
+                                     SearchScope, generate_pattern_tables, inconsistency_row, interned_inconsistency,
+                                     predicted_edge, remove_redundant_relations, search_inconsistencies)
+from Transitive_closure import CLOSURE_RELATIONS, compute_closure
+
+PLAN_VERSION = 1
+PLAN_FILE = 'plan.json'
+INPUTS_DIR = 'inputs'
+SNAPSHOT_DIR = 'snapshot'
+CLAIMS_DIR = 'claims'
+RESULTS_DIR = 'results'
+CROSS_ROOT_BLOCKS = 4   # default number of jobs of the concept-pairs across subhierarchies
+
+
+# the jobs of a plan, as dicts of the SearchScope arguments and a name. relation_groups is a list of lists of relations
+# searched by separate jobs within each subhierarchy ([None] for a single job with all relations).
+def plan_jobs(concept_dict, relation_groups=(None,), cross_root_blocks=CROSS_ROOT_BLOCKS):
+    roots = sorted({con.root for con in concept_dict.values()})
+    jobs = []
+    for root in roots:
+        for relations in relation_groups:
+            name = 'root-' + root.replace(':', '_') + ('' if relations is None else '-' + '-'.join(relations))
+            jobs.append({'name': name, 'roots': [root], 'partners': 'same_root', 'relations': relations, 'block': None})
+
+    if len(roots) > 1:
+        num_concepts = len(concept_dict)
+        bounds = [num_concepts * k // cross_root_blocks for k in range(cross_root_blocks + 1)]
+        for k, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            if end > start:
+                jobs.append({'name': 'cross-root-{0:03d}'.format(k), 'roots': None, 'partners': 'other_roots', 'relations': None,
+                             'block': [start, end]})
+    return jobs
+
+
+def job_scope(job):
+    return SearchScope(job['roots'], job['partners'], job['relations'], job['block'])
+
+
+def read_plan(shared_dir):
+    try:
+        with open(os.path.join(shared_dir, PLAN_FILE)) as f:
+            plan = json.load(f)
+    except (OSError, ValueError):
+        raise ValueError('No plan in ' + shared_dir)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError('The plan in ' + shared_dir + ' was written by another version')
+    return plan
+
+
+def input_files(shared_dir, plan):
+    return [os.path.join(shared_dir, INPUTS_DIR, input_file) for input_file in plan['input_files']]
+
+
+def result_file(shared_dir, job):
+    return os.path.join(shared_dir, RESULTS_DIR, job['name'] + '.csv')
+
+
+def claim_file(shared_dir, job):
+    return os.path.join(shared_dir, CLAIMS_DIR, job['name'])
+
+
+# writes the plan of an audit of the input files to shared_dir, which must not have a plan yet
+def plan_audit(shared_dir, labels_file, relations_file, pos_tag_file, split_relations=False, cross_root_blocks=CROSS_ROOT_BLOCKS,
+               search_mode='index', difference_table='counted'):
+    if os.path.exists(os.path.join(shared_dir, PLAN_FILE)):
+        raise ValueError('There is already a plan in ' + shared_dir)
+    paths = (labels_file, relations_file, pos_tag_file)    # the labels and relations may be the same OBO file
+    if len({os.path.basename(path) for path in set(paths)}) < len(set(paths)):
+        raise ValueError('Input files must have different names')
+    os.makedirs(os.path.join(shared_dir, INPUTS_DIR), exist_ok=True)
+    for path in set(paths):
+        shutil.copyfile(path, os.path.join(shared_dir, INPUTS_DIR, os.path.basename(path)))
+    names = [os.path.basename(path) for path in paths]
+
+    concept_dict = compute_closure(*[os.path.join(shared_dir, INPUTS_DIR, name) for name in names],
+                                   snapshot_dir=os.path.join(shared_dir, SNAPSHOT_DIR))
+    relation_groups = [[rel] for rel in CLOSURE_RELATIONS] if split_relations else [None]
+    plan = {'version': PLAN_VERSION, 'input_files': names, 'search_mode': search_mode, 'difference_table': difference_table,
+            'jobs': plan_jobs(concept_dict, relation_groups, cross_root_blocks)}
+
+    os.makedirs(os.path.join(shared_dir, CLAIMS_DIR), exist_ok=True)
+    os.makedirs(os.path.join(shared_dir, RESULTS_DIR), exist_ok=True)
+    with open(os.path.join(shared_dir, PLAN_FILE + '.tmp'), 'w') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(os.path.join(shared_dir, PLAN_FILE + '.tmp'), os.path.join(shared_dir, PLAN_FILE))
+    print('Planned {0} jobs in {1}'.format(len(plan['jobs']), shared_dir))
+    return plan
+
+
+# claims a job for this process; False if another process claimed it first
+def claim_job(shared_dir, job):
+    try:
+        fd = os.open(claim_file(shared_dir, job), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write('{0} {1} {2}\n'.format(socket.gethostname(), os.getpid(), time.strftime('%Y-%m-%d %H:%M:%S')))
+    return True
+
+
+# runs the given jobs (by name), or else claims and runs the jobs that are not claimed yet until none is left.
+# The closure is loaded from the snapshot and the pattern tables are generated once, before the first job.
+def run_jobs(shared_dir, job_names=None, workers=1):
+    plan = read_plan(shared_dir)
+    jobs = {job['name']: job for job in plan['jobs']}
+    unknown = [name for name in job_names or () if name not in jobs]
+    if unknown:
+        raise ValueError('Unknown jobs: ' + ', '.join(unknown))
+
+    pattern_tables = None
+    num_run = 0
+    for job in ([jobs[name] for name in job_names] if job_names else plan['jobs']):
+        if not job_names and (os.path.exists(result_file(shared_dir, job)) or not claim_job(shared_dir, job)):
+            continue
+        if pattern_tables is None:
+            suggest_inconsistencies.closure_concept_dict = compute_closure(*input_files(shared_dir, plan),
+                                                                           snapshot_dir=os.path.join(shared_dir, SNAPSHOT_DIR))
+            pattern_tables = generate_pattern_tables(workers, plan['difference_table'])
+
+        print('Running job ' + job['name'] + '...')
+        start_time = time.time()
+        inconsistencies = search_inconsistencies(*pattern_tables, plan['search_mode'], workers, scope=job_scope(job))
+        tmp_file = os.path.join(shared_dir, RESULTS_DIR, '.tmp-' + job['name'] + '.csv')
+        with InconsistencyWriter(tmp_file, SUGGESTION_HEADERS) as writer:
+            writer.write_rows(inconsistency_row(inconsistency) for inconsistency in inconsistencies)
+        os.replace(tmp_file, result_file(shared_dir, job))
+        print('Job {0}: {1} suggestions in {2:.2f} mins'.format(job['name'], len(inconsistencies), (time.time() - start_time) / 60))
+        num_run += 1
+    return num_run
+
+
+# prints the number of jobs done, running (claimed without a result) and pending
+def print_status(shared_dir):
+    plan = read_plan(shared_dir)
+    done = [job['name'] for job in plan['jobs'] if os.path.exists(result_file(shared_dir, job))]
+    running = [job['name'] for job in plan['jobs'] if job['name'] not in done and os.path.exists(claim_file(shared_dir, job))]
+    print('{0} jobs: {1} done, {2} running, {3} pending'.format(len(plan['jobs']), len(done), len(running),
+                                                                   len(plan['jobs']) - len(done) - len(running)))
+    for name in running:
+        with open(claim_file(shared_dir, {'name': name})) as f:
+            print('  running ' + name + ' (claimed by ' + f.read().strip() + ')')
+    return len(done) == len(plan['jobs'])
+
+
+# merges the results of all the jobs and writes the inconsistencies left after removing redundant suggestions
+def merge_results(shared_dir, output_file, reachability=False):
+    plan = read_plan(shared_dir)
+    missing = [job['name'] for job in plan['jobs'] if not os.path.exists(result_file(shared_dir, job))]
+    if missing:
+        raise ValueError('Jobs without results: ' + ', '.join(missing))
+
+    predictions = {}    # key = (child id, relation, parent id), value = inconsistency
+    for job in plan['jobs']:
+        with open(result_file(shared_dir, job), newline='') as f:
+            rows = csv.reader(f)
+            next(rows)  # headers
+            for row in rows:
+                predictions.setdefault(predicted_edge(row), interned_inconsistency(tuple(row)))
+    print('Merged {0} suggestions of {1} jobs'.format(len(predictions), len(plan['jobs'])))
+
+    return remove_redundant_relations(set(predictions.values()), *input_files(shared_dir, plan), output_file, reachability=reachability)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Audits GO in independent jobs, on nodes sharing a directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help='copy the input files, build the closure snapshot and write the jobs')
+    plan_parser.add_argument('shared_dir')
+    plan_parser.add_argument('labels_file')
+    plan_parser.add_argument('relations_file')
+    plan_parser.add_argument('pos_tag_file')
+    plan_parser.add_argument('--split-relations', action='store_true', help='search each relation type in its own jobs within each subhierarchy')
+    plan_parser.add_argument('--cross-root-blocks', type=int, default=CROSS_ROOT_BLOCKS,
+                             help='number of jobs of the concept-pairs across subhierarchies (default {0})'.format(CROSS_ROOT_BLOCKS))
+    plan_parser.add_argument('--search-mode', choices=SEARCH_MODES, default='index', help='how candidate concept-pairs are enumerated')
+    plan_parser.add_argument('--difference-table', choices=DIFFERENCE_TABLES, default='counted',
+                             help='how the relation-pairs of the difference patterns are stored (default counted)')
+
+    run_parser = commands.add_parser('run', help='run the jobs not claimed yet, or the given jobs')
+    run_parser.add_argument('shared_dir')
+    run_parser.add_argument('--job', action='append', metavar='NAME', help='run this job (again), even if it was claimed')
+    run_parser.add_argument('--workers', type=int, default=1, help='number of worker processes of this node')
+
+    status_parser = commands.add_parser('status', help='print the number of jobs done, running and pending')
+    status_parser.add_argument('shared_dir')
+
+    merge_parser = commands.add_parser('merge', help='merge the results of the jobs and remove redundant suggestions')
+    merge_parser.add_argument('shared_dir')
+    merge_parser.add_argument('output_file')
+    merge_parser.add_argument('--reachability-index', action='store_true',
+                              help='check the redundancy of suggestions with a reachability index (see suggest_inconsistencies.py)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'plan' and args.cross_root_blocks < 1:
+        parser.error('--cross-root-blocks must be at least 1')
+    return args
+
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    Instrumentation.reset_report(dict(vars(args)))
+    try:
+        if args.command == 'plan':
+            plan_audit(args.shared_dir, args.labels_file, args.relations_file, args.pos_tag_file, args.split_relations,
+                       args.cross_root_blocks, args.search_mode, args.difference_table)
+        elif args.command == 'run':
+            print('Ran {0} jobs'.format(run_jobs(args.shared_dir, args.job, args.workers)))
+        elif args.command == 'status':
+            sys.exit(0 if print_status(args.shared_dir) else 1)
+        else:
+            inconsistencies = merge_results(args.shared_dir, args.output_file, args.reachability_index)
+            print('{0} inconsistencies written to {1}'.format(len(inconsistencies), args.output_file))
+    except ValueError as e:
+        sys.exit('Error: ' + str(e))
+
+
+if __name__ == '__main__':
+    main()
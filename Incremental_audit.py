@@ -0,0 +1,464 @@
+## Incremental audit of a new GO release, starting from the state saved by the audit of a previous release
+## (see save_audit_state). Only the closures, lexical patterns, difference patterns and concept-pairs affected by the
+## changes of labels, part-of-speech tags and relations between the two releases are recomputed.
+## The audit state is a directory with a closure snapshot of the release (see Closure_snapshot) and the pattern tables,
+## the suggestions and the inconsistencies (after removing redundant suggestions) of the release, keyed by concept ids.
+
+import csv
+import os
+import pickle
+from array import array
+from collections import defaultdict
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from tqdm import tqdm
+
+import Closure_snapshot
+import Transitive_closure
+from Transitive_closure import CLOSURE_RELATIONS
+import suggest_inconsistencies
+from suggest_inconsistencies import (OUTPUT_HEADERS, Relation, Pattern, DifferencePattern, PatternTemplateIndex, WordIndex,
+                                     check_concept_pair, compact_inconsistency, difference_pattern, difference_pattern_key,
+                                     expand_inconsistency, get_pattern_from_concept_pair, inconsistency_row,
+                                     intern_difference_pattern, intern_pattern, interned_inconsistency, pattern_key,
+                                     predicted_edge, remove_redundant_relations)
+
+AUDIT_STATE_VERSION = 1
+CLOSURE_DIR = 'closure'
+TABLES_FILE = 'tables.pickle'
+
+
+# packs the groups (key, rel, members) of a pattern table, whose members are tuples of concept ids, into arrays of
+# concept indices: the members of group k are the rows offsets[k]:offsets[k + 1] of members
+def encode_table(groups, index, width):
+    keys, rels, sizes, members = [], [], [], array('i')
+    for key, rel_string, group_members in groups:
+        keys.append(key)
+        rels.append(rel_string)
+        sizes.append(len(group_members))
+        for member in group_members:
+            members.extend(index[con_id] for con_id in member)
+
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return {'keys': keys, 'rels': rels, 'offsets': offsets, 'members': np.frombuffer(members, dtype=np.int32).reshape(-1, width)}
+
+
+def decode_members(members, ids):
+    return [tuple(ids[i] for i in member) for member in members]
+
+
+# the groups (key, rel, members) of a table packed by encode_table, with the members as tuples of concept ids
+def decode_table(table, ids):
+    offsets = table['offsets'].tolist()
+    members = table['members'].tolist()
+    for k, (key, rel_string) in enumerate(zip(table['keys'], table['rels'])):
+        yield key, rel_string, decode_members(members[offsets[k]:offsets[k + 1]], ids)
+
+
+def pattern_groups(pattern_id, pattern_obj):
+    for rel_string, rels in pattern_obj.exhibiting_relations.items():
+        yield pattern_obj.pattern_string, rel_string, [(rel.child.id, rel.parent.id) for rel in rels]
+
+
+def difference_groups(diff_key, diff_pat_obj):
+    for rel_string, rel_pairs in diff_pat_obj.exhibiting_relation_pairs.items():
+        yield diff_pat_obj.difference_pattern_string, rel_string, [(rel1.child.id, rel1.parent.id, rel2.child.id, rel2.parent.id) for rel1, rel2 in rel_pairs]
+
+
+def add_pattern_group(pattern_obj, rel_string, pairs, concept_dict):
+    for child_id, parent_id in pairs:
+        pattern_obj.add_exhibiting_relation(rel_string, concept_dict[child_id], concept_dict[parent_id])
+
+
+def add_difference_group(diff_pat_obj, rel_string, quads, concept_dict):
+    for child1_id, parent1_id, child2_id, parent2_id in quads:
+        diff_pat_obj.add_exhibiting_relation_pair(rel_string, concept_dict[child1_id], concept_dict[parent1_id],
+                                                  concept_dict[child2_id], concept_dict[parent2_id])
+
+
+# the groups (key string, rel, members) of a table given as a dict (or a StoredTable) of Pattern or DifferencePattern instances
+def table_groups(table, entry_groups):
+    if isinstance(table, StoredTable):
+        return table.packed_groups()
+    return (group for key, entry in table.items() for group in entry_groups(key, entry))
+
+
+def pattern_table_objects(table, ids, concept_dict):
+    pattern_dict = {}
+    for pattern_string, rel_string, pairs in decode_table(table, ids):
+        pattern_id = pattern_key(pattern_string)
+        pattern_obj = pattern_dict.get(pattern_id) or pattern_dict.setdefault(pattern_id, Pattern(pattern_id))
+        add_pattern_group(pattern_obj, rel_string, pairs, concept_dict)
+    return pattern_dict
+
+
+# dict-like table over a table packed by encode_table, whose Pattern or DifferencePattern instances are built when
+# first accessed (the difference pattern table of GO has millions of relation pairs, of which a search only looks up a
+# few). Built entries are kept and may be updated; removed keys are kept as None. key_of gives the key of the table for
+# a key string of the packed table. Pattern tables are packed with the pattern strings as keys, since pattern ids
+# are only valid within a process.
+class StoredTable(MutableMapping):
+    def __init__(self, table, ids, concept_dict, entry_class, add_group, entry_groups, key_of):
+        self.table = table
+        self.ids = ids
+        self.concept_dict = concept_dict
+        self.entry_class = entry_class
+        self.add_group = add_group  # adds the members of a group to an entry
+        self.entry_groups = entry_groups    # groups of an entry
+        self.packed = defaultdict(list)  # key = key of the table, value = indices of its packed groups
+        for k, key_string in enumerate(table['keys']):
+            self.packed[key_of(key_string)].append(k)
+        self.entries = {}
+
+    def __getitem__(self, key):
+        if key not in self.entries:
+            if key not in self.packed:
+                raise KeyError(key)
+            entry = self.entry_class(key)
+            offsets, members = self.table['offsets'], self.table['members']
+            for k in self.packed[key]:
+                self.add_group(entry, self.table['rels'][k], decode_members(members[offsets[k]:offsets[k + 1]].tolist(), self.ids), self.concept_dict)
+            self.entries[key] = entry
+        entry = self.entries[key]
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        if key in self.entries:
+            return self.entries[key] is not None
+        return key in self.packed
+
+    def __setitem__(self, key, entry):
+        self.entries[key] = entry
+
+    def __delitem__(self, key):
+        self[key]
+        self.entries[key] = None
+
+    def __iter__(self):
+        for key in self.packed:
+            if self.entries.get(key, True) is not None:
+                yield key
+        for key, entry in self.entries.items():
+            if entry is not None and key not in self.packed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    # the groups of the table, decoded from the packed table for the entries that were not built
+    def packed_groups(self):
+        offsets, members = self.table['offsets'], self.table['members']
+        for key, group_indices in self.packed.items():
+            if key not in self.entries:
+                for k in group_indices:
+                    yield self.table['keys'][k], self.table['rels'][k], decode_members(members[offsets[k]:offsets[k + 1]].tolist(), self.ids)
+        for key, entry in self.entries.items():
+            if entry is not None:
+                yield from self.entry_groups(key, entry)
+
+
+# writes the audit state of a release: a closure snapshot and the pattern tables, the suggestions and the rows of the
+# inconsistencies written to the output file. Concepts are referred to by id, or by index in the snapshot in the pattern tables.
+def save_audit_state(state_dir, labels_file, all_rels_file, pos_tags_file, concept_dict, pattern_dict,
+                     replacement_candidate_dict, predictions, inconsistencies):
+    print('Saving audit state...')
+    os.makedirs(state_dir, exist_ok=True)
+    Closure_snapshot.write_snapshot(os.path.join(state_dir, CLOSURE_DIR),
+                                    Closure_snapshot.input_hash(labels_file, all_rels_file, pos_tags_file), concept_dict)
+
+    index = {con_id: i for i, con_id in enumerate(concept_dict)}
+    tables = {'version': AUDIT_STATE_VERSION,
+              'ids': list(concept_dict),
+              'patterns': encode_table(table_groups(pattern_dict, pattern_groups), index, 2),
+              'differences': encode_table(table_groups(replacement_candidate_dict, difference_groups), index, 4),
+              'predictions': [compact_inconsistency(inconsistency_row(pred)) for pred in predictions],
+              'rows': [tuple(str(value) for value in inconsistency_row(row)) for row in inconsistencies]}
+
+    tmp_file = os.path.join(state_dir, TABLES_FILE + '.tmp')
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, os.path.join(state_dir, TABLES_FILE))
+
+
+def load_audit_state(state_dir):
+    with open(os.path.join(state_dir, TABLES_FILE), 'rb') as f:
+        tables = pickle.load(f)
+    if tables.get('version') != AUDIT_STATE_VERSION:
+        raise ValueError('Audit state in ' + state_dir + ' was saved by another version')
+    old_concepts = Closure_snapshot.load_snapshot(os.path.join(state_dir, CLOSURE_DIR))
+    return old_concepts, tables
+
+
+# loads the new release and computes its closure, reusing the ancestors of the previous release for the concepts
+# whose direct parents and whose ancestors' direct parents are unchanged. Returns the concepts and the ids of the
+# concepts whose closure (ancestors or root) changed, including the new concepts.
+def update_closure(old_concepts, labels_file, all_rels_file, pos_tags_file):
+    concept_dict = Transitive_closure.get_ont_with_direct_rels(labels_file, all_rels_file, pos_tags_file)
+
+    children = defaultdict(list)
+    for con in concept_dict.values():
+        for rel in CLOSURE_RELATIONS:
+            for parent_id in con.parents.get(rel, ()):
+                children[parent_id].append(con.id)
+
+    affected = set()
+    stack = [con_id for con_id, con in concept_dict.items() if con_id not in old_concepts or con.parents != old_concepts[con_id].parents]
+    while len(stack) > 0:   # concepts with changed parents and their descendants by any relation
+        con_id = stack.pop()
+        if con_id not in affected:
+            affected.add(con_id)
+            stack.extend(children[con_id])
+    print('Recomputing the closure of {0} of {1} concepts...'.format(len(affected), len(concept_dict)))
+
+    for con_id, con in concept_dict.items():
+        if con_id not in affected:
+            old_con = old_concepts[con_id]
+            con.ancestors = {rel: set(old_con.ancestors[rel]) for rel in CLOSURE_RELATIONS}
+            con.all_ancestors = set(old_con.all_ancestors)
+            con.root = old_con.root
+
+    # the components of the affected concepts; the ancestors of the other concepts are known
+    affected_ids = [con_id for con_id in concept_dict if con_id in affected]
+    components = {}
+    for rel in CLOSURE_RELATIONS:
+        if rel == 'negatively_regulates':
+            components[rel] = components['is_a']
+        else:
+            components[rel] = Transitive_closure.strongly_connected_components(
+                affected_ids, lambda con_id: [dep for dep in Transitive_closure.closure_dependencies(concept_dict[con_id], rel) if dep in affected])
+    Transitive_closure.report_cycles(Transitive_closure.find_cycles(concept_dict, components))
+    for rel in CLOSURE_RELATIONS:
+        Transitive_closure.close_relation(concept_dict, rel, components[rel])
+
+    for con_id in affected_ids:
+        concept_dict[con_id].find_all_ancs()
+    for con_id in affected_ids:
+        concept_dict[con_id].find_root()
+
+    closure_changed = set()
+    for con_id in affected_ids:
+        con, old_con = concept_dict[con_id], old_concepts.get(con_id)
+        if old_con is None or con.root != old_con.root or any(con.ancestors[rel] != set(old_con.ancestors[rel]) for rel in CLOSURE_RELATIONS):
+            closure_changed.add(con_id)
+
+    return concept_dict, closure_changed
+
+
+# (child id, rel, ancestor id) of the ancestors of the concepts in changed_descendants and of the ancestors in changed_ancestors
+def relations_of_changed_concepts(concept_dict, changed_descendants, changed_ancestors):
+    for con_id, con in concept_dict.items():
+        for rel in CLOSURE_RELATIONS:
+            if con_id in changed_descendants:
+                ancestor_ids = con.ancestors[rel]
+            else:
+                ancestor_ids = [anc_id for anc_id in con.ancestors[rel] if anc_id in changed_ancestors]
+            for anc_id in ancestor_ids:
+                yield con_id, rel, anc_id
+
+
+# the net changes of the groups (key, rel) of a pattern table: (key, rel), removed members, added members
+def net_changes(removed, added):
+    for key_rel in removed.keys() | added.keys():
+        removed_members, added_members = removed.get(key_rel, set()), added.get(key_rel, set())
+        if removed_members != added_members:
+            yield key_rel, removed_members - added_members, added_members - removed_members
+
+
+# updates the lexical patterns for the relations whose descendant changed (closure, label or part-of-speech tags)
+# or whose ancestor changed (label or part-of-speech tags). Returns the net changed patterns and, for the difference
+# patterns, the (child id, parent id) of the relations of every pattern touched by the update, before and after it.
+def update_pattern_table(pattern_dict, old_concepts, concept_dict, changed_descendants, changed_ancestors):
+    removed, added = defaultdict(set), defaultdict(set)
+    for concepts, changes in ((old_concepts, removed), (concept_dict, added)):
+        for con_id, rel, anc_id in relations_of_changed_concepts(concepts, changed_descendants, changed_ancestors):
+            pattern = get_pattern_from_concept_pair(concepts[con_id], concepts[anc_id])
+            if pattern is not None:
+                changes[(intern_pattern(pattern), rel)].add((con_id, anc_id))
+
+    touched = {pattern_id for pattern_id, rel in removed.keys() | added.keys()}
+    old_relations = {pattern_id: pattern_relation_ids(pattern_dict.get(pattern_id)) for pattern_id in touched}
+
+    changed_patterns = set()
+    for (pattern_id, rel_string), removed_pairs, added_pairs in net_changes(removed, added):
+        changed_patterns.add(pattern_id)
+        pattern_obj = pattern_dict.get(pattern_id) or pattern_dict.setdefault(pattern_id, Pattern(pattern_id))
+        for child_id, parent_id in removed_pairs:
+            pattern_obj.exhibiting_relations[rel_string].discard(Relation(rel_string, old_concepts[child_id], old_concepts[parent_id]))
+        for child_id, parent_id in added_pairs:
+            pattern_obj.add_exhibiting_relation(rel_string, concept_dict[child_id], concept_dict[parent_id])
+        remove_empty_group(pattern_dict, pattern_id, pattern_obj.exhibiting_relations, rel_string)
+
+    new_relations = {pattern_id: pattern_relation_ids(pattern_dict.get(pattern_id)) for pattern_id in touched}
+    return changed_patterns, old_relations, new_relations
+
+
+def pattern_relation_ids(pattern_obj):
+    if pattern_obj is None:
+        return {}
+    return {rel_string: [(rel.child.id, rel.parent.id) for rel in rels] for rel_string, rels in pattern_obj.exhibiting_relations.items()}
+
+
+def remove_empty_group(table, key, groups, rel_string):
+    if len(groups[rel_string]) == 0:
+        del groups[rel_string]
+        if len(groups) == 0:
+            del table[key]
+
+
+# (difference pattern key, (child1 id, parent1 id, child2 id, parent2 id)) of the ordered pairs of relations of a pattern
+# (as in suggest_inconsistencies.generate_difference_patterns) in which at least one relation is not in stable
+def relation_pair_differences(pairs, concept_dict, stable):
+    diff_pats = [intern_difference_pattern(difference_pattern(concept_dict[child_id], concept_dict[parent_id])) for child_id, parent_id in pairs]
+    unstable = [i for i, pair in enumerate(pairs) if pair not in stable]
+    unstable_set = set(unstable)
+    for i in unstable:
+        for j in range(len(pairs)):
+            if j != i:
+                yield (diff_pats[i], diff_pats[j]), pairs[i] + pairs[j]
+                if j not in unstable_set:
+                    yield (diff_pats[j], diff_pats[i]), pairs[j] + pairs[i]
+
+
+# updates the difference patterns for the patterns touched by update_pattern_table. The pairs of relations that are in a
+# pattern before and after the update and whose concepts kept their labels have the same difference patterns, so only
+# the pairs with another relation are compared. Returns the changed difference patterns.
+def update_difference_table(replacement_candidate_dict, old_concepts, concept_dict, old_relations, new_relations, label_changed):
+    removed, added = defaultdict(set), defaultdict(set)
+    for pattern_id, old_rel_pairs in old_relations.items():
+        new_rel_pairs = new_relations[pattern_id]
+        for rel_string in old_rel_pairs.keys() | new_rel_pairs.keys():
+            old_pairs, new_pairs = old_rel_pairs.get(rel_string, []), new_rel_pairs.get(rel_string, [])
+            stable = {pair for pair in set(old_pairs).intersection(new_pairs) if pair[0] not in label_changed and pair[1] not in label_changed}
+            for diff_pat, quad in relation_pair_differences(old_pairs, old_concepts, stable):
+                removed[(diff_pat, rel_string)].add(quad)
+            for diff_pat, quad in relation_pair_differences(new_pairs, concept_dict, stable):
+                added[(diff_pat, rel_string)].add(quad)
+
+    changed_differences = set()
+    for (diff_key, rel_string), removed_quads, added_quads in net_changes(removed, added):
+        changed_differences.add(diff_key)
+        diff_pat_obj = (replacement_candidate_dict.get(diff_key)
+                        or replacement_candidate_dict.setdefault(diff_key, DifferencePattern(diff_key)))
+        for child1_id, parent1_id, child2_id, parent2_id in removed_quads:
+            diff_pat_obj.exhibiting_relation_pairs[rel_string].discard(
+                (Relation(rel_string, old_concepts[child1_id], old_concepts[parent1_id]), Relation(rel_string, old_concepts[child2_id], old_concepts[parent2_id])))
+        for child1_id, parent1_id, child2_id, parent2_id in added_quads:
+            diff_pat_obj.add_exhibiting_relation_pair(rel_string, concept_dict[child1_id], concept_dict[parent1_id],
+                                                      concept_dict[child2_id], concept_dict[parent2_id])
+        remove_empty_group(replacement_candidate_dict, diff_key, diff_pat_obj.exhibiting_relation_pairs, rel_string)
+
+    return changed_differences
+
+
+# positions (in all_concepts) of the concept-pairs whose suggestion may differ from the previous release:
+# the pairs with a changed concept, the candidate pairs of the changed usable patterns and of the usable patterns
+# with a relation whose difference pattern is the second half of a changed difference pattern
+def pairs_to_check(all_concepts, pattern_dict, changed_concepts, changed_patterns, changed_differences):
+    position = {con.id: i for i, con in enumerate(all_concepts)}
+    word_index = WordIndex(all_concepts, pattern_dict)
+    template_index = PatternTemplateIndex(all_concepts)
+
+    pairs = set()
+    for con_id in changed_concepts:
+        i = position[con_id]
+        pairs.update((i, j) for j in word_index.candidate_partners(i))
+        pairs.update((j, i) for j in word_index.candidate_descendants(i))
+
+    changed_halves = {diff_key[1] for diff_key in changed_differences}
+    for pattern_id in word_index.usable_patterns:
+        pattern_obj = pattern_dict[pattern_id]
+        if pattern_id in changed_patterns or any(rel.get_difference_pattern_id() in changed_halves
+                                                     for rels in pattern_obj.exhibiting_relations.values() for rel in rels):
+            pairs.update(template_index.candidate_pairs(pattern_id))
+
+    return pairs
+
+
+# audits a new release incrementally from the audit state of the previous release in state_dir. Writes the
+# inconsistencies to output_file, and the inconsistencies added and resolved since the previous release next to it.
+# If new_state_dir is given, the audit state of the new release is saved there.
+def incremental_audit(state_dir, labels_file, all_rels_file, pos_tags_file, output_file, new_state_dir=None):
+    print('Loading audit state of the previous release...')
+    old_concepts, tables = load_audit_state(state_dir)
+
+    concept_dict, closure_changed = update_closure(old_concepts, labels_file, all_rels_file, pos_tags_file)
+    suggest_inconsistencies.closure_concept_dict = concept_dict
+    removed_concepts = old_concepts.keys() - concept_dict.keys()
+    label_changed = {con_id for con_id, con in concept_dict.items() if con_id not in old_concepts
+                     or con.label != old_concepts[con_id].label or con.pos_tags != old_concepts[con_id].pos_tags}
+    changed_concepts = closure_changed | label_changed
+    print('{0} new, {1} removed, {2} relabeled concepts, {3} concepts with a changed closure'.format(
+          len(concept_dict.keys() - old_concepts.keys()), len(removed_concepts),
+          len(label_changed - (concept_dict.keys() - old_concepts.keys())), len(closure_changed)))
+
+    # relations of removed concepts are built with the concepts of the previous release and removed from the tables
+    table_concepts = dict(concept_dict)
+    table_concepts.update((con_id, old_concepts[con_id]) for con_id in removed_concepts)
+    pattern_dict = pattern_table_objects(tables['patterns'], tables['ids'], table_concepts)
+    replacement_candidate_dict = StoredTable(tables['differences'], tables['ids'], table_concepts, DifferencePattern,
+                                             add_difference_group, difference_groups, difference_pattern_key)
+    del tables['patterns']
+
+    print('Updating lexical patterns...')
+    changed_patterns, old_relations, new_relations = update_pattern_table(pattern_dict, old_concepts, concept_dict,
+                                                                          changed_concepts | removed_concepts, label_changed | removed_concepts)
+    print('Updating difference patterns...')
+    changed_differences = update_difference_table(replacement_candidate_dict, old_concepts, concept_dict, old_relations,
+                                                  new_relations, label_changed | removed_concepts)
+    print('{0} lexical patterns and {1} difference patterns changed'.format(len(changed_patterns), len(changed_differences)))
+
+    all_concepts = list(concept_dict.values())
+    pairs = pairs_to_check(all_concepts, pattern_dict, changed_concepts, changed_patterns, changed_differences)
+
+    position = {con.id: i for i, con in enumerate(all_concepts)}
+    predictions = set()
+    for compact in tables['predictions']:
+        compact = interned_inconsistency(compact)
+        child_id, rel_string, parent_id = predicted_edge(compact)
+        if child_id in removed_concepts or parent_id in removed_concepts:
+            continue
+        pair = (position[child_id], position[parent_id])
+        if (pair in pairs or child_id in changed_concepts or parent_id in changed_concepts
+                or compact[3] in changed_patterns or compact[6] in changed_differences):
+            pairs.add(pair)     # checked again below
+        else:
+            predictions.add(expand_inconsistency(compact))
+
+    print('Checking {0} concept-pairs...'.format(len(pairs)))
+    for i, j in tqdm(sorted(pairs)):
+        inconsistency = check_concept_pair(all_concepts[i], all_concepts[j], pattern_dict, replacement_candidate_dict)
+        if inconsistency is not None:
+            predictions.add(inconsistency)
+
+    inconsistencies = remove_redundant_relations(predictions, labels_file, all_rels_file, pos_tags_file, output_file)
+    write_changes(output_file, tables['rows'], inconsistencies)
+
+    if new_state_dir is not None:
+        save_audit_state(new_state_dir, labels_file, all_rels_file, pos_tags_file, concept_dict, pattern_dict,
+                         replacement_candidate_dict, predictions, inconsistencies)
+
+    return inconsistencies
+
+
+# writes the inconsistencies that are new in this release and the ones of the previous release that are resolved,
+# compared by (child id, relation, parent id)
+def write_changes(output_file, previous_rows, inconsistencies):
+    previous = {predicted_edge(row): row for row in previous_rows}
+    current = {predicted_edge(row): row for row in map(inconsistency_row, inconsistencies)}
+    added = [row for edge, row in current.items() if edge not in previous]
+    resolved = [row for edge, row in previous.items() if edge not in current]
+    print('{0} inconsistencies added and {1} resolved since the previous release'.format(len(added), len(resolved)))
+
+    if output_file is None:
+        return
+    output_base = os.path.splitext(output_file)[0]
+    for suffix, rows in (('_added.csv', added), ('_resolved.csv', resolved)):
+        with open(output_base + suffix, 'w') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(OUTPUT_HEADERS)
+            csvwriter.writerows(rows)
@@ -0,0 +1,117 @@
+## Instrumentation of a run of suggest_inconsistencies: the wall-clock time and peak memory of each stage, counters of
+## the search (concept-pairs enumerated, pruned, ...) and an optional profiler around the run. The measurements are
+## written as a JSON report, so runs on different releases (or with different options) can be compared.
+
+import json
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+# peak resident set size (in MB) of this process and of its (waited for) worker processes so far
+def peak_rss_mb():
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS and in KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def growth(start, end):
+    return None if start is None else round(end - start, 3)
+
+
+# count_checks: whether the outcomes of the checks of concept-pairs in the search are counted (which slows the search a little)
+class RunReport:
+    def __init__(self, settings=None, count_checks=False):
+        self.start_time = time.time()
+        self.stages = []    # list of dicts with the name, time and peak memory of each stage, in the order they ended
+        self.counters = Counter()
+        self.settings = settings or {}
+        self.count_checks = count_checks
+        self.plan = None    # the estimated cost of the run, if it was estimated (see Cost_estimator)
+
+    # peak_rss_mb and peak_worker_rss_mb are the peaks of the run so far, so a stage after the peak of the run reports the
+    # same values. rss_growth_mb and worker_rss_growth_mb are the increases of those peaks during the stage: the memory a
+    # stage used beyond the peak of the stages before it.
+    @contextmanager
+    def stage(self, name):
+        start_time = time.time()
+        start_rss, start_children_rss = peak_rss_mb()
+        try:
+            yield
+        finally:
+            peak_rss, peak_children_rss = peak_rss_mb()
+            self.stages.append({'stage': name, 'seconds': round(time.time() - start_time, 3),
+                                'peak_rss_mb': peak_rss, 'peak_worker_rss_mb': peak_children_rss,
+                                'rss_growth_mb': growth(start_rss, peak_rss), 'worker_rss_growth_mb': growth(start_children_rss, peak_children_rss)})
+
+    def add_counts(self, counts):
+        self.counters.update(counts)
+
+    def as_dict(self):
+        peak_rss, peak_children_rss = peak_rss_mb()
+        report = {'settings': self.settings, 'stages': self.stages, 'counters': dict(self.counters),
+                  'total_seconds': round(time.time() - self.start_time, 3), 'peak_rss_mb': peak_rss, 'peak_worker_rss_mb': peak_children_rss}
+        if self.plan is not None:
+            report['plan'] = self.plan
+        return report
+
+    def write(self, report_file):
+        with open(report_file, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+run_report = RunReport()    # report of the current run
+
+
+def reset_report(settings=None, count_checks=False):
+    global run_report
+    run_report = RunReport(settings, count_checks)
+    return run_report
+
+
+def stage(name):
+    return run_report.stage(name)
+
+
+def add_counts(counts):
+    run_report.add_counts(counts)
+
+
+def set_plan(plan):
+    run_report.plan = plan
+
+
+# runs function() under a profiler and writes the profile to profile_file: cProfile statistics (readable with pstats or
+# snakeviz) or, for pyinstrument, an HTML report if profile_file ends with .html and a text report otherwise.
+# Only the main process is profiled, not the worker processes.
+def run_profiled(function, profiler, profile_file):
+    if profiler == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function)
+        finally:
+            profile.dump_stats(profile_file)
+
+    if profiler == 'pyinstrument':
+        import pyinstrument     # pyinstrument is only needed for this profiler
+        profile = pyinstrument.Profiler()
+        profile.start()
+        try:
+            return function()
+        finally:
+            profile.stop()
+            with open(profile_file, 'w') as f:
+                f.write(profile.output_html() if profile_file.endswith('.html') else profile.output_text())
+
+    raise ValueError('Unknown profiler: ' + str(profiler))
@@ -1,40 +1,173 @@
-import pandas as pd
-import spacy
-from spacy.tokenizer import Tokenizer
+import argparse
+import csv
+import gzip
+import os
 import re
 import time
 import sys
 
+from Transitive_closure import read_labels, read_pos_tags
+
+BATCH_SIZE = 256    # number of labels sent through the model at once
+POS_PIPES = ('transformer', 'tok2vec', 'tagger', 'morphologizer', 'attribute_ruler')    # pipes needed for part-of-speech tags
+
+MODEL_NAME = 'en_core_web_trf'
+
 #nlp_general = spacy.load('en_core_web_sm')
 #nlp_biomedical = spacy.load('en_core_sci_lg')
-nlp_bert = spacy.load('en_core_web_trf')
-nlp_bert.tokenizer = Tokenizer(nlp_bert.vocab, token_match=re.compile(r'\S+').match)
+nlp_bert = None     # loaded on first use (see get_model), so that importing this module or finding that no label needs tags is fast
+
+
+# the spaCy model, with a tokenizer splitting labels on spaces only (as the audit does)
+def get_model():
+    global nlp_bert
+    if nlp_bert is None:
+        import spacy    # spaCy is only needed to tag labels
+        from spacy.tokenizer import Tokenizer
+        nlp_bert = spacy.load(MODEL_NAME)
+        nlp_bert.tokenizer = Tokenizer(nlp_bert.vocab, token_match=re.compile(r'\S+').match)
+    return nlp_bert
 
 def get_part_of_speech(x):
-    doc = nlp_bert(x)
+    doc = get_model()(x)
     pos_tag_seq = [token.pos_ for token in doc]
     return ' | '.join(pos_tag_seq)
 
+
+# part-of-speech tags of several labels, streamed through the model in batches (and optionally in several processes)
+# with only the pipes needed for part-of-speech tags enabled
+def get_parts_of_speech(labels, batch_size=BATCH_SIZE, n_process=1):
+    nlp = get_model()
+    disabled_pipes = [pipe for pipe in nlp.pipe_names if pipe not in POS_PIPES]
+    docs = nlp.pipe(labels, batch_size=batch_size, n_process=n_process, disable=disabled_pipes)
+    return [' | '.join(token.pos_ for token in doc) for doc in docs]
+
+
+# identifies the model in the cache, so that tags obtained with another model (or model version) are not reused
+def model_name():
+    nlp = get_model()
+    return nlp.meta['lang'] + '_' + nlp.meta['name'] + '-' + nlp.meta['version']
+
+
+# loads the label -> part-of-speech tags cache (only the entries obtained with the current model)
+def load_pos_cache(cache_file):
+    pos_cache = {}
+    if cache_file is None or not os.path.exists(cache_file):
+        return pos_cache
+
+    model = model_name()
+    with open(cache_file, 'r', newline='') as csvfile:
+        rows = csv.reader(csvfile)
+        for i, row in enumerate(rows):
+            if i==0:    # headers
+                continue
+            if row[0] == model:
+                pos_cache[row[1]] = row[2]
+    return pos_cache
+
+
+# appends new label -> part-of-speech tags entries to the cache
+def update_pos_cache(cache_file, new_entries):
+    if cache_file is None or len(new_entries) == 0:
+        return
+
+    write_headers = not os.path.exists(cache_file)
+    model = model_name()
+    with open(cache_file, 'a', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        if write_headers:
+            csvwriter.writerow(('Model', 'label', 'POS tags'))
+        csvwriter.writerows((model, label, pos_tags) for label, pos_tags in new_entries.items())
+
+
 #Extracts part-of-speech tags and write to csv
-def extract_pos_tags(labels_file, output_pos_tags):
-    labels_df = pd.read_csv(labels_file, delimiter='\t', header=None)
-    labels_df.columns = ['ID', 'label']
+#Only labels missing from the cache (if given) are tagged by the model, e.g. the new or changed labels of a new release
+def extract_pos_tags(labels_file, output_pos_tags, batch_size=BATCH_SIZE, n_process=1, cache_file=None):
+    import pandas as pd     # pandas is only needed to write the part-of-speech file here
+    labels_df = pd.DataFrame(read_labels(labels_file), columns=['ID', 'label'])   # a labels file or an OBO file (see Transitive_closure.read_labels)
     #labels_df['Noun chunks'] = labels_df['label'].apply(get_noun_chunks_general)
-    labels_df['POS tags'] = labels_df['label'].apply(get_part_of_speech)
+
+    pos_cache = load_pos_cache(cache_file)
+    labels_to_tag = list(dict.fromkeys(label for label in labels_df['label'] if label not in pos_cache))
+    print('Tagging {0} of {1} labels ({2} cached)...'.format(len(labels_to_tag), len(labels_df), len(labels_df) - len(labels_to_tag)))
+
+    new_entries = dict(zip(labels_to_tag, get_parts_of_speech(labels_to_tag, batch_size, n_process)))
+    update_pos_cache(cache_file, new_entries)
+    pos_cache.update(new_entries)
+
+    labels_df['POS tags'] = labels_df['label'].map(pos_cache)
     #labels_df['Noun chunks'] = labels_df['label'].apply(lambda x: ' | '.join([chunk.text for chunk in nlp_general(x).noun_chunks]))
     labels_df.to_csv(output_pos_tags)
 
+# tags the labels, from the cache (if given) or else by the model, and adds the new tags to the cache.
+# Returns a dict: key = label, value = part-of-speech tags separated by ' | '
+def tag_labels(labels, batch_size=BATCH_SIZE, n_process=1, cache_file=None):
+    pos_cache = load_pos_cache(cache_file)
+    labels_to_tag = list(dict.fromkeys(label for label in labels if label not in pos_cache))
+    new_entries = dict(zip(labels_to_tag, get_parts_of_speech(labels_to_tag, batch_size, n_process)))
+    update_pos_cache(cache_file, new_entries)
+    pos_cache.update(new_entries)
+    return {label: pos_cache[label] for label in labels}
+
+
+# writes a part-of-speech file in the format of extract_pos_tags (gzip-compressed if its name ends with .gz), under a
+# temporary name renamed when complete. pos_tags: dict, key = concept id, value = (label, list of tags)
+def write_pos_tags_file(pos_tags_file, pos_tags):
+    tmp_file = os.path.join(os.path.dirname(os.path.abspath(pos_tags_file)), '.tmp-' + os.path.basename(pos_tags_file))
+    with (gzip.open(tmp_file, 'wt', newline='') if pos_tags_file.endswith('.gz') else open(tmp_file, 'w', newline='')) as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(('', 'ID', 'label', 'POS tags'))
+        for i, (con_id, (label, tags)) in enumerate(pos_tags.items()):
+            csvwriter.writerow((i, con_id, label, ' | '.join(tags)))
+    os.replace(tmp_file, pos_tags_file)
+
+
+# tags only the concepts of the labels file that have no tags in the part-of-speech file (which need not exist yet), or
+# whose tags were obtained for another label (see Transitive_closure.load_POS_tags_of_concepts), and rewrites the
+# part-of-speech file with the tags of the concepts of the labels file. The model is not loaded if no concept needs tags.
+# Returns the number of concepts tagged.
+def update_pos_tags(labels_file, pos_tags_file, batch_size=BATCH_SIZE, n_process=1, cache_file=None):
+    labels = dict(read_labels(labels_file))
+    old_pos_tags = {}
+    if os.path.exists(pos_tags_file):
+        old_pos_tags = {con_id: (label, tags) for con_id, label, tags in read_pos_tags(pos_tags_file)}
+
+    to_tag = [con_id for con_id, label in labels.items() if con_id not in old_pos_tags or old_pos_tags[con_id][0] != label]
+    stale = sum(1 for con_id in to_tag if con_id in old_pos_tags)
+    print('Tagging {0} concepts ({1} missing, {2} stale)...'.format(len(to_tag), len(to_tag) - stale, stale))
+    if len(to_tag) == 0:
+        return 0
+
+    new_tags = tag_labels([labels[con_id] for con_id in to_tag], batch_size, n_process, cache_file)
+    tagged = set(to_tag)
+    pos_tags = {}
+    for con_id, label in labels.items():
+        pos_tags[con_id] = (label, new_tags[label].split(' | ')) if con_id in tagged else old_pos_tags[con_id]
+    write_pos_tags_file(pos_tags_file, pos_tags)
+    return len(to_tag)
+
+
 def main():
     start_time = time.time()
 
-    labels_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description='Extracts part-of-speech tags of GO concept labels.')
+    parser.add_argument('labels_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='number of labels sent through the model at once')
+    parser.add_argument('--n-process', type=int, default=1, help='number of processes running the model')
+    parser.add_argument('--cache-file', help='csv file caching the tags of labels, so that only new or changed labels are tagged')
+    parser.add_argument('--update', action='store_true',
+                        help='only tag the concepts whose tags are missing from the output file or stale, keeping the other tags')
+    args = parser.parse_args(sys.argv[1:])
 
     #extract_pos_tags('inputs/GO_labels_2020_11_18.txt', 'part_of_speech_tags/part_of_speech_tags_en_core_web_rtf.csv')
-    extract_pos_tags(labels_file, output_file)
+    if args.update:
+        update_pos_tags(args.labels_file, args.output_file, args.batch_size, args.n_process, args.cache_file)
+    else:
+        extract_pos_tags(args.labels_file, args.output_file, args.batch_size, args.n_process, args.cache_file)
 
     end_time = (time.time() - start_time) / 60
     print("Total time: {0:.2f} mins".format(end_time))
 
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,198 @@
+## Reachability index over the typed relations of GO: answers whether a concept is an ancestor of another by a given
+## relation (or by any relation) from the direct relations only, without the ancestor sets of Transitive_closure.
+## The composition rules of Transitive_closure.ancestors_from_parents are a small automaton over the relations of a path
+## (e.g. part_of ancestors are reached by is_a edges, then a part_of edge, then is_a or part_of edges), so the ancestors
+## of a concept by a relation are the concepts reached in an accepting state of the automaton. The index is an interval
+## labeling of the product graph of the concepts and the automaton states: its strongly connected components are
+## numbered in the post-order of a depth-first search, and each component stores the ranges of component numbers it
+## reaches (its own depth-first subtree is one range, the components reached by other edges add ranges).
+
+from array import array
+from bisect import bisect_right
+
+# states of the automaton: the relations of the path followed so far
+START, IS_A, PART_OF, HAS_PART, REGULATES, NEGATIVELY_REGULATES, NEGATIVELY_REGULATES_TWICE, POSITIVELY_REGULATES, \
+    POSITIVELY_THEN_NEGATIVELY_REGULATES, ANY = range(10)
+NUM_STATES = 10
+
+# key = relation, value = dict: key = state, value = state after an edge of the relation
+TRANSITIONS = {
+    'is_a': {START: IS_A, IS_A: IS_A, PART_OF: PART_OF, HAS_PART: HAS_PART, REGULATES: REGULATES,
+             NEGATIVELY_REGULATES: NEGATIVELY_REGULATES, NEGATIVELY_REGULATES_TWICE: NEGATIVELY_REGULATES_TWICE,
+             POSITIVELY_REGULATES: POSITIVELY_REGULATES, POSITIVELY_THEN_NEGATIVELY_REGULATES: POSITIVELY_THEN_NEGATIVELY_REGULATES},
+    'part_of': {START: PART_OF, IS_A: PART_OF, PART_OF: PART_OF},
+    'has_part': {START: HAS_PART, IS_A: HAS_PART, HAS_PART: HAS_PART},
+    'regulates': {START: REGULATES, IS_A: REGULATES, REGULATES: REGULATES},
+    # negatively_regulates ancestors of negatively_regulates ancestors are positively_regulates ancestors
+    'negatively_regulates': {START: NEGATIVELY_REGULATES, IS_A: NEGATIVELY_REGULATES, NEGATIVELY_REGULATES: NEGATIVELY_REGULATES_TWICE,
+                             POSITIVELY_REGULATES: POSITIVELY_THEN_NEGATIVELY_REGULATES,
+                             POSITIVELY_THEN_NEGATIVELY_REGULATES: NEGATIVELY_REGULATES_TWICE},
+    'positively_regulates': {START: POSITIVELY_REGULATES, IS_A: POSITIVELY_REGULATES, POSITIVELY_REGULATES: POSITIVELY_REGULATES},
+}
+
+# key = relation, value = the states in which the concepts reached are ancestors by the relation
+ACCEPTING = {'is_a': (IS_A,), 'part_of': (PART_OF,), 'has_part': (HAS_PART,), 'regulates': (REGULATES,),
+             'negatively_regulates': (NEGATIVELY_REGULATES,), 'positively_regulates': (POSITIVELY_REGULATES, NEGATIVELY_REGULATES_TWICE)}
+ANY_ACCEPTING = frozenset(state for states in ACCEPTING.values() for state in states)  # these states have an edge to ANY
+
+
+# sorted, merged ranges (as a flat array of start, end) covering the given (start, end) ranges
+def merge_ranges(ranges):
+    ranges.sort()
+    merged = array('i')
+    for start, end in ranges:
+        if len(merged) > 0 and start <= merged[-1] + 1:
+            if end > merged[-1]:
+                merged[-1] = end
+        else:
+            merged.append(start)
+            merged.append(end)
+    return merged
+
+
+# concept_dict only needs the direct parents of the concepts (see Transitive_closure.get_ont_with_direct_rels).
+# By default only the ranges of the start states are kept, which answer related(). all_states keeps the ranges of all
+# the states, which is_implied() needs.
+class ReachabilityIndex:
+    def __init__(self, concept_dict, all_states=False):
+        self.ids = list(concept_dict)
+        self.positions = {con_id: i for i, con_id in enumerate(self.ids)}
+        self.all_states = all_states
+        # key = concept position, value = list of (relation, parent positions) of its relations in TRANSITIONS
+        self.parents = [[(rel, [self.positions[parent_id] for parent_id in parent_ids if parent_id in self.positions])
+                         for rel, parent_ids in con.parents.items() if rel in TRANSITIONS] for con in concept_dict.values()]
+        self.build()
+
+    # the product graph nodes (concept position * NUM_STATES + state) following a node
+    def successors(self, node):
+        con, state = divmod(node, NUM_STATES)
+        if state in ANY_ACCEPTING:
+            yield con * NUM_STATES + ANY
+        for rel, parents in self.parents[con]:
+            next_state = TRANSITIONS[rel].get(state)
+            if next_state is not None:
+                for parent in parents:
+                    yield parent * NUM_STATES + next_state
+
+    # Tarjan's algorithm (iteratively) from the start nodes, numbering the components in the order they are completed.
+    # The components completed while a node is on the depth-first search stack are those of its subtree.
+    def build(self):
+        num_nodes = len(self.ids) * NUM_STATES
+        self.component = array('i', [-1]) * num_nodes    # key = node, value = component number (-1 if not reached from a start node)
+        dfs_index = array('i', [-1]) * num_nodes
+        lowlink = array('i', [0]) * num_nodes
+        subtree_start = {}  # key = node on the search stack, value = number of components completed before it was reached
+        stack = []
+        on_stack = bytearray(num_nodes)
+        ranges = []     # key = component number, value = merged ranges of the components it reaches
+        num_visited = 0
+
+        for start in range(START, num_nodes, NUM_STATES):
+            if dfs_index[start] != -1:
+                continue
+            dfs_index[start] = lowlink[start] = num_visited
+            num_visited += 1
+            subtree_start[start] = len(ranges)
+            stack.append(start)
+            on_stack[start] = 1
+            work = [(start, self.successors(start))]
+
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if dfs_index[successor] == -1:
+                        dfs_index[successor] = lowlink[successor] = num_visited
+                        num_visited += 1
+                        subtree_start[successor] = len(ranges)
+                        stack.append(successor)
+                        on_stack[successor] = 1
+                        work.append((successor, self.successors(successor)))
+                        break
+                    elif on_stack[successor]:
+                        lowlink[node] = min(lowlink[node], dfs_index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == dfs_index[node]:
+                        number = len(ranges)
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = 0
+                            self.component[member] = number
+                            members.append(member)
+                            if member == node:
+                                break
+                        component_ranges = [(subtree_start[node], number)]
+                        reached = set()
+                        for member in members:
+                            del subtree_start[member]
+                            for successor in self.successors(member):
+                                successor_component = self.component[successor]
+                                if successor_component != number and successor_component not in reached:
+                                    reached.add(successor_component)
+                                    successor_ranges = ranges[successor_component]
+                                    component_ranges.extend(zip(successor_ranges[::2], successor_ranges[1::2]))
+                        ranges.append(merge_ranges(component_ranges))
+
+        # the kept ranges are packed in flat arrays: the ranges of row k are starts[offsets[k]:offsets[k + 1]] (and ends)
+        self.row = array('i', [-1]) * len(ranges)   # key = component number, value = row of its ranges (-1 if not kept)
+        self.offsets = array('q', [0])
+        self.starts, self.ends = array('i'), array('i')
+        if self.all_states:
+            kept = range(len(ranges))
+        else:
+            kept = [self.component[start] for start in range(START, num_nodes, NUM_STATES)]
+        for number in kept:
+            if self.row[number] == -1:
+                self.row[number] = len(self.offsets) - 1
+                self.starts.extend(ranges[number][::2])
+                self.ends.extend(ranges[number][1::2])
+                self.offsets.append(len(self.starts))
+
+    # whether the product graph node target is reached from the node source (whose ranges must be kept)
+    def reaches(self, source, target):
+        target_component = self.component[target]
+        if target_component == -1:
+            return False
+        row = self.row[self.component[source]]
+        lo, hi = self.offsets[row], self.offsets[row + 1]
+        k = bisect_right(self.starts, target_component, lo, hi) - 1
+        return k >= lo and self.ends[k] >= target_component
+
+    # whether ancestor_id is an ancestor of con_id by rel (by any relation if rel is None)
+    def related(self, con_id, ancestor_id, rel=None):
+        con, ancestor = self.positions.get(con_id), self.positions.get(ancestor_id)
+        if con is None or ancestor is None:
+            return False
+        source = con * NUM_STATES + START
+        if rel is None:
+            return self.reaches(source, ancestor * NUM_STATES + ANY)
+        return any(self.reaches(source, ancestor * NUM_STATES + state) for state in ACCEPTING[rel])
+
+    # whether the relation (con_id, rel, parent_id) is implied by the other relations of con_id (needs all_states).
+    # Returns None when a path implying it may go through con_id again (con_id is on a cycle), so that the relation
+    # itself may be used; Concept.is_implied_without_parent answers those cases.
+    def is_implied(self, con_id, rel, parent_id):
+        con, parent = self.positions[con_id], self.positions[parent_id]
+        accepting = ACCEPTING[rel]
+        targets = [parent * NUM_STATES + state for state in accepting]
+        con_nodes = [con * NUM_STATES + state for state in range(NUM_STATES)]
+        for parent_rel, parents in self.parents[con]:
+            state = TRANSITIONS[parent_rel][START]
+            for other_parent in parents:
+                if parent_rel == rel and other_parent == parent:    # the relation left out
+                    continue
+                if other_parent == parent and state in accepting:
+                    return True
+                source = other_parent * NUM_STATES + state
+                if any(self.reaches(source, target) for target in targets):
+                    if any(self.reaches(source, con_node) for con_node in con_nodes):
+                        return None
+                    return True
+        return False
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.component, self.row, self.offsets, self.starts, self.ends))
@@ -1,10 +1,14 @@
 ## Transitive closure considering the combination of different types of relations in GO
 
 import csv
+import gzip
 
 concept_dict = None #key = con id, value = Concept instance
 
 class Concept:
+    __slots__ = ('id', 'label', 'id_label', 'parents', 'ancestors', 'all_ancestors', 'root', 'noun_chunks', 'sequence_of_words',
+                 'set_of_words', 'pos_tags', 'word_ids', 'word_id_set', 'pos_ids', 'pos_signature')
+
     def __init__(self, id, label):
         self.id = id
         self.label = label
@@ -17,6 +21,10 @@ class Concept:
         self.sequence_of_words = None
         self.set_of_words = None
         self.pos_tags = None # each element here corresponds to an element of sequence_of_words
+        self.word_ids = None    # sequence_of_words as token ids (see suggest_inconsistencies.encode_concept)
+        self.word_id_set = None
+        self.pos_ids = None # pos_tags as token ids
+        self.pos_signature = None   # id of pos_ids (see suggest_inconsistencies.PatternPrefilter)
 
 
     def __hash__(self):
@@ -42,122 +50,35 @@ class Concept:
         return self.set_of_words
 
 
-    def is_a_ancestors(self):
-        if 'is_a' in self.ancestors:
-            return self.ancestors['is_a']
+    # ancestors by rel. The closure of rel is computed for the whole ontology the first time it is needed (see close_relation)
+    def relation_ancestors(self, rel):
+        if rel not in self.ancestors:
+            close_relation(concept_dict, rel)
+        return self.ancestors[rel]
 
-        isa_ancs = set()
-        if 'is_a' in self.parents:
-            isa_ancs.update(self.parents['is_a'])
-            for isa_anc in self.parents['is_a']:
-                isa_ancs.update(concept_dict[isa_anc].is_a_ancestors())
 
-        self.ancestors['is_a'] = isa_ancs
-        return self.ancestors['is_a']
+    def is_a_ancestors(self):
+        return self.relation_ancestors('is_a')
 
 
     def part_of_ancestors(self):
-        if 'part_of' in self.ancestors:   #if ancestors has been previously computed
-            return self.ancestors['part_of']
-
-        partof_ancs = set()
-
-        if 'is_a' in self.parents:
-            for isa_anc in self.parents['is_a']:
-                partof_ancs.update(concept_dict[isa_anc].part_of_ancestors())   # part-of ancestors of is-a ancestors
-
-        if 'part_of' in self.parents:
-            partof_ancs.update(self.parents['part_of'])  # part of parents
-            for partof_anc in self.parents['part_of']:
-                partof_ancs.update(concept_dict[partof_anc].part_of_ancestors())   #partof ancestors of partof parents
-                partof_ancs.update(concept_dict[partof_anc].is_a_ancestors())  # isa ancestors of partof parents
-
-        self.ancestors['part_of'] = partof_ancs
-        return partof_ancs
+        return self.relation_ancestors('part_of')
 
 
     def has_part_ancestors(self):
-        if 'has_part' in self.ancestors:   #if ancestors has been previously computed
-            return self.ancestors['has_part']
+        return self.relation_ancestors('has_part')
 
-        haspart_ancs = set()
-
-        if 'is_a' in self.parents:
-            for isa_anc in self.parents['is_a']:
-                haspart_ancs.update(concept_dict[isa_anc].has_part_ancestors())
-
-        if 'has_part' in self.parents:
-            haspart_ancs.update(self.parents['has_part'])  # haspart of parents
-            for haspart_anc in self.parents['has_part']:
-                haspart_ancs.update(concept_dict[haspart_anc].has_part_ancestors())   #haspart ancestors of haspart parents
-                haspart_ancs.update(concept_dict[haspart_anc].is_a_ancestors())   #isa ancestors of haspart parents
-
-        self.ancestors['has_part'] = haspart_ancs
-        return haspart_ancs
 
     def regulates_ancestors(self):
-        if 'regulates' in self.ancestors:   #if ancestors has been previously computed
-            return self.ancestors['regulates']
-
-        regulates_ancs = set()
-
-        if 'is_a' in self.parents:
-            for isa_anc in self.parents['is_a']:
-                regulates_ancs.update(concept_dict[isa_anc].regulates_ancestors())
-
-        if 'regulates' in self.parents:
-            regulates_ancs.update(self.parents['regulates'])  # regulates of parents
-            for regulates_anc in self.parents['regulates']:
-                regulates_ancs.update(concept_dict[regulates_anc].regulates_ancestors())   # regulates ancestors of regulates parents
-                regulates_ancs.update(concept_dict[regulates_anc].is_a_ancestors())  # isa ancestors of regulates parents
-
-        self.ancestors['regulates'] = regulates_ancs
-        return regulates_ancs
+        return self.relation_ancestors('regulates')
 
 
     def negatively_regulates_ancestors(self):
-        if 'negatively_regulates' in self.ancestors:   #if ancestors has been previously computed
-            return self.ancestors['negatively_regulates']
-
-        negatively_regulates_ancs = set()
-
-        if 'is_a' in self.parents:
-            for isa_anc in self.parents['is_a']:
-                negatively_regulates_ancs.update(concept_dict[isa_anc].negatively_regulates_ancestors())        # negatively_regulates ancestors of is_a parents
-
-        if 'negatively_regulates' in self.parents:
-            negatively_regulates_ancs.update(self.parents['negatively_regulates'])  # direct relation
-            for neg_regulates_anc in self.parents['negatively_regulates']:
-                negatively_regulates_ancs.update(concept_dict[neg_regulates_anc].is_a_ancestors())  # isa ancestors of negatively_regulates parents
-
-        self.ancestors['negatively_regulates'] = negatively_regulates_ancs
-        return negatively_regulates_ancs
+        return self.relation_ancestors('negatively_regulates')
 
 
     def positively_regulates_ancestors(self):
-        if 'positively_regulates' in self.ancestors:   #if ancestors has been previously computed
-            return self.ancestors['positively_regulates']
-
-        positively_regulates_ancs = set()
-
-        if 'is_a' in self.parents:
-            for isa_anc in self.parents['is_a']:
-                positively_regulates_ancs.update(concept_dict[isa_anc].positively_regulates_ancestors())        # positively_regulates ancestors of is-a parents
-
-        if 'positively_regulates' in self.parents:
-            positively_regulates_ancs.update(self.parents['positively_regulates'])  # direct relation
-            for pos_regulates_anc in self.parents['positively_regulates']:
-                positively_regulates_ancs.update(concept_dict[pos_regulates_anc].positively_regulates_ancestors())  # positively_regulates ancestors of positively_regulates parents
-                positively_regulates_ancs.update(concept_dict[pos_regulates_anc].is_a_ancestors())  # isa ancestors of positively_regulates parents
-
-        neg_reg_ancs = self.negatively_regulates_ancestors()
-
-        for neg_reg_anc in neg_reg_ancs:
-            positively_regulates_ancs.update(concept_dict[neg_reg_anc].negatively_regulates_ancestors())    # negatively_regulates ancestors of negatively_regulates parents. Based on OWL file and relation ontology, this property chain holds
-
-        self.ancestors['positively_regulates'] = positively_regulates_ancs
-
-        return positively_regulates_ancs
+        return self.relation_ancestors('positively_regulates')
 
 
     def find_all_ancs_closure(self):
@@ -172,66 +93,411 @@ class Concept:
         for rel, ancs in self.ancestors.items():
             self.all_ancestors.update(ancs)
 
+    # checks whether the relation (of type rel) to parent_id is implied by the other relations in the graph when the direct
+    # relation to parent_id is left out. If this concept is not on a cycle, the ancestors of its parents do not depend on
+    # this relation, so only this concept's ancestors are recomputed. Otherwise the closure of rel is recomputed.
+    def is_implied_without_parent(self, rel, parent_id):
+        self.find_all_ancs_closure()
+        on_cycle = any(self.id in concept_dict[dep].ancestors['is_a'] or self.id in concept_dict[dep].ancestors[rel]
+                       for dep in closure_dependencies(self, rel))
+
+        self.parents[rel].discard(parent_id)
+        try:
+            if not on_cycle:
+                return parent_id in ancestors_from_parents(self, rel)
+
+            saved_ancestors = {con_id: con.ancestors[rel] for con_id, con in concept_dict.items()}
+            try:
+                close_relation(concept_dict, rel)
+                return parent_id in self.ancestors[rel]
+            finally:
+                for con_id, ancs in saved_ancestors.items():
+                    concept_dict[con_id].ancestors[rel] = ancs
+        finally:
+            self.parents[rel].add(parent_id)
+
     def find_root(self):
         if self.root is not None:
             return self.root
-        elif len(self.is_a_ancestors()) != 0:   # this concept has ancestors: which means it is not the root
-            anc = next(iter(self.ancestors['is_a']))
-            self.root = concept_dict[anc].find_root()
-            return self.root
+
+        path = []   # concepts visited by following is_a ancestors up to a root
+        con = self
+        while con.root is None and len(con.is_a_ancestors()) != 0 and con not in path:  # con has ancestors: which means it is not the root
+            path.append(con)
+            con = concept_dict[next(iter(con.ancestors['is_a']))]
+
+        if con.root is None:    # con is a root (or on an is_a cycle above all its descendants)
+            con.root = con.id
+        for path_con in path:
+            path_con.root = con.root
+        return self.root
+
+
+# relations for which the closure is computed
+CLOSURE_RELATIONS = ('is_a', 'part_of', 'has_part', 'regulates', 'negatively_regulates', 'positively_regulates')
+
+
+# ids of the direct parents whose rel ancestors are needed to compute the rel ancestors of con
+def closure_dependencies(con, rel):
+    dependencies = list(con.parents.get('is_a', ()))
+    if rel != 'is_a' and rel != 'negatively_regulates':   # negatively_regulates ancestors of negatively_regulates parents are not inherited
+        dependencies.extend(con.parents.get(rel, ()))
+    return dependencies
+
+
+# rel ancestors of con obtained from its direct parents, given the rel ancestors of those parents. Parents in
+# cycle_members (the strongly connected component of con, whose ancestors are being computed) are skipped.
+# The is_a ancestors of every concept (and, for positively_regulates, the negatively_regulates ancestors) must be known.
+def ancestors_from_parents(con, rel, cycle_members=()):
+    ancs = set()
+
+    for isa_parent in con.parents.get('is_a', ()):
+        if rel == 'is_a':
+            ancs.add(isa_parent)
+        if isa_parent not in cycle_members:
+            ancs.update(concept_dict[isa_parent].ancestors[rel])   # rel ancestors of is-a parents
+
+    if rel != 'is_a':
+        for rel_parent in con.parents.get(rel, ()):
+            ancs.add(rel_parent)    # direct relation
+            ancs.update(concept_dict[rel_parent].ancestors['is_a'])    # isa ancestors of rel parents
+            if rel != 'negatively_regulates' and rel_parent not in cycle_members:
+                ancs.update(concept_dict[rel_parent].ancestors[rel])   # rel ancestors of rel parents
+
+    if rel == 'positively_regulates':
+        for neg_reg_anc in con.ancestors['negatively_regulates']:
+            ancs.update(concept_dict[neg_reg_anc].ancestors['negatively_regulates'])  # negatively_regulates ancestors of negatively_regulates parents. Based on OWL file and relation ontology, this property chain holds
+
+    return ancs
+
+
+# strongly connected components of the graph given by dependencies(node), computed iteratively (Tarjan's algorithm).
+# A component is listed after all components it depends on.
+def strongly_connected_components(nodes, dependencies):
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for start in nodes:
+        if start in index:
+            continue
+        index[start] = lowlink[start] = len(index)
+        stack.append(start)
+        on_stack.add(start)
+        work = [(start, iter(dependencies(start)))]
+
+        while work:
+            node, deps = work[-1]
+            for dep in deps:
+                if dep not in index:
+                    index[dep] = lowlink[dep] = len(index)
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(dependencies(dep))))
+                    break
+                elif dep in on_stack:
+                    lowlink[node] = min(lowlink[node], index[dep])
+            else:
+                work.pop()
+                if work:
+                    lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+# the strongly connected components of the closure dependencies of rel, in dependency order
+def relation_components(con_dict, rel):
+    return strongly_connected_components(con_dict.keys(), lambda con_id: closure_dependencies(con_dict[con_id], rel))
+
+
+# the components of every relation. negatively_regulates ancestors only depend on is_a parents, like is_a ancestors.
+def closure_components(con_dict):
+    components = {}
+    for rel in CLOSURE_RELATIONS:
+        if rel == 'negatively_regulates':
+            components[rel] = components['is_a']
         else:
-            self.root = self.id
-            return self.root
+            components[rel] = relation_components(con_dict, rel)
+    return components
+
+
+def is_cycle(con_dict, component, rel):
+    return len(component) > 1 or component[0] in closure_dependencies(con_dict[component[0]], rel)
+
+
+# cycles in the relations, which make concepts ancestors of themselves. key = rel, value = list of sorted lists of concept ids
+def find_cycles(con_dict, components=None):
+    if components is None:
+        components = closure_components(con_dict)
+
+    cycles = {}
+    for rel in CLOSURE_RELATIONS:
+        rel_cycles = [sorted(component) for component in components[rel] if is_cycle(con_dict, component, rel)]
+        if len(rel_cycles) > 0:
+            cycles[rel] = rel_cycles
+    return cycles
+
+
+# the (child id, rel, parent id) edges that lie on a cycle of the closure dependencies
+def edges_on_cycles(con_dict, edges, components=None):
+    if components is None:
+        components = closure_components(con_dict)
+
+    cycle_of = {}   # key = (rel, concept id), value = index of the cycle of the concept
+    for rel in CLOSURE_RELATIONS:
+        for i, component in enumerate(components[rel]):
+            if is_cycle(con_dict, component, rel):
+                for con_id in component:
+                    cycle_of[(rel, con_id)] = i
+
+    cyclic_edges = set()
+    for child_id, rel, parent_id in edges:
+        if rel == 'is_a':
+            dependent_rels = CLOSURE_RELATIONS    # is_a parents are dependencies of every relation
+        elif rel in CLOSURE_RELATIONS and rel != 'negatively_regulates':
+            dependent_rels = (rel,)
+        else:
+            dependent_rels = ()
+        for dependent_rel in dependent_rels:
+            child_cycle = cycle_of.get((dependent_rel, child_id))
+            if child_cycle is not None and child_cycle == cycle_of.get((dependent_rel, parent_id)):
+                cyclic_edges.add((child_id, rel, parent_id))
+                break
+
+    return cyclic_edges
+
+
+# computes the rel ancestors of every concept in one pass over the strongly connected components of the closure dependencies,
+# parents before children. The concepts of a component (a cycle) all get the same ancestors, which include themselves.
+def close_relation(con_dict, rel, components=None):
+    if rel != 'is_a' and any('is_a' not in con.ancestors for con in con_dict.values()):
+        close_relation(con_dict, 'is_a')
+    if rel == 'positively_regulates' and any('negatively_regulates' not in con.ancestors for con in con_dict.values()):
+        close_relation(con_dict, 'negatively_regulates')
+
+    if components is None:
+        components = relation_components(con_dict, rel)
+
+    for component in components:
+        if not is_cycle(con_dict, component, rel):
+            con = con_dict[component[0]]
+            con.ancestors[rel] = ancestors_from_parents(con, rel)
+            continue
+
+        cycle_members = set(component)
+        ancs = set()
+        for con_id in component:
+            ancs.update(ancestors_from_parents(con_dict[con_id], rel, cycle_members))
+        if rel == 'is_a' or any(cycle_members.intersection(con_dict[con_id].parents.get(rel, ())) for con_id in component):
+            ancs.update(cycle_members)  # the members of the cycle are connected to each other by rel
+        for con_id in component:
+            con_dict[con_id].ancestors[rel] = set(ancs)
+
+
+# prints the cycles found by find_cycles
+def report_cycles(cycles):
+    for rel, rel_cycles in cycles.items():
+        for cycle in rel_cycles:
+            print('Cycle in ' + rel + ' closure: ' + ', '.join(cycle))
+
+
+## Input files are streamed line by line, and may be gzip-compressed (names ending with .gz). Labels and relations may
+## also be read from an OBO file of GO (e.g. go-basic.obo, names ending with .obo or .obo.gz) instead of the
+## tab-separated files: the names, is_a tags and relationship tags of its non-obsolete terms.
+
+OBO_EXTENSIONS = ('.obo', '.obo.gz')
+
+
+def open_input(input_file):
+    if input_file.endswith('.gz'):
+        return gzip.open(input_file, 'rt')
+    return open(input_file, 'r')
+
+
+def is_obo(input_file):
+    return input_file.endswith(OBO_EXTENSIONS)
+
+
+# streams the non-obsolete [Term] stanzas of an OBO file as (id, name, list of (relation, parent id))
+def read_obo_terms(obo_file):
+    con_id, name, relations, obsolete = None, None, [], False
+    in_term = False     # the header and other stanzas ([Typedef], ...) are skipped
+    with open_input(obo_file) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('['):    # a new stanza
+                if con_id is not None and not obsolete:
+                    yield con_id, name, relations
+                con_id, name, relations, obsolete = None, None, [], False
+                in_term = line == '[Term]'
+                continue
+            if not in_term:
+                continue
+            tag, _, value = line.partition(': ')
+            if tag == 'id':
+                con_id = value.strip()
+            elif tag == 'name':
+                name = value.strip()
+            elif tag == 'is_obsolete':
+                obsolete = value.strip() == 'true'
+            elif tag == 'is_a':
+                relations.append(('is_a', value.split()[0]))    # without the trailing '! label' comment
+            elif tag == 'relationship':
+                tokens = value.split()
+                relations.append((tokens[0], tokens[1]))
+    if con_id is not None and not obsolete:
+        yield con_id, name, relations
+
+
+# streams (id, label) from a labels file or an OBO file
+def read_labels(id_label_file):
+    if is_obo(id_label_file):
+        for con_id, name, _ in read_obo_terms(id_label_file):
+            yield con_id, name
+        return
+    with open_input(id_label_file) as txtfile:
+        for line in txtfile:
+            tokens = line.rstrip("\n").split("\t")
+            yield tokens[0], tokens[1]
+
+
+# streams (child id, relation, parent id) from a relations file or an OBO file
+def read_relations(all_relations_file):
+    if is_obo(all_relations_file):
+        for con_id, _, relations in read_obo_terms(all_relations_file):
+            for rel, parent_id in relations:
+                yield con_id, rel, parent_id
+        return
+    with open_input(all_relations_file) as txtfile:
+        for line in txtfile:
+            tokens = line.rstrip("\n").split("\t")
+            yield tokens[0], tokens[1], tokens[2]
+
+
+# streams (id, label, part-of-speech tags) from a part-of-speech file
+def read_pos_tags(post_tags_file):
+    with open_input(post_tags_file) as csvfile:
+        rows = csv.reader(csvfile)
+        next(rows, None)    # headers
+        for row in rows:
+            yield row[1], row[2], row[3].split(' | ')
+
+
+# prints how many entries of an input file referred to concepts missing from the labels (and were skipped)
+def report_unknown_concepts(input_file, num_unknown, example):
+    if num_unknown > 0:
+        print('Skipped {0} entries of {1} with unknown GO ids (e.g. {2})'.format(num_unknown, input_file, example))
 
 
 #load concepts as Concept class instances
 def load_concepts(id_label_file):
     global concept_dict
     concept_dict = {}
-    with open(id_label_file, 'r') as txtfile:
-        lines = txtfile.readlines()
-        for line in lines:
-            line = line.rstrip("\n")
-            tokens = line.split("\t")
-            concept_dict[tokens[0]] = Concept(tokens[0], tokens[1])
+    for con_id, label in read_labels(id_label_file):
+        concept_dict[con_id] = Concept(con_id, label)
 
 
-# load direct parent by different relations into class instances created by load_concepts() method
+# load direct parent by different relations into class instances created by load_concepts() method.
+# Relations of concepts that have no label are skipped.
 def load_parents(all_relations_file):
-    with open(all_relations_file, 'r') as txtfile:
-        lines = txtfile.readlines()
-        for line in lines:
-            line = line.rstrip("\n")
-            tokens = line.split("\t")
-            if tokens[1] not in concept_dict[tokens[0]].parents:
-                parents = set()
-            else:
-                parents = concept_dict[tokens[0]].parents[tokens[1]]
-            parents.add(tokens[2])
-            concept_dict[tokens[0]].parents[tokens[1]] = parents
-
-
-# loading part of speech tags from a file
+    num_unknown, example = 0, None
+    for con_id, rel, parent_id in read_relations(all_relations_file):
+        if con_id not in concept_dict or parent_id not in concept_dict:
+            num_unknown += 1
+            example = example or con_id + ' ' + rel + ' ' + parent_id
+            continue
+        parents = concept_dict[con_id].parents
+        if rel not in parents:
+            parents[rel] = set()
+        parents[rel].add(parent_id)
+    report_unknown_concepts(all_relations_file, num_unknown, example)
+
+
+# loads the labels and the relations of an OBO file in one pass. Parents may be defined after their children in the
+# file, so the relations to concepts that are not in the file (or obsolete) are only removed at the end.
+def load_obo(obo_file):
+    global concept_dict
+    concept_dict = {}
+    for con_id, name, relations in read_obo_terms(obo_file):
+        con = Concept(con_id, name)
+        for rel, parent_id in relations:
+            if rel not in con.parents:
+                con.parents[rel] = set()
+            con.parents[rel].add(parent_id)
+        concept_dict[con_id] = con
+
+    num_unknown, example = 0, None
+    for con in concept_dict.values():
+        for rel, parents in con.parents.items():
+            unknown = [parent_id for parent_id in parents if parent_id not in concept_dict]
+            if unknown:
+                num_unknown += len(unknown)
+                example = example or con.id + ' ' + rel + ' ' + unknown[0]
+                parents.difference_update(unknown)
+    report_unknown_concepts(obo_file, num_unknown, example)
+
+
+# loads the concepts and their direct relations, in one pass if both are read from the same OBO file
+def load_ontology(id_label_file, all_relations_file):
+    if is_obo(id_label_file) and all_relations_file == id_label_file:
+        load_obo(id_label_file)
+    else:
+        load_concepts(id_label_file)
+        load_parents(all_relations_file)
+
+
+# loading part of speech tags from a file. Tags obtained for another label than the concept's (e.g. a label changed
+# in a new release) are stale and are not loaded; Part_of_speech_tagging.update_pos_tags tags them again.
 def load_POS_tags_of_concepts(post_tags_file):
-    with open(post_tags_file, 'r') as csvfile:
-        rows = csv.reader(csvfile)
-        for i, row in enumerate(rows):
-            if i==0:    # headers
-                continue
-            #print(row[1])
-            tokens = row[3].split(' | ')
-            concept_dict[row[1]].pos_tags = tokens
-
-
-def compute_closure(labels_file, all_rels_file, pos_tags_file):
-    load_concepts(labels_file)
-    load_parents(all_rels_file)
+    num_unknown, example = 0, None
+    num_stale = 0
+    for con_id, label, pos_tags in read_pos_tags(post_tags_file):
+        if con_id not in concept_dict:
+            num_unknown += 1
+            example = example or con_id
+            continue
+        if label != concept_dict[con_id].label:
+            num_stale += 1
+            continue
+        concept_dict[con_id].pos_tags = pos_tags
+    report_unknown_concepts(post_tags_file, num_unknown, example)
+    num_missing = sum(1 for con in concept_dict.values() if con.pos_tags is None) - num_stale
+    if num_stale > 0 or num_missing > 0:
+        print('{0} concepts have no part-of-speech tags and {1} have stale tags in {2} (see Part_of_speech_tagging.update_pos_tags)'.format(num_missing, num_stale, post_tags_file))
+
+
+# if snapshot_dir is given, the closure is loaded from the snapshot in that directory (see Closure_snapshot), which is
+# rebuilt first when it is missing or was built from other input files.
+# all_ancestors is left empty if find_all_ancestors is False (e.g. when a Reachability_index answers the ancestry checks).
+def compute_closure(labels_file, all_rels_file, pos_tags_file, snapshot_dir=None, find_all_ancestors=True):
+    if snapshot_dir is not None:
+        import Closure_snapshot   # NumPy is only needed for snapshots
+        return Closure_snapshot.load_or_build(snapshot_dir, labels_file, all_rels_file, pos_tags_file)
+
+    load_ontology(labels_file, all_rels_file)
     load_POS_tags_of_concepts(pos_tags_file)
 
+    components = closure_components(concept_dict)
+    report_cycles(find_cycles(concept_dict, components))
+    for rel in CLOSURE_RELATIONS:
+        close_relation(concept_dict, rel, components[rel])
+
     roots = set()
     for con in concept_dict.values():
         con.find_all_ancs_closure()
-        con.find_all_ancs()
+        if find_all_ancestors:
+            con.find_all_ancs()
         rt = con.find_root()
         roots.add(rt)
     print(roots)
@@ -240,8 +506,7 @@ def compute_closure(labels_file, all_rels_file, pos_tags_file):
 
 
 def get_ont_with_direct_rels(labels_file, all_rels_file, pos_tags_file):
-    load_concepts(labels_file)
-    load_parents(all_rels_file)
+    load_ontology(labels_file, all_rels_file)
     load_POS_tags_of_concepts(pos_tags_file)
 
     return concept_dict
\ No newline at end of file
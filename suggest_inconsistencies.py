@@ -1,283 +1,1251 @@
-from Transitive_closure import compute_closure, get_ont_with_direct_rels
-from collections import defaultdict
+from Transitive_closure import compute_closure, get_ont_with_direct_rels, closure_components, find_cycles, report_cycles, edges_on_cycles
+from collections import Counter, defaultdict
+from itertools import combinations
+import argparse
 import csv
 import copy
+import gzip
+import multiprocessing
+import os
+import random
 import time
-import spacy
+import Instrumentation
 import sys
 
-from tqdm import tqdm, trange
+from tqdm import tqdm
 
 closure_concept_dict = {}  #key = con id, value = Concept instance (which includes ancestors)
-
-
-# class to represent existing relations, non-relations or missing relations
+reachability_index = None   # if set (see --reachability-index), a Reachability_index.ReachabilityIndex answering the ancestry checks of the search instead of all_ancestors
+
+PATTERN_SEPARATOR = ' ******** '    # separates the descendant side and the ancestor side of a lexical pattern
+DIFFERENCE_PATTERN_SEPARATOR = ' -------- '   # separates the two difference patterns compared for a replacement
+
+SEARCH_MODES = ('index', 'pattern', 'pairwise')    # see search_inconsistencies()
+CLOSURE_BACKENDS = ('sets', 'compact')  # see Transitive_closure.compute_closure() and Compact_closure.compute_compact_closure()
+DIFFERENCE_TABLES = ('full', 'sampled', 'counted')  # see generate_difference_patterns()
+EXAMPLE_PAIRS = 3   # number of example relation-pairs kept per difference pattern and relation by the 'sampled' and 'counted' tables
+FREQUENT_TOKEN_THRESHOLD = 200  # words in more labels than this are not enumerated through their posting lists
+MAX_FREQUENT_SUBSET_WORDS = 16  # above this many frequent words in a label, their posting lists are enumerated instead
+
+SUGGESTION_HEADERS = ('Descendant', 'Relation', 'Ancestor', 'Pattern', 'num existing relations with pattern',
+                      'Example existing relations with pattern', 'Difference pattern',
+                      'num examples for replacement', 'Replacement example 1', 'Replacement example 2')
+OUTPUT_HEADERS = ('Descendant', 'Relation', 'Ancestor', 'Pattern', 'num existing relations with pattern',
+                  'Example existing relations with pattern', 'Replacement pattern',
+                  'num examples for replacement', 'Replacement example 1', 'Replacement example 2')
+COUNT_COLUMNS = (4, 7)  # columns of the output rows holding numbers, stored as integers in Parquet files
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet'}  # key = output format, value = file extension
+
+CONCEPT_SHARD_SIZE = 256    # number of descendant concepts in a shard of the search
+PATTERN_SHARD_SIZE = 2048   # number of lexical patterns in a shard of the search or of the difference pattern generation
+
+# labels and part-of-speech tags are encoded once per concept as tuples of token ids (see encode_concept). A lexical or
+# difference pattern is a tuple of token ids: the words of the descendant side, POS_MARKER, its part-of-speech tags,
+# SIDE_MARKER, then the ancestor side in the same layout. Patterns are interned to dense integer ids, and the pattern
+# strings are only produced when inconsistencies are written (see inconsistency_row).
+token_ids = {}  # key = word, part-of-speech tag or replacement token (e.g. ##E0##), value = id
+token_strings = []  # key = id, value = token
+shared_word_positions = {}  # key = id of a ##E<position>## token, value = position
+placeholder_ids = {}  # key = (token prefix, position), value = id of the replacement token
+POS_MARKER = -1 # separates the words of a pattern side from its part-of-speech tags
+SIDE_MARKER = -2    # separates the descendant side and the ancestor side of a pattern
+
+pattern_ids = {}  # key = lexical pattern tuple, value = id
+pattern_keys = []  # key = id, value = lexical pattern tuple
+
+# difference patterns of single concept-pairs are interned to dense integer ids. The difference pattern table is keyed
+# by the ids of its two difference patterns, so lookups compare integers instead of concatenating and hashing long strings.
+difference_pattern_ids = {}  # key = difference pattern tuple, value = id
+difference_pattern_keys = []  # key = id, value = difference pattern tuple
+
+# sequences of part-of-speech tags (as token ids) are interned to dense integer ids, the part-of-speech signatures of
+# concepts, which PatternPrefilter compares instead of the tag sequences
+pos_signature_ids = {}  # key = tuple of part-of-speech tag ids, value = id
+
+# canonical Relation objects, one per (relation, child, parent) edge, shared by the lexical and difference pattern tables
+# (see canonical_relation). Keys and values are the same objects, so the table only costs its own slots.
+relation_objects = {}
+
+# state read by the shard functions. It is set before a process pool is forked, so that the workers share the closure,
+# the pattern tables and the indexes copy-on-write instead of receiving them with every shard.
+shared_state = {}
+
+
+# class to represent existing relations, non-relations or missing relations. Relations of the pattern tables are
+# canonical (see canonical_relation), so the tables share one object per edge.
 class Relation:
+    __slots__ = ('rel_string', 'child', 'parent', 'difference_pattern_id', 'hash_value')
+
     def __init__(self, rel_string, child, parent):
         self.rel_string = rel_string
         self.child = child  # a concept object
         self.parent = parent # a concept object
         #self.pattern = None # used to store pattern that was used to obtain missing relation
+        self.difference_pattern_id = None   # id of the difference pattern of child and parent, computed once
+        self.hash_value = hash((rel_string, child.id, parent.id))
 
     def __hash__(self):
-        return hash((self.rel_string, self.child.id, self.parent.id))
+        return self.hash_value
 
     def __eq__(self, other):
         """Overrides the default implementation"""
+        if self is other:
+            return True
         if isinstance(other, Relation):
-            return self.rel_string == other.rel_string and self.child == other.child and self.parent == other.parent
+            return (self.hash_value == other.hash_value and self.rel_string == other.rel_string
+                    and self.child.id == other.child.id and self.parent.id == other.parent.id)
         return False
 
     def __str__(self):
         return self.child.id_label + ' ** ' + self.rel_string + ' ** ' + self.parent.id_label
 
+    def get_difference_pattern_id(self):
+        if self.difference_pattern_id is None:
+            self.difference_pattern_id = intern_difference_pattern(difference_pattern(self.child, self.parent))
+        return self.difference_pattern_id
+
+
+# the canonical Relation object of an edge. A relation whose concepts were replaced (e.g. by those of a new release in
+# an incremental audit) replaces the canonical object.
+def canonical_relation(rel_string, child, parent):
+    rel_obj = Relation(rel_string, child, parent)
+    canonical = relation_objects.setdefault(rel_obj, rel_obj)
+    if canonical.child is not child or canonical.parent is not parent:
+        del relation_objects[canonical]
+        relation_objects[rel_obj] = canonical = rel_obj
+    return canonical
+
 
 # class to represent a lexical pattern
 class Pattern:
-    def __init__(self, pattern_string):
-        self.pattern_string = pattern_string
+    __slots__ = ('pattern_id', 'exhibiting_relations')
+
+    def __init__(self, pattern_id):
+        self.pattern_id = pattern_id
         self.exhibiting_relations = {}  # key =rel_string, value = set of Relation objects
 
     def __hash__(self):
-        return hash(self.pattern_string)
+        return hash(self.pattern_id)
 
     def __eq__(self, other):
         """Overrides the default implementation"""
         if isinstance(other, Pattern):
-            return self.pattern_string == other.pattern_string
+            return self.pattern_id == other.pattern_id
         return False
 
+    @property
+    def pattern_string(self):
+        return pattern_string(self.pattern_id)
+
     def add_exhibiting_relation(self, rel_string, child, parent): # child and parent should be Concept objects
         if rel_string not in self.exhibiting_relations:
             self.exhibiting_relations[rel_string] = set()
-        self.exhibiting_relations[rel_string].add(Relation(rel_string, child, parent))
+        self.exhibiting_relations[rel_string].add(canonical_relation(rel_string, child, parent))
 
 
 # class to represent a difference pattern
 class DifferencePattern:
-    def __init__(self, difference_pattern_string):
-        self.difference_pattern_string = difference_pattern_string
+    __slots__ = ('difference_key', 'exhibiting_relation_pairs')
+
+    def __init__(self, difference_key):
+        self.difference_key = difference_key    # (difference pattern id, difference pattern id)
         self.exhibiting_relation_pairs = {}  # key =rel_string, value = set of two-Relation tuples. The two relations are examples for the replacement
 
     def __hash__(self):
-        return hash(self.difference_pattern_string)
+        return hash(self.difference_key)
 
     def __eq__(self, other):
         """Overrides the default implementation"""
         if isinstance(other, DifferencePattern):
-            return self.difference_pattern_string == other.difference_pattern_string
+            return self.difference_key == other.difference_key
         return False
 
+    @property
+    def difference_pattern_string(self):
+        return difference_pattern_string(self.difference_key)
+
     def add_exhibiting_relation_pair(self, rel_string, child1, parent1, child2, parent2): # child1, parent1, child2, parent2 should be Concept objects
         if rel_string not in self.exhibiting_relation_pairs:
             self.exhibiting_relation_pairs[rel_string] = set()
-        self.exhibiting_relation_pairs[rel_string].add((Relation(rel_string, child1, parent1), Relation(rel_string, child2, parent2)))
+        self.exhibiting_relation_pairs[rel_string].add((canonical_relation(rel_string, child1, parent1), canonical_relation(rel_string, child2, parent2)))
+
+    def relation_pair_count(self, rel_string):
+        return len(self.exhibiting_relation_pairs.get(rel_string, ()))
+
+    def example_relation_pair(self, rel_string):
+        return next(iter(self.exhibiting_relation_pairs[rel_string]))
+
+
+# class to represent a difference pattern by the number of relation-pairs exhibiting it and a few example pairs, instead of
+# the pairs themselves. Each example has a random priority and the examples with the lowest priorities are kept, so the
+# examples found in several shards are merged by keeping the lowest priorities of all of them.
+class CompactDifferencePattern:
+    __slots__ = ('difference_key', 'relation_pair_counts', 'example_pairs')
+
+    def __init__(self, difference_key):
+        self.difference_key = difference_key    # (difference pattern id, difference pattern id)
+        self.relation_pair_counts = {}  # key = rel_string, value = number of relation-pairs
+        self.example_pairs = {}  # key = rel_string, value = sorted list of (priority, child1 id, parent1 id, child2 id, parent2 id)
+
+    def __hash__(self):
+        return hash(self.difference_key)
+
+    def __eq__(self, other):
+        """Overrides the default implementation"""
+        if isinstance(other, CompactDifferencePattern):
+            return self.difference_key == other.difference_key
+        return False
+
+    @property
+    def difference_pattern_string(self):
+        return difference_pattern_string(self.difference_key)
+
+    def add_relation_pairs(self, rel_string, count, examples):
+        self.relation_pair_counts[rel_string] = self.relation_pair_counts.get(rel_string, 0) + count
+        self.example_pairs[rel_string] = sorted(self.example_pairs.get(rel_string, []) + examples)[:EXAMPLE_PAIRS]
+
+    def relation_pair_count(self, rel_string):
+        return self.relation_pair_counts.get(rel_string, 0)
+
+    def example_relation_pair(self, rel_string):
+        priority, child1_id, parent1_id, child2_id, parent2_id = self.example_pairs[rel_string][0]
+        return (canonical_relation(rel_string, closure_concept_dict[child1_id], closure_concept_dict[parent1_id]),
+                canonical_relation(rel_string, closure_concept_dict[child2_id], closure_concept_dict[parent2_id]))
 
 
 def tokenize_by_space(input_str):
     return input_str.strip().split(' ')
 
 
+def intern_token(token):
+    token_id = token_ids.get(token)
+    if token_id is None:
+        token_id = token_ids[token] = len(token_strings)
+        token_strings.append(token)
+        if token.startswith('##E') and token.endswith('##') and token[3:-2].isdigit():
+            shared_word_positions[token_id] = int(token[3:-2])
+    return token_id
+
+
+# id of the token replacing the word at a position, e.g. ##E2## for token_prefix '##E' and position 2
+def placeholder_token(token_prefix, position):
+    token_id = placeholder_ids.get((token_prefix, position))
+    if token_id is None:
+        token_id = placeholder_ids[(token_prefix, position)] = intern_token(token_prefix + str(position) + '##')
+    return token_id
+
+
+UNNUMBERED_SHARED_WORD = intern_token('##E##')
+
+
+# encodes the words and the part-of-speech tags of the label of a concept as token ids, once per concept
+def encode_concept(con):
+    if con.word_ids is None:
+        con.word_ids = tuple(intern_token(word) for word in con.get_sequence_of_words())
+        con.word_id_set = frozenset(con.word_ids)
+        con.pos_ids = tuple(intern_token(tag) for tag in con.pos_tags or ())
+        con.pos_signature = pos_signature(con.pos_ids)
+    return con
+
+
+def pos_signature(pos_ids):
+    signature = pos_signature_ids.get(pos_ids)
+    if signature is None:
+        signature = pos_signature_ids[pos_ids] = len(pos_signature_ids)
+    return signature
+
+
 def replace_words_in_sequence_by_token(seq, word_set_to_replace, elem_repString_dict, token_prefix):
     seq_updated = []
     for i, word in enumerate(seq):
         if word in word_set_to_replace:
             if word not in elem_repString_dict:
-                rep_string = token_prefix + str(i) + '##'
-                elem_repString_dict[word] = rep_string
+                rep_token = placeholder_token(token_prefix, i)
+                elem_repString_dict[word] = rep_token
             else:
-                rep_string = elem_repString_dict[word]
-            seq_updated.append(rep_string)
+                rep_token = elem_repString_dict[word]
+            seq_updated.append(rep_token)
         else:
             seq_updated.append(word)
-    return seq_updated
+    return tuple(seq_updated)
+
+
+# one side of a lexical pattern: the (partially replaced) word sequence followed by the part-of-speech tags
+def pattern_side(seq_updated, con):
+    return seq_updated + (POS_MARKER,) + con.pos_ids
 
 
 # generate a lexical pattern from a given concept-pair
 def get_pattern_from_concept_pair(con1, con2):
-    con1_seq = con1.get_sequence_of_words()
-    con2_seq = con2.get_sequence_of_words()
-    common_words = con1.get_set_of_words().intersection(con2.get_set_of_words())
+    common_words = encode_concept(con1).word_id_set.intersection(encode_concept(con2).word_id_set)
 
     if len(common_words)==0:
         return None
 
     elem_repString = {}
 
-    con1_seq_updated = replace_words_in_sequence_by_token(con1_seq, common_words, elem_repString, '##E')
-    con2_seq_updated = replace_words_in_sequence_by_token(con2_seq, common_words, elem_repString, '##E')
+    con1_seq_updated = replace_words_in_sequence_by_token(con1.word_ids, common_words, elem_repString, '##E')
+    con2_seq_updated = replace_words_in_sequence_by_token(con2.word_ids, common_words, elem_repString, '##E')
+
+    return pattern_side(con1_seq_updated, con1) + (SIDE_MARKER,) + pattern_side(con2_seq_updated, con2)
+
+
+def intern_pattern(pattern):
+    pattern_id = pattern_ids.get(pattern)
+    if pattern_id is None:
+        pattern_id = pattern_ids[pattern] = len(pattern_keys)
+        pattern_keys.append(pattern)
+    return pattern_id
+
+
+# splits a lexical or difference pattern into its descendant side and its ancestor side
+def split_pattern(pattern):
+    k = pattern.index(SIDE_MARKER)
+    return pattern[:k], pattern[k + 1:]
+
+
+# splits one side of a lexical pattern into its word sequence (with ##E tokens) and its part-of-speech tags
+def split_pattern_side(side):
+    k = side.index(POS_MARKER)
+    return side[:k], side[k + 1:]
+
+
+def is_shared_word_token(token):
+    return token in shared_word_positions
+
+
+# replaces the ##E tokens of a pattern side by the words at those positions of the descendant's word sequence
+def fill_shared_words(seq_with_tokens, con1_seq):
+    return tuple(con1_seq[shared_word_positions[token]] if token in shared_word_positions else token for token in seq_with_tokens)
+
+
+# ancestor side of a pattern with the ##E tokens unnumbered, which (unlike the numbering) does not depend on the descendant
+def unnumbered_ancestor_side(ancestor_seq, pos_ids):
+    return tuple(UNNUMBERED_SHARED_WORD if is_shared_word_token(token) else token for token in ancestor_seq) + (POS_MARKER,) + pos_ids
+
+
+def side_string(side):
+    words, pos_ids = split_pattern_side(side)
+    return ' '.join(token_strings[token] for token in words) + ' <' + ' '.join(token_strings[token] for token in pos_ids) + '> '
 
-    return ' '.join(con1_seq_updated) + ' <'+' '.join(con1.pos_tags)+'> ' + ' ******** ' + ' '.join(con2_seq_updated) + ' <'+' '.join(con2.pos_tags)+'> '
+
+def pattern_tuple_string(pattern):
+    descendant_side, ancestor_side = split_pattern(pattern)
+    return side_string(descendant_side) + PATTERN_SEPARATOR + side_string(ancestor_side)
+
+
+def pattern_string(pattern_id):
+    return pattern_tuple_string(pattern_keys[pattern_id])
+
+
+# the pattern tuple of a lexical or difference pattern string, e.g. a pattern read from a saved audit state
+def parse_pattern(pattern_str):
+    sides = []
+    for side in pattern_str.split(PATTERN_SEPARATOR):
+        words, pos_string = side[:-2].rsplit(' <', 1)
+        pos_tags = pos_string.split(' ') if len(pos_string) > 0 else ()
+        sides.append(tuple(intern_token(word) for word in words.split(' ')) + (POS_MARKER,) + tuple(intern_token(tag) for tag in pos_tags))
+    return sides[0] + (SIDE_MARKER,) + sides[1]
+
+
+def pattern_key(pattern_str):
+    return intern_pattern(parse_pattern(pattern_str))
+
+
+# splits range(total) into consecutive (start, end) shards
+def make_shards(total, shard_size):
+    return [(start, min(start + shard_size, total)) for start in range(0, total, shard_size)]
+
+
+# applies shard_function to each shard, in a pool of forked worker processes if workers > 1. Results are yielded in shard order,
+# so merging them gives the same result as processing the shards one after the other.
+def run_shards(shard_function, shards, workers=1):
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        print('Process forking is not available on this platform. Running with a single worker.')
+        workers = 1
+
+    if workers <= 1:
+        for shard in shards:
+            yield shard_function(shard)
+        return
+
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        for result in pool.imap(shard_function, shards):
+            yield result
 
 
 # generates lexical patterns from all concept pairs with existing relations
 def generate_patterns_existing_rels():
-    pattern_dict = {}  # key = pattern_string, value = Pattern object
+    pattern_dict = {}  # key = pattern id, value = Pattern object
 
     print('Generating lexical patterns from existing relations..')
     for con in closure_concept_dict.values():
         for rel, ancs in con.ancestors.items():
             for anc_id in ancs:
                 anc = closure_concept_dict[anc_id]
-                pattern_string = get_pattern_from_concept_pair(con, anc)
-                if pattern_string is None:  # the concepts have no common words
+                pattern = get_pattern_from_concept_pair(con, anc)
+                if pattern is None:  # the concepts have no common words
                     continue
-                if pattern_string not in pattern_dict:
-                    pattern_dict[pattern_string] = Pattern(pattern_string)
-                pattern_dict[pattern_string].add_exhibiting_relation(rel, con, anc)
+                pattern_id = intern_pattern(pattern)
+                if pattern_id not in pattern_dict:
+                    pattern_dict[pattern_id] = Pattern(pattern_id)
+                pattern_dict[pattern_id].add_exhibiting_relation(rel, con, anc)
 
     return pattern_dict
 
 
 def difference_pattern(con1, con2):
-    con1_seq = con1.get_sequence_of_words()
-    con2_seq = con2.get_sequence_of_words()
-    con1_con2_diff = con1.get_set_of_words().difference(con2.get_set_of_words())
-    con2_con1_diff = con2.get_set_of_words().difference(con1.get_set_of_words())
+    con1_words = encode_concept(con1).word_id_set
+    con2_words = encode_concept(con2).word_id_set
+    con1_con2_diff = con1_words.difference(con2_words)
+    con2_con1_diff = con2_words.difference(con1_words)
 
     con1_elem_repString = {}
-    con1_seq_updated = replace_words_in_sequence_by_token(con1_seq, con1_con2_diff, con1_elem_repString, '##L')
-    con2_seq_updated = replace_words_in_sequence_by_token(con2_seq, con2_con1_diff, con1_elem_repString, '##R')
+    con1_seq_updated = replace_words_in_sequence_by_token(con1.word_ids, con1_con2_diff, con1_elem_repString, '##L')
+    con2_seq_updated = replace_words_in_sequence_by_token(con2.word_ids, con2_con1_diff, con1_elem_repString, '##R')
 
-    return ' '.join(con1_seq_updated) + ' <' + ' '.join(con1.pos_tags) + '> ' + ' ******** ' + ' '.join(con2_seq_updated) + ' <' + ' '.join(con2.pos_tags) + '> '
+    return pattern_side(con1_seq_updated, con1) + (SIDE_MARKER,) + pattern_side(con2_seq_updated, con2)
 
 
-def generate_difference_patterns(pattern_dict):
-    if pattern_dict == None:
-        pattern_dict = generate_patterns_existing_rels(None)
+def intern_difference_pattern(diff_pat):
+    diff_pat_id = difference_pattern_ids.get(diff_pat)
+    if diff_pat_id is None:
+        diff_pat_id = difference_pattern_ids[diff_pat] = len(difference_pattern_keys)
+        difference_pattern_keys.append(diff_pat)
+    return diff_pat_id
 
-    difference_patterns = {}  # key = (string), value = ReplacementPattern object
 
-    print('Generating difference patterns from existing relation pairs...')
-    for pattern_string, pat_obj in pattern_dict.items():
+# key of the difference pattern table for a difference pattern string (two difference patterns joined by DIFFERENCE_PATTERN_SEPARATOR)
+def difference_pattern_key(difference_pat):
+    difference_pat_1, difference_pat_2 = difference_pat.split(DIFFERENCE_PATTERN_SEPARATOR)
+    return intern_difference_pattern(parse_pattern(difference_pat_1)), intern_difference_pattern(parse_pattern(difference_pat_2))
+
+
+def difference_pattern_string(key):
+    return pattern_tuple_string(difference_pattern_keys[key[0]]) + DIFFERENCE_PATTERN_SEPARATOR + pattern_tuple_string(difference_pattern_keys[key[1]])
+
+
+# difference patterns of the pairs of existing relations exhibiting the patterns in a shard of shared_state['pattern_ids'].
+# The difference pattern ids of the relations are computed before the shards are processed, so that worker processes
+# agree on them. Relations are returned as concept ids, so that results of worker processes are cheap to send back.
+def difference_patterns_of_shard(shard):
+    pattern_dict = shared_state['pattern_dict']
+    pattern_ids_of_table = shared_state['pattern_ids']
+    difference_pats = []    # list of (difference pattern key, rel_string, child1 id, parent1 id, child2 id, parent2 id)
+
+    for pattern_id in pattern_ids_of_table[shard[0]:shard[1]]:
+        pat_obj = pattern_dict[pattern_id]
         for rel_string, rel_obj_set in pat_obj.exhibiting_relations.items():
             for rel_obj_1 in rel_obj_set:
-                difference_pat_1 = difference_pattern(rel_obj_1.child, rel_obj_1.parent)
+                difference_pat_1 = rel_obj_1.difference_pattern_id
 
                 for rel_obj_2 in rel_obj_set:
-                    if rel_obj_1 == rel_obj_2:
+                    if rel_obj_1 is rel_obj_2:
                         continue
 
-                    difference_pat_2 = difference_pattern(rel_obj_2.child, rel_obj_2.parent)
-                    difference_pat = difference_pat_1 + ' -------- ' + difference_pat_2
+                    difference_pats.append(((difference_pat_1, rel_obj_2.difference_pattern_id), rel_string,
+                                            rel_obj_1.child.id, rel_obj_1.parent.id, rel_obj_2.child.id, rel_obj_2.parent.id))
+
+    return difference_pats
+
+
+# number of relation-pairs and example pairs of the difference patterns of the pairs of existing relations exhibiting the
+# patterns in a shard, for the 'sampled' and 'counted' difference tables. 'sampled' enumerates the pairs. 'counted' groups
+# the relations of a pattern by their difference pattern and counts the pairs of every two groups, with one example pair each.
+def difference_counts_of_shard(shard):
+    pattern_dict = shared_state['pattern_dict']
+    pattern_ids_of_table = shared_state['pattern_ids']
+    counted = shared_state['difference_table'] == 'counted'
+    rng = random.Random(shard[0])   # seeded by the shard, so the examples do not depend on the number of workers
+    counts = {}  # key = (difference pattern key, rel_string), value = [number of relation-pairs, examples]
+
+    def add_pairs(difference_key, rel_string, count, rel_obj_1, rel_obj_2):
+        entry = counts.get((difference_key, rel_string))
+        if entry is None:
+            entry = counts[(difference_key, rel_string)] = [0, []]
+        entry[0] += count
+        examples = entry[1]
+        examples.append((rng.random(), rel_obj_1.child.id, rel_obj_1.parent.id, rel_obj_2.child.id, rel_obj_2.parent.id))
+        if len(examples) > EXAMPLE_PAIRS:
+            examples.sort()
+            examples.pop()
+
+    for pattern_id in pattern_ids_of_table[shard[0]:shard[1]]:
+        pat_obj = pattern_dict[pattern_id]
+        for rel_string, rel_obj_set in pat_obj.exhibiting_relations.items():
+            if not counted:
+                for rel_obj_1 in rel_obj_set:
+                    for rel_obj_2 in rel_obj_set:
+                        if rel_obj_1 is not rel_obj_2:
+                            add_pairs((rel_obj_1.difference_pattern_id, rel_obj_2.difference_pattern_id), rel_string, 1, rel_obj_1, rel_obj_2)
+                continue
 
-                    if difference_pat not in difference_patterns:
-                        diff_pat_obj = DifferencePattern(difference_pat)
-                        difference_patterns[difference_pat] = diff_pat_obj
+            groups = defaultdict(list)  # key = difference pattern id, value = relations with that difference pattern
+            for rel_obj in rel_obj_set:
+                groups[rel_obj.difference_pattern_id].append(rel_obj)
+            for difference_pat_1, rels_1 in groups.items():
+                for difference_pat_2, rels_2 in groups.items():
+                    if difference_pat_1 != difference_pat_2:
+                        add_pairs((difference_pat_1, difference_pat_2), rel_string, len(rels_1) * len(rels_2), rels_1[0], rels_2[0])
+                    elif len(rels_1) > 1:
+                        add_pairs((difference_pat_1, difference_pat_2), rel_string, len(rels_1) * (len(rels_1) - 1), rels_1[0], rels_1[1])
 
-                    diff_pat_obj = difference_patterns[difference_pat]
-                    diff_pat_obj.add_exhibiting_relation_pair(rel_string, rel_obj_1.child, rel_obj_1.parent, rel_obj_2.child, rel_obj_2.parent)
+    return [(difference_key, rel_string, count, examples) for (difference_key, rel_string), (count, examples) in counts.items()]
 
-    return difference_patterns
 
+# difference_table selects how the relation-pairs exhibiting each difference pattern are stored:
+#   'full': all relation-pairs (DifferencePattern), which is quadratic in the number of relations of each lexical pattern
+#   'sampled': the number of relation-pairs and EXAMPLE_PAIRS sampled example pairs (CompactDifferencePattern)
+#   'counted': as 'sampled', with the number of relation-pairs computed without enumerating them
+# All tables give the same inconsistencies, although the example relation-pairs reported may differ.
+def generate_difference_patterns(pattern_dict, workers=1, difference_table='full'):
+    if difference_table not in DIFFERENCE_TABLES:
+        raise ValueError('Unknown difference table: ' + str(difference_table))
 
-# suggestions are made considering all non-related concept-pairs
-# to suggest a missing relation, concept-pair needs to generate a lexical pattern that was generated by a related concept-pair
-# difference pattern between the suggestion and the leveraged existing relation should be same as the difference pattern obtained by a pair of existing relations.
-def suggest_inconsistencies(output_file):
-    pattern_dict = generate_patterns_existing_rels()
-    replacement_candidate_dict = generate_difference_patterns(pattern_dict)
-    inconsistencies = set()
-    all_concepts = list(closure_concept_dict.values())
+    if pattern_dict == None:
+        pattern_dict = generate_patterns_existing_rels()
 
-    print('Identifying inconsistencies...')
-    for i in trange(len(all_concepts)):
-        con1 = all_concepts[i]
+    difference_patterns = {}  # key = (difference pattern id, difference pattern id), value = DifferencePattern (or CompactDifferencePattern) object
 
-        for j in range(len(all_concepts)):
-            con2 = all_concepts[j]
-            if con1 == con2:
-                continue
+    print('Computing difference patterns of existing relations...')
+    difference_pattern_cache = {}   # key = (child id, parent id), value = difference pattern id
+    for pat_obj in pattern_dict.values():
+        for rel_obj_set in pat_obj.exhibiting_relations.values():
+            for rel_obj in rel_obj_set:
+                concept_pair = (rel_obj.child.id, rel_obj.parent.id)
+                if concept_pair not in difference_pattern_cache:    # the same concept-pair may be related by several relations
+                    difference_pattern_cache[concept_pair] = rel_obj.get_difference_pattern_id()
+                rel_obj.difference_pattern_id = difference_pattern_cache[concept_pair]
 
-            if con2.id in con1.all_ancestors or con1.id in con2.all_ancestors:  # if there exists any relation between these concept, another relation isn't predicted.
-                continue
+    shared_state['pattern_dict'] = pattern_dict
+    shared_state['pattern_ids'] = list(pattern_dict)
+    shared_state['difference_table'] = difference_table
+    shards = make_shards(len(shared_state['pattern_ids']), PATTERN_SHARD_SIZE)
 
-            pattern_string = get_pattern_from_concept_pair(con1, con2)
+    print('Generating difference patterns from existing relation pairs...')
+    if difference_table != 'full':
+        for difference_counts in tqdm(run_shards(difference_counts_of_shard, shards, workers), total=len(shards)):
+            for difference_key, rel_string, count, examples in difference_counts:
+                if difference_key not in difference_patterns:
+                    difference_patterns[difference_key] = CompactDifferencePattern(difference_key)
+                difference_patterns[difference_key].add_relation_pairs(rel_string, count, examples)
+        return difference_patterns
+
+    for difference_pats in tqdm(run_shards(difference_patterns_of_shard, shards, workers), total=len(shards)):
+        for difference_key, rel_string, child1_id, parent1_id, child2_id, parent2_id in difference_pats:
+            if difference_key not in difference_patterns:
+                diff_pat_obj = DifferencePattern(difference_key)
+                difference_patterns[difference_key] = diff_pat_obj
+
+            diff_pat_obj = difference_patterns[difference_key]
+            diff_pat_obj.add_exhibiting_relation_pair(rel_string, closure_concept_dict[child1_id], closure_concept_dict[parent1_id],
+                                                      closure_concept_dict[child2_id], closure_concept_dict[parent2_id])
 
-            if pattern_string is None or pattern_string not in pattern_dict:  # the pattern is not found among existing relations
-                continue
+    return difference_patterns
 
-            pattern_obj = pattern_dict[pattern_string]  # this returns Pattern object
 
-            if len(pattern_obj.exhibiting_relations) > 1:  # if the pattern is observed in multiple relations, don't use it to predict missing is-a
+# class to index concepts by the words of their labels. Used to enumerate only the concept-pairs sharing a word.
+# Words occurring in many labels (e.g. 'of', 'activity', 'process') are not enumerated through their (long) posting lists.
+# Pairs sharing only such frequent words are instead found from the lexical patterns of existing relations: given the
+# descendant and the set of shared words, the ancestor side of a pattern determines the label of the ancestor.
+class WordIndex:
+    def __init__(self, all_concepts, pattern_dict, frequent_token_threshold=FREQUENT_TOKEN_THRESHOLD):
+        self.all_concepts = all_concepts
+        self.word_postings = defaultdict(list)  # key = word id, value = list of positions in all_concepts
+        self.label_positions = defaultdict(list)    # key = word id sequence, value = list of positions in all_concepts
+
+        for i, con in enumerate(all_concepts):
+            encode_concept(con)
+            for word in con.word_id_set:
+                self.word_postings[word].append(i)
+            self.label_positions[con.word_ids].append(i)
+
+        self.frequent_words = set(word for word, postings in self.word_postings.items() if len(postings) > frequent_token_threshold)
+
+        # key = descendant side of a usable pattern, value = list of ancestor word sequences (still with ##E tokens)
+        self.ancestor_sides = defaultdict(list)
+        self.usable_patterns = []
+        for pattern_id, pattern_obj in pattern_dict.items():
+            if len(pattern_obj.exhibiting_relations) > 1:   # such patterns are never used for suggestions
                 continue
+            self.usable_patterns.append(pattern_id)
+            descendant_side, ancestor_side = split_pattern(pattern_keys[pattern_id])
+            self.ancestor_sides[descendant_side].append(split_pattern_side(ancestor_side)[0])
+
+        self.descendant_sides = None    # built when candidate_descendants() is first used, see frequent_word_descendants()
+
+    # returns the positions (in all_concepts) of the concepts that share at least one word with all_concepts[i]
+    def candidate_partners(self, i):
+        partners = self.concept_partners(self.all_concepts[i])
+        partners.discard(i)
+        return sorted(partners)
+
+    # the set of positions of the concepts sharing at least one word with con1, which need not be in all_concepts
+    def concept_partners(self, con1):
+        words = encode_concept(con1).word_id_set
+        partners = set()
+
+        for word in words:
+            if word not in self.frequent_words:
+                partners.update(self.word_postings.get(word, ()))
+
+        frequent_words = sorted(words.intersection(self.frequent_words))
+        if len(frequent_words) > MAX_FREQUENT_SUBSET_WORDS:
+            for word in frequent_words:
+                partners.update(self.word_postings.get(word, ()))
+        else:
+            partners.update(self.frequent_word_partners(con1, frequent_words))
+        return partners
+
+    # concepts sharing only frequent words with con1, restricted to those whose lexical pattern exists among the usable patterns
+    def frequent_word_partners(self, con1, frequent_words):
+        con1_seq = con1.word_ids
+        con1_words = con1.word_id_set
+        partners = []
+
+        for size in range(1, len(frequent_words) + 1):
+            for common_words in combinations(frequent_words, size):
+                descendant_side = pattern_side(replace_words_in_sequence_by_token(con1_seq, set(common_words), {}, '##E'), con1)
+
+                for ancestor_seq in self.ancestor_sides.get(descendant_side, ()):
+                    for j in self.label_positions.get(fill_shared_words(ancestor_seq, con1_seq), ()):
+                        if con1_words.intersection(self.all_concepts[j].word_id_set).issubset(self.frequent_words):
+                            partners.append(j)   # pairs sharing an infrequent word are found through the posting lists
+
+        return partners
+
+
+    # returns the positions (in all_concepts) of the concepts that share at least one word with all_concepts[j],
+    # i.e. the descendants of the concept-pairs having all_concepts[j] as the ancestor
+    def candidate_descendants(self, j):
+        descendants = self.concept_descendants(self.all_concepts[j])
+        descendants.discard(j)
+        return sorted(descendants)
+
+    # the set of positions of the candidate descendants of con2 (as the ancestor), which need not be in all_concepts
+    def concept_descendants(self, con2):
+        words = encode_concept(con2).word_id_set
+        descendants = set()
+
+        for word in words:
+            if word not in self.frequent_words:
+                descendants.update(self.word_postings.get(word, ()))
+
+        frequent_words = sorted(words.intersection(self.frequent_words))
+        if len(frequent_words) > MAX_FREQUENT_SUBSET_WORDS:
+            for word in frequent_words:
+                descendants.update(self.word_postings.get(word, ()))
+        else:
+            descendants.update(self.frequent_word_descendants(con2, frequent_words))
+        return descendants
+
+    # concepts sharing only frequent words with con2 (as the ancestor), restricted to those whose lexical pattern exists
+    # among the usable patterns. The ancestor side of a pattern (with unnumbered ##E tokens) and the ancestor's words
+    # determine the words replaced by each ##E token, which then fix the descendant label.
+    def frequent_word_descendants(self, con2, frequent_words):
+        if self.descendant_sides is None:
+            # key = unnumbered ancestor side of a usable pattern, value = list of (ancestor word sequence, descendant word sequence)
+            self.descendant_sides = defaultdict(list)
+            for pattern_id in self.usable_patterns:
+                descendant_side, ancestor_side = split_pattern(pattern_keys[pattern_id])
+                ancestor_seq, ancestor_pos = split_pattern_side(ancestor_side)
+                self.descendant_sides[unnumbered_ancestor_side(ancestor_seq, ancestor_pos)].append((ancestor_seq, split_pattern_side(descendant_side)[0]))
+
+        con2_seq = con2.word_ids
+        con2_words = con2.word_id_set
+        descendants = []
+
+        for size in range(1, len(frequent_words) + 1):
+            for common_words in combinations(frequent_words, size):
+                ancestor_side = pattern_side(tuple(UNNUMBERED_SHARED_WORD if word in common_words else word for word in con2_seq), con2)
+
+                for ancestor_seq, descendant_seq in self.descendant_sides.get(ancestor_side, ()):
+                    shared_words = {token: con2_seq[k] for k, token in enumerate(ancestor_seq) if is_shared_word_token(token)}
+                    for i in self.label_positions.get(tuple(shared_words.get(word, word) for word in descendant_seq), ()):
+                        if con2_words.intersection(self.all_concepts[i].word_id_set).issubset(self.frequent_words):
+                            descendants.append(i)   # pairs sharing an infrequent word are found through the posting lists
+
+        return descendants
+
+
+# class to index concepts by the shape of their labels (number of words and part-of-speech tags) and by the word at each position.
+# A usable lexical pattern fixes the shape of the descendant and its words at the positions not shared with the ancestor,
+# so the concepts that can fill the descendant side are looked up directly. The shared words then fix the ancestor label.
+class PatternTemplateIndex:
+    def __init__(self, all_concepts):
+        self.all_concepts = all_concepts
+        self.shape_positions = defaultdict(list)  # key = (number of words, part-of-speech tag ids), value = list of positions in all_concepts
+        self.slot_positions = defaultdict(list)   # key = (shape, word position, word id), value = list of positions in all_concepts
+        self.label_positions = defaultdict(list)    # key = word id sequence, value = list of positions in all_concepts
+
+        for i, con in enumerate(all_concepts):
+            seq = encode_concept(con).word_ids
+            shape = (len(seq), con.pos_ids)
+            self.shape_positions[shape].append(i)
+            for k, word in enumerate(seq):
+                self.slot_positions[(shape, k, word)].append(i)
+            self.label_positions[seq].append(i)
+
+    # returns the (descendant position, ancestor position) pairs in all_concepts that can generate the given pattern
+    def candidate_pairs(self, pattern_id):
+        descendant_side, ancestor_side = split_pattern(pattern_keys[pattern_id])
+        descendant_seq, descendant_pos = split_pattern_side(descendant_side)
+        ancestor_seq = split_pattern_side(ancestor_side)[0]
+        shape = (len(descendant_seq), descendant_pos)
+
+        if shape not in self.shape_positions:
+            return []
+
+        slots = [self.slot_positions.get((shape, k, word), []) for k, word in enumerate(descendant_seq) if not is_shared_word_token(word)]
+        if len(slots) == 0:
+            descendants = self.shape_positions[shape]
+        else:
+            slots.sort(key=len)
+            descendants = set(slots[0])
+            for slot in slots[1:]:
+                descendants.intersection_update(slot)
+                if len(descendants) == 0:
+                    break
+            descendants = sorted(descendants)
+
+        pairs = []
+        for i in descendants:
+            con1_seq = self.all_concepts[i].word_ids
+            if fill_shared_words(descendant_seq, con1_seq) != con1_seq:   # the same ##E token must stand for the same word
+                continue
+            for j in self.label_positions.get(fill_shared_words(ancestor_seq, con1_seq), ()):
+                pairs.append((i, j))
+
+        return pairs
+
+
+# bit mask of the positions of a word sequence holding shared words: the ##E tokens of a pattern side, or the words
+# of a concept in shared_words
+def shared_word_mask(seq, shared_words=None):
+    mask = 0
+    for i, token in enumerate(seq):
+        if (token in shared_words) if shared_words is not None else is_shared_word_token(token):
+            mask |= 1 << i
+    return mask
+
+
+# fast rejection of the concept-pairs that cannot generate a usable lexical pattern (one of a single relation), before
+# the pattern is built. A lexical pattern is determined by the words of the two labels, so the signatures of the usable
+# patterns (the part-of-speech signatures of the two sides and the masks of the positions of the shared words) are a
+# necessary condition: a concept-pair whose signature is not among them has no usable pattern. The part-of-speech
+# signatures are compared first, from precomputed ids of the concepts; the masks are only computed for the pairs passing.
+class PatternPrefilter:
+    def __init__(self, pattern_dict):
+        self.pos_pairs = set()  # (part-of-speech signature of the descendant, of the ancestor)
+        self.signatures = set()  # (part-of-speech signatures, shared word mask of the descendant, of the ancestor)
+        for pattern_id, pattern_obj in pattern_dict.items():
+            if len(pattern_obj.exhibiting_relations) > 1:
+                continue
+            descendant_side, ancestor_side = split_pattern(pattern_keys[pattern_id])
+            descendant_seq, descendant_pos = split_pattern_side(descendant_side)
+            ancestor_seq, ancestor_pos = split_pattern_side(ancestor_side)
+            pos_pair = (pos_signature(descendant_pos), pos_signature(ancestor_pos))
+            self.pos_pairs.add(pos_pair)
+            self.signatures.add(pos_pair + (shared_word_mask(descendant_seq), shared_word_mask(ancestor_seq)))
+
+    # False if the concept-pair (encoded, see encode_concept) has no usable lexical pattern
+    def may_match(self, con1, con2):
+        pos_pair = (con1.pos_signature, con2.pos_signature)
+        if pos_pair not in self.pos_pairs:
+            return False
+        shared_words = con1.word_id_set.intersection(con2.word_id_set)
+        return pos_pair + (shared_word_mask(con1.word_ids, shared_words), shared_word_mask(con2.word_ids, shared_words)) in self.signatures
+
+
+# prints the rates of the prefilter from the counters of check_concept_pair: the share of the checked concept-pairs
+# passing it (hits), and the share of those without a usable lexical pattern after all (false positives)
+def print_prefilter_rates(counters):
+    checked = counters['prefilter_passes'] + counters['prefilter_rejections']
+    if checked > 0:
+        false_positives = counters['prefilter_passes'] - counters['pattern_hits']
+        print('Prefilter: {0} of {1} concept-pairs passed ({2:.2%}), {3} false positives ({4:.2%} of the passed)'.format(
+            counters['prefilter_passes'], checked, counters['prefilter_passes'] / checked, false_positives,
+            false_positives / counters['prefilter_passes'] if counters['prefilter_passes'] > 0 else 0))
+
+
+# whether the concepts are connected by any relation, in either direction
+def concepts_related(con1, con2):
+    if reachability_index is not None:
+        return reachability_index.related(con1.id, con2.id) or reachability_index.related(con2.id, con1.id)
+    return con2.id in con1.all_ancestors or con1.id in con2.all_ancestors
+
+
+# checks a concept-pair without an existing relation and returns the suggested inconsistency (None if there is none)
+# If counters (a Counter) is given, the pairs pruned by ancestry, the pairs passing and rejected by the prefilter, the
+# pattern hits and the difference pattern hits are counted.
+# If a prefilter (a PatternPrefilter of pattern_dict) is given, the concept-pairs it rejects are not checked further.
+def check_concept_pair(con1, con2, pattern_dict, replacement_candidate_dict, counters=None, prefilter=None):
+    if con1 == con2:
+        return None
 
-            diff_pat_1 = difference_pattern(con1, con2)
+    if concepts_related(con1, con2):  # if there exists any relation between these concept, another relation isn't predicted.
+        if counters is not None:
+            counters['pairs_pruned_by_ancestry'] += 1
+        return None
 
-            for rel_string, rel_exhibiting_set in pattern_obj.exhibiting_relations.items():
-                if rel_string == 'is_a' and con1.root != con2.root: # don't suggest is-a relations across different top-level subhierarchies
-                    continue
+    if prefilter is not None:
+        if not prefilter.may_match(con1, con2):
+            if counters is not None:
+                counters['prefilter_rejections'] += 1
+            return None
+        if counters is not None:
+            counters['prefilter_passes'] += 1
 
-                for rel_exhibit in rel_exhibiting_set:
-                    diff_pat_2 = difference_pattern(rel_exhibit.child, rel_exhibit.parent)
-                    diff_pat = diff_pat_1 + ' -------- ' + diff_pat_2
+    pattern = get_pattern_from_concept_pair(con1, con2)
+    if pattern is None:
+        return None
 
-                    if diff_pat in replacement_candidate_dict:
-                        repl_pat_obj = replacement_candidate_dict[diff_pat]
-                        if rel_string in repl_pat_obj.exhibiting_relation_pairs:
-                            exhibit_rel_pair_sample = next(iter(repl_pat_obj.exhibiting_relation_pairs[rel_string]))
-                            inconsistencies.add((con1.id_label, rel_string, con2.id_label, pattern_string,
-                                             len(rel_exhibiting_set), rel_exhibit, diff_pat, len(repl_pat_obj.exhibiting_relation_pairs[rel_string]),
-                                             str(exhibit_rel_pair_sample[0]), str(exhibit_rel_pair_sample[1])))
-                            break
+    # only lexical patterns of existing relations are interned
+    pattern_id = pattern_ids.get(pattern)
+    if pattern_id is None or pattern_id not in pattern_dict:  # the pattern is not found among existing relations
+        return None
 
+    pattern_obj = pattern_dict[pattern_id]  # this returns Pattern object
+
+    if len(pattern_obj.exhibiting_relations) > 1:  # if the pattern is observed in multiple relations, don't use it to predict missing is-a
+        return None
+    if counters is not None:
+        counters['pattern_hits'] += 1
+
+    # only difference patterns of existing relations are interned, so a concept-pair whose difference pattern is not
+    # interned has no replacement example
+    diff_pat_1 = difference_pattern_ids.get(difference_pattern(con1, con2))
+    if diff_pat_1 is None:
+        return None
+    if counters is not None:
+        counters['difference_pattern_hits'] += 1
+
+    for rel_string, rel_exhibiting_set in pattern_obj.exhibiting_relations.items():
+        if rel_string == 'is_a' and con1.root != con2.root: # don't suggest is-a relations across different top-level subhierarchies
+            continue
+
+        for rel_exhibit in rel_exhibiting_set:
+            diff_key = (diff_pat_1, rel_exhibit.get_difference_pattern_id())
+
+            if diff_key in replacement_candidate_dict:
+                repl_pat_obj = replacement_candidate_dict[diff_key]
+                if repl_pat_obj.relation_pair_count(rel_string) > 0:
+                    exhibit_rel_pair_sample = repl_pat_obj.example_relation_pair(rel_string)
+                    return (con1.id_label, rel_string, con2.id_label, pattern_id,
+                            len(rel_exhibiting_set), rel_exhibit, diff_key, repl_pat_obj.relation_pair_count(rel_string),
+                            str(exhibit_rel_pair_sample[0]), str(exhibit_rel_pair_sample[1]))
+
+    return None
+
+
+# the example existing relation (6th element) of an inconsistency is replaced by concept ids to send it back from a worker process
+def compact_inconsistency(inconsistency):
+    rel_exhibit = inconsistency[5]
+    return inconsistency[:5] + ((rel_exhibit.rel_string, rel_exhibit.child.id, rel_exhibit.parent.id),) + inconsistency[6:]
+
+
+def expand_inconsistency(compact):
+    rel_string, child_id, parent_id = compact[5]
+    return compact[:5] + (canonical_relation(rel_string, closure_concept_dict[child_id], closure_concept_dict[parent_id]),) + compact[6:]
+
+
+# the row of an inconsistency in the output file. The lexical pattern (4th element) and the difference pattern (7th element)
+# of an inconsistency are ids, which are replaced by the pattern strings.
+def inconsistency_row(inconsistency):
+    return (inconsistency[:3] + (pattern_string(inconsistency[3]),) + inconsistency[4:6]
+            + (difference_pattern_string(inconsistency[6]),) + inconsistency[7:])
+
+
+# the inconsistency of a row, with the pattern strings replaced by ids (the inverse of inconsistency_row)
+def interned_inconsistency(row):
+    return row[:3] + (pattern_key(row[3]),) + row[4:6] + (difference_pattern_key(row[6]),) + row[7:]
+
+
+# part of the concept-pairs searched by a job of a distributed audit (see Distributed_audit):
+#   roots: top-level concepts (root ids) of the descendant concepts, or None for all of them
+#   partners: 'same_root', 'other_roots' or 'all', the ancestor concepts compared with a descendant, by their root
+#   relations: relations of the inconsistencies, or None for all of them. The usable lexical patterns have a single
+#              relation, so the other patterns are left out of the search.
+#   block: (start, end) positions of the descendant concepts, or None for all of them
+# The scopes of a plan partition the concept-pairs, so each inconsistency is found by a single job.
+class SearchScope:
+    PARTNERS = ('all', 'same_root', 'other_roots')
+
+    def __init__(self, roots=None, partners='all', relations=None, block=None):
+        if partners not in self.PARTNERS:
+            raise ValueError('Unknown partners: ' + str(partners))
+        self.roots = None if roots is None else set(roots)
+        self.partners = partners
+        self.relations = None if relations is None else set(relations)
+        self.block = None if block is None else tuple(block)
+
+    def descendant_range(self, num_concepts):
+        return self.block if self.block is not None else (0, num_concepts)
+
+    # whether the concept con1 at position i is a descendant of the concept-pairs of the scope
+    def includes_descendant(self, i, con1):
+        if self.block is not None and not self.block[0] <= i < self.block[1]:
+            return False
+        return self.roots is None or con1.root in self.roots
+
+    # whether the concept-pair (con1 at position i as the descendant) is in the scope
+    def includes(self, i, con1, con2):
+        if not self.includes_descendant(i, con1):
+            return False
+        if self.partners == 'same_root':
+            return con1.root == con2.root
+        if self.partners == 'other_roots':
+            return con1.root != con2.root
+        return True
+
+    # the lexical patterns that can give inconsistencies of the relations of the scope
+    def patterns(self, pattern_dict):
+        if self.relations is None:
+            return pattern_dict
+        return {pattern_id: pattern_obj for pattern_id, pattern_obj in pattern_dict.items()
+                if len(pattern_obj.exhibiting_relations) == 1 and not self.relations.isdisjoint(pattern_obj.exhibiting_relations)}
+
+
+# inconsistencies found from the concept-pairs of a shard, and the counters of check_concept_pair for them. A shard is a range of descendant concepts ('pairwise' and 'index' modes)
+# or a range of usable lexical patterns ('pattern' mode).
+def inconsistencies_of_shard(shard):
+    search_mode = shared_state['search_mode']
+    all_concepts = shared_state['all_concepts']
+    pattern_dict = shared_state['pattern_dict']
+    replacement_candidate_dict = shared_state['replacement_candidate_dict']
+    scope = shared_state['scope']
+    prefilter = shared_state['prefilter']
+
+    descendants = range(shard[0], shard[1])
+    if scope is not None and search_mode != 'pattern':
+        descendants = [i for i in descendants if scope.includes_descendant(i, all_concepts[i])]
+
+    if search_mode == 'pattern':
+        template_index = shared_state['template_index']
+        pairs = (pair for pattern_id in shared_state['usable_patterns'][shard[0]:shard[1]] for pair in template_index.candidate_pairs(pattern_id))
+    elif search_mode == 'index':
+        word_index = shared_state['word_index']
+        pairs = ((i, j) for i in descendants for j in word_index.candidate_partners(i))
+    else:
+        pairs = ((i, j) for i in descendants for j in range(len(all_concepts)))
+
+    inconsistencies = []
+    counters = Counter() if shared_state['count_checks'] else None
+    num_pairs = 0
+    for i, j in pairs:
+        if scope is not None and not scope.includes(i, all_concepts[i], all_concepts[j]):
+            continue
+        num_pairs += 1
+        inconsistency = check_concept_pair(all_concepts[i], all_concepts[j], pattern_dict, replacement_candidate_dict, counters, prefilter)
+        if inconsistency is not None:
+            inconsistencies.append(compact_inconsistency(inconsistency))
+
+    counters = counters or Counter()
+    counters.update(pairs_enumerated=num_pairs, suggestions_emitted=len(inconsistencies))
+    return inconsistencies, counters
+
+
+# searches the concept-pairs without existing relations for inconsistencies. The search modes give the same inconsistencies:
+#   'pairwise': compares all ordered concept-pairs
+#   'index': only compares concept-pairs sharing a word, which are the only ones that can generate a lexical pattern
+#   'pattern': looks up the concept-pairs that can generate each usable lexical pattern of existing relations
+# With workers > 1, the shards are searched in forked worker processes and merged in shard order.
+# The inconsistencies of each shard are passed to the suggestion_writers (see InconsistencyWriter and PartFileWriter) as
+# soon as the shard is searched, so they can be reviewed while the search is going on.
+# If a checkpoint (see Checkpoint.RunCheckpoint) is given, the shards searched are recorded in it and the shards already
+# recorded are not searched again.
+# If a scope (see SearchScope) is given, only its concept-pairs are searched.
+# If max_pairs is given, the search stops after the shard in which max_pairs concept-pairs have been enumerated, and only
+# the inconsistencies of the shards searched so far are returned (the search is not recorded as complete in the checkpoint).
+def search_inconsistencies(pattern_dict, replacement_candidate_dict, search_mode='index', workers=1, suggestion_writers=(), checkpoint=None,
+                           scope=None, max_pairs=None):
+    if search_mode not in SEARCH_MODES:
+        raise ValueError('Unknown search mode: ' + str(search_mode))
+
+    all_concepts = list(closure_concept_dict.values())
+    for con in all_concepts:    # before forking, so that the workers share the token ids
+        encode_concept(con)
+    if scope is not None:
+        pattern_dict = scope.patterns(pattern_dict)
+    shared_state.update(search_mode=search_mode, all_concepts=all_concepts, pattern_dict=pattern_dict,
+                        replacement_candidate_dict=replacement_candidate_dict, count_checks=Instrumentation.run_report.count_checks,
+                        scope=scope, prefilter=PatternPrefilter(pattern_dict))
+
+    if search_mode == 'pattern':
+        print('Indexing concepts by pattern templates...')
+        shared_state['template_index'] = PatternTemplateIndex(all_concepts)
+        # ordered by pattern string, so the shards do not depend on the order in which patterns were found (e.g. for checkpoints)
+        shared_state['usable_patterns'] = sorted((pattern_id for pattern_id, pattern_obj in pattern_dict.items() if len(pattern_obj.exhibiting_relations) == 1),
+                                                 key=pattern_string)
+        shards = make_shards(len(shared_state['usable_patterns']), PATTERN_SHARD_SIZE)
+    else:
+        if search_mode == 'index':
+            print('Indexing concepts by words...')
+            shared_state['word_index'] = WordIndex(all_concepts, pattern_dict)
+        start, end = scope.descendant_range(len(all_concepts)) if scope is not None else (0, len(all_concepts))
+        shards = [(start + shard_start, start + shard_end) for shard_start, shard_end in make_shards(end - start, CONCEPT_SHARD_SIZE)]
+
+    inconsistencies = {}    # key = (child id, relation, parent id), value = inconsistency
+    searched_shards = checkpoint.searched_shards if checkpoint is not None else {}
+    for shard_index in sorted(searched_shards):
+        add_shard_inconsistencies(inconsistencies, shard_index, map(interned_inconsistency, searched_shards[shard_index]), suggestion_writers)
+
+    pending_shards = [shard_index for shard_index in range(len(shards)) if shard_index not in searched_shards]
+
+    print('Identifying inconsistencies...')
+    shard_results = run_shards(inconsistencies_of_shard, [shards[shard_index] for shard_index in pending_shards], workers)
+    search_counters = Counter()
+    num_searched = 0
+    for shard_index, (shard_inconsistencies, shard_counters) in zip(pending_shards, tqdm(shard_results, total=len(pending_shards))):
+        Instrumentation.add_counts(shard_counters)
+        search_counters.update(shard_counters)
+        if checkpoint is not None:  # with pattern strings instead of ids, which are only valid within this process
+            checkpoint.record_shard(shard_index, [inconsistency_row(compact) for compact in shard_inconsistencies])
+        add_shard_inconsistencies(inconsistencies, shard_index, shard_inconsistencies, suggestion_writers)
+        num_searched += 1
+        if max_pairs is not None and search_counters['pairs_enumerated'] >= max_pairs and num_searched < len(pending_shards):
+            break
+    shard_results.close()   # stops the worker processes if the search was stopped
+
+    if num_searched < len(pending_shards):
+        print('Search stopped after {0} of {1} shards: the budget of {2} concept-pairs was reached and the results are partial'.format(
+            len(shards) - len(pending_shards) + num_searched, len(shards), max_pairs))
+        Instrumentation.add_counts({'search_budget_reached': 1, 'shards_not_searched': len(pending_shards) - num_searched})
+    elif checkpoint is not None:
+        checkpoint.record_search_complete()
+    if Instrumentation.run_report.count_checks:
+        print_prefilter_rates(search_counters)
+    Instrumentation.add_counts({'suggestions': len(inconsistencies)})
+    return set(inconsistencies.values())
+
+
+# adds the (compact) inconsistencies found in a shard to the inconsistencies found so far and writes the new ones
+def add_shard_inconsistencies(inconsistencies, shard_index, shard_inconsistencies, suggestion_writers):
+    new_inconsistencies = []
+    for compact in shard_inconsistencies:
+        edge = predicted_edge(compact)
+        if edge not in inconsistencies:
+            inconsistencies[edge] = expand_inconsistency(compact)
+            new_inconsistencies.append(inconsistencies[edge])
+    for writer in suggestion_writers:
+        writer.write_shard(shard_index, new_inconsistencies)
+
+
+# the inconsistencies recorded by a checkpoint of a complete search, which are written to the suggestion_writers again
+def restore_inconsistencies(checkpoint, suggestion_writers=()):
+    inconsistencies = {}
+    for shard_index in sorted(checkpoint.searched_shards):
+        add_shard_inconsistencies(inconsistencies, shard_index, map(interned_inconsistency, checkpoint.searched_shards[shard_index]), suggestion_writers)
+    return set(inconsistencies.values())
+
+
+# lexical patterns of existing relations (unless already generated) and difference patterns of pairs of existing relations
+def generate_pattern_tables(workers=1, difference_table='full', pattern_dict=None):
+    if pattern_dict is None:
+        with Instrumentation.stage('generate_patterns_existing_rels'):
+            pattern_dict = generate_patterns_existing_rels()
+    with Instrumentation.stage('generate_difference_patterns'):
+        replacement_candidate_dict = generate_difference_patterns(pattern_dict, workers, difference_table)
+    Instrumentation.add_counts({'lexical_patterns': len(pattern_dict), 'difference_patterns': len(replacement_candidate_dict)})
+    return pattern_dict, replacement_candidate_dict
+
+
+# runs the search with each of the given modes and reports whether they give the same inconsistencies
+def compare_search_modes(search_modes=SEARCH_MODES, workers=1, difference_table='full'):
+    pattern_dict, replacement_candidate_dict = generate_pattern_tables(workers, difference_table)
+
+    results = {}
+    for search_mode in search_modes:
+        start_time = time.time()
+        results[search_mode] = search_inconsistencies(pattern_dict, replacement_candidate_dict, search_mode, workers)
+        print('{0}: {1} inconsistencies in {2:.2f} mins'.format(search_mode, len(results[search_mode]), (time.time() - start_time) / 60))
+
+    reference_mode = search_modes[0]
+    all_equal = True
+    for search_mode in search_modes[1:]:
+        if results[search_mode] != results[reference_mode]:
+            all_equal = False
+            print('{0} and {1} differ: {2} only in {0}, {3} only in {1}'.format(reference_mode, search_mode,
+                  len(results[reference_mode] - results[search_mode]), len(results[search_mode] - results[reference_mode])))
+
+    if all_equal:
+        print('All search modes gave the same inconsistencies.')
+    return all_equal
+
+
+# suggestions are made considering all non-related concept-pairs
+# to suggest a missing relation, concept-pair needs to generate a lexical pattern that was generated by a related concept-pair
+# difference pattern between the suggestion and the leveraged existing relation should be same as the difference pattern obtained by a pair of existing relations.
+# pattern_tables: (pattern_dict, replacement_candidate_dict) if already generated
+# The suggestions are written to output_file as they are found, and to part files of part_format in suggestions_dir if it is given.
+# With a checkpoint, the search resumes from the shards recorded in it (and the pattern tables are not needed once it is complete).
+# max_pairs: budget of concept-pairs of the search (see search_inconsistencies)
+def suggest_inconsistencies(output_file, search_mode='index', workers=1, pattern_tables=None, suggestions_dir=None, part_format='csv',
+                            checkpoint=None, max_pairs=None):
+    search_complete = checkpoint is not None and checkpoint.search_complete
+    if pattern_tables is None and not search_complete:
+        pattern_tables = generate_pattern_tables(workers)
+
+    suggestion_writers = []
     if output_file != None:
-        with open(output_file, 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(('Descendant', 'Relation', 'Ancestor', 'Pattern', 'num existing relations with pattern',
-                                'Example existing relations with pattern', 'Difference pattern',
-                                'num examples for replacement', 'Replacement example 1', 'Replacement example 2'))
-            csvwriter.writerows(inconsistencies)
+        suggestion_writers.append(InconsistencyWriter(output_file, SUGGESTION_HEADERS))
+    if suggestions_dir != None:
+        suggestion_writers.append(PartFileWriter(suggestions_dir, part_format, SUGGESTION_HEADERS))
+    try:
+        with Instrumentation.stage('search'):
+            if search_complete:
+                inconsistencies = restore_inconsistencies(checkpoint, suggestion_writers)
+            else:
+                inconsistencies = search_inconsistencies(*pattern_tables, search_mode, workers, suggestion_writers, checkpoint,
+                                                         max_pairs=max_pairs)
+    finally:
+        for writer in suggestion_writers:
+            writer.close()
 
     return inconsistencies
 
 
-def remove_redundant_relations(predictions, labels_file, relations_file, pos_tag_file, output_file_redundantRemoved):
-    redundant_predictions = set()
+# parses the (child id, relation, parent id) of a predicted relation
+def predicted_edge(prediction):
+    return prediction[0].split(' ', 1)[0], prediction[1], prediction[2].split(' ', 1)[0]
+
+
+# format of an output file, given by its extension: '.parquet', '.gz' (a gzip-compressed CSV file) or any other (a CSV file)
+def output_format(output_file):
+    if output_file.endswith('.parquet'):
+        return 'parquet'
+    if output_file.endswith('.gz'):
+        return 'csv.gz'
+    return 'csv'
+
+
+# writes rows of inconsistencies to a CSV, gzip-compressed CSV or Parquet file (see output_format). Parquet files require pyarrow.
+# Every batch of rows is flushed, so the file can be read (up to the last batch) while it is being written.
+class InconsistencyWriter:
+    def __init__(self, output_file, headers):
+        self.format = output_format(output_file)
+        self.headers = headers
+        if self.format == 'parquet':
+            import pyarrow  # pyarrow is only needed for Parquet output
+            import pyarrow.parquet
+            self.pyarrow = pyarrow
+            self.schema = pyarrow.schema([(header, pyarrow.int64() if k in COUNT_COLUMNS else pyarrow.string()) for k, header in enumerate(headers)])
+            self.parquet_writer = pyarrow.parquet.ParquetWriter(output_file, self.schema)
+        else:
+            self.file = gzip.open(output_file, 'wt') if self.format == 'csv.gz' else open(output_file, 'w')
+            self.csvwriter = csv.writer(self.file)
+            self.csvwriter.writerow(headers)
+
+    def write_rows(self, rows):
+        if self.format == 'parquet':
+            columns = [[] for header in self.headers]
+            for row in rows:
+                for k, value in enumerate(row):
+                    columns[k].append(int(value) if k in COUNT_COLUMNS else str(value))
+            if len(columns[0]) > 0:
+                self.parquet_writer.write_table(self.pyarrow.Table.from_arrays([self.pyarrow.array(column, type=field.type)
+                                                                                for column, field in zip(columns, self.schema)], schema=self.schema))
+        else:
+            self.csvwriter.writerows(rows)
+            self.file.flush()
 
-    for pred1 in tqdm(predictions):
-        pred1_child = pred1[0].split(' ', 1)[0]
-        pred1_rel = pred1[1]
-        pred1_parent = pred1[2].split(' ', 1)[0]
+    def write_shard(self, shard_index, inconsistencies):
+        self.write_rows(map(inconsistency_row, inconsistencies))
 
-        if pred1_child == 'GO:0001775' and pred1_rel == 'part_of' and (pred1_parent == 'GO:0030154' or pred1_parent == 'GO:0048468'):
-            continue
+    def close(self):
+        if self.format == 'parquet':
+            self.parquet_writer.close()
+        else:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# writes the rows of each shard of the search to its own part file in a directory, e.g. part-00012.csv.gz for shard 12.
+# A part file is written under a temporary name and renamed when complete, so the part files present are complete.
+class PartFileWriter:
+    def __init__(self, directory, file_format, headers):
+        self.directory = directory
+        self.extension = OUTPUT_EXTENSIONS[file_format]
+        self.headers = headers
+        os.makedirs(directory, exist_ok=True)
+
+    def part_file(self, shard_index):
+        return os.path.join(self.directory, 'part-{0:05d}{1}'.format(shard_index, self.extension))
+
+    def write_shard(self, shard_index, inconsistencies):
+        tmp_file = os.path.join(self.directory, '.tmp-part-{0:05d}{1}'.format(shard_index, self.extension))
+        with InconsistencyWriter(tmp_file, self.headers) as writer:
+            writer.write_shard(shard_index, inconsistencies)
+        os.replace(tmp_file, self.part_file(shard_index))
+
+    def close(self):
+        pass
+
+
+# a predicted relation is redundant if it is implied by the existing relations and the other predicted relations.
+# The ontology is loaded once and all predictions are added to it once. Each prediction is then checked by leaving
+# only its own relation out (see Concept.is_implied_without_parent).
+# Predicted relations that close a cycle are reported, left out of the graph and kept as suggestions.
+# If a checkpoint is given, the result of each check is recorded in it and the predictions already checked are not checked again.
+# If reachability is True, the checks are answered by a reachability index of the graph (see Reachability_index), without
+# computing its closure, except for predictions whose child is on a cycle.
+def remove_redundant_relations(predictions, labels_file, relations_file, pos_tag_file, output_file_redundantRemoved, checkpoint=None,
+                               reachability=False):
+    redundant_predictions = set()
 
-        closure_concept_dict_3 = get_ont_with_direct_rels(labels_file, relations_file, pos_tag_file)
+    closure_concept_dict_3 = get_ont_with_direct_rels(labels_file, relations_file, pos_tag_file)
 
-        for pred2 in predictions:   # load parent as a direct parent of child
-            if pred1 == pred2:
-                continue
-            pred2_child = pred2[0].split(' ', 1)[0]
-            pred2_rel = pred2[1]
-            pred2_parent = pred2[2].split(' ', 1)[0]
+    for pred in predictions:   # load parent as a direct parent of child
+        pred_child, pred_rel, pred_parent = predicted_edge(pred)
 
-            if pred2_child == 'GO:0001775' and pred2_rel == 'part_of' and (pred2_parent == 'GO:0030154' or pred2_parent == 'GO:0048468'):  # This creates a cycle in GO. Breaking the cycle here.
-                continue
+        if pred_rel in closure_concept_dict_3[pred_child].parents:
+            closure_concept_dict_3[pred_child].parents[pred_rel].add(pred_parent)
+        else:
+            ances = set()
+            ances.add(pred_parent)
+            closure_concept_dict_3[pred_child].parents[pred_rel] = ances
+
+    components = closure_components(closure_concept_dict_3)
+    report_cycles(find_cycles(closure_concept_dict_3, components))
+    cyclic_edges = edges_on_cycles(closure_concept_dict_3, [predicted_edge(pred) for pred in predictions], components)
+    for pred_child, pred_rel, pred_parent in sorted(cyclic_edges):  # This creates a cycle in GO. Breaking the cycle here.
+        print('Predicted relation on a cycle: ' + pred_child + ' ' + pred_rel + ' ' + pred_parent)
+        closure_concept_dict_3[pred_child].parents[pred_rel].discard(pred_parent)
+
+    index = None
+    if reachability:
+        from Reachability_index import ReachabilityIndex
+        index = ReachabilityIndex(closure_concept_dict_3, all_states=True)
 
-            if pred2_rel in closure_concept_dict_3[pred2_child].parents:
-                closure_concept_dict_3[pred2_child].parents[pred2_rel].add(pred2_parent)
-            else:
-                ances = set()
-                ances.add(pred2_parent)
-                closure_concept_dict_3[pred2_child].parents[pred2_rel] = ances
+    for pred1 in tqdm(predictions):
+        pred1_child, pred1_rel, pred1_parent = predicted_edge(pred1)
 
-        closure_concept_dict_3[pred1_child].find_all_ancs_closure()
+        if (pred1_child, pred1_rel, pred1_parent) in cyclic_edges:
+            continue
 
-        # if the predicted relation exists in the computed closure which is also based on other predicted relations, then it is a redundant relation
-        if (pred1_rel in closure_concept_dict_3[pred1_child].ancestors) and (pred1_parent in closure_concept_dict_3[pred1_child].ancestors[pred1_rel]):
+        if checkpoint is not None and (pred1_child, pred1_rel, pred1_parent) in checkpoint.checked_predictions:
+            redundant = checkpoint.checked_predictions[(pred1_child, pred1_rel, pred1_parent)]
+        else:
+            # if the predicted relation is implied by the closure which is also based on other predicted relations, then it is a redundant relation
+            redundant = None if index is None else index.is_implied(pred1_child, pred1_rel, pred1_parent)
+            if redundant is None:
+                redundant = closure_concept_dict_3[pred1_child].is_implied_without_parent(pred1_rel, pred1_parent)
+            if checkpoint is not None:
+                checkpoint.record_prediction((pred1_child, pred1_rel, pred1_parent), redundant)
+
+        if redundant:
             redundant_predictions.add(pred1)
 
-
     redundant_removed = predictions.difference(redundant_predictions)
 
     if output_file_redundantRemoved != None:
-        with open(output_file_redundantRemoved, 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(('Descendant', 'Relation', 'Ancestor', 'Pattern', 'num existing relations with pattern',
-                                'Example existing relations with pattern', 'Replacement pattern',
-                                'num examples for replacement', 'Replacement example 1', 'Replacement example 2'))
-            csvwriter.writerows(redundant_removed)
+        with InconsistencyWriter(output_file_redundantRemoved, OUTPUT_HEADERS) as writer:
+            writer.write_rows(inconsistency_row(inconsistency) for inconsistency in redundant_removed)
 
     # if output_redundant_rels != None:
     #     with open(output_redundant_rels, 'w') as csvfile:
@@ -290,33 +1258,185 @@ def remove_redundant_relations(predictions, labels_file, relations_file, pos_tag
     return redundant_removed
 
 
-def main():
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Suggests inconsistencies in GO relations using evidence-based lexical patterns.')
+    parser.add_argument('labels_file')
+    parser.add_argument('relations_file')
+    parser.add_argument('pos_tag_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--search-mode', choices=SEARCH_MODES, default='index', help='how candidate concept-pairs are enumerated')
+    parser.add_argument('--compare-search-modes', nargs='+', choices=SEARCH_MODES, metavar='MODE',
+                        help='run the given search modes, check that they give the same inconsistencies and exit')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes for the difference patterns and the search')
+    parser.add_argument('--closure-backend', choices=CLOSURE_BACKENDS, default='sets',
+                        help="how ancestors are stored: Python sets or 'compact' integer arrays (requires NumPy)")
+    parser.add_argument('--snapshot-dir', help='directory of the closure snapshot, reused while the input files are unchanged (requires NumPy)')
+    parser.add_argument('--save-state', metavar='DIR', help='save the audit state of this release, for an incremental audit of the next release (requires NumPy)')
+    parser.add_argument('--previous-state', metavar='DIR',
+                        help='audit incrementally from the audit state saved for the previous release and also write the added and resolved inconsistencies')
+    parser.add_argument('--difference-table', choices=DIFFERENCE_TABLES, default='full',
+                        help="how the relation-pairs of difference patterns are stored: all pairs, or only their number and a few examples ('sampled', 'counted')")
+    parser.add_argument('--suggestions-file', metavar='FILE',
+                        help='also write the suggestions (before removing redundant ones) to FILE as they are found')
+    parser.add_argument('--suggestions-dir', metavar='DIR',
+                        help='also write the suggestions found in each shard of the search to a part file in DIR, in the format of the output file')
+    parser.add_argument('--checkpoint-dir', metavar='DIR', help='checkpoint the progress of the search and of the removal of redundant suggestions in DIR')
+    parser.add_argument('--checkpoint-interval', type=float, default=60, metavar='SECONDS', help='seconds between writes of the checkpoint (default 60)')
+    parser.add_argument('--resume', action='store_true', help='resume the run checkpointed in the --checkpoint-dir')
+    parser.add_argument('--reachability-index', action='store_true',
+                        help='check the ancestry of concept-pairs and the redundancy of suggestions with a reachability index instead of the ancestors of all relations')
+    parser.add_argument('--tag-pos', action='store_true',
+                        help='first tag the concepts whose part-of-speech tags are missing from the part-of-speech file or stale, and write them to it (requires spaCy)')
+    parser.add_argument('--pos-cache-file', metavar='FILE', help='csv file caching the part-of-speech tags of labels for --tag-pos (see Part_of_speech_tagging.py)')
+    parser.add_argument('--plan', action='store_true',
+                        help='estimate the size of the pattern tables, the concept-pairs of the search and the time and memory of the run, and exit')
+    parser.add_argument('--max-pairs', type=int, metavar='N',
+                        help="budget of concept-pairs enumerated by the search: 'index' is used instead of 'pairwise' if it exceeds it, and the search stops with partial results when it is reached")
+    parser.add_argument('--max-memory', type=float, metavar='MB', help='budget of the projected peak memory of the run, in MB: a compact difference table is used instead if it exceeds it')
+    parser.add_argument('--report', metavar='FILE', help='write the time and peak memory of each stage and the counters of the search to FILE as JSON')
+    parser.add_argument('--profile', choices=Instrumentation.PROFILERS, help='profile the run (the main process) with cProfile or pyinstrument')
+    parser.add_argument('--profile-output', metavar='FILE', default='profile.out',
+                        help='file of the profile (default profile.out); pyinstrument writes HTML if it ends with .html')
+    args = parser.parse_args(argv)
+    if args.resume and args.checkpoint_dir is None:
+        parser.error('--resume requires --checkpoint-dir')
+    if args.checkpoint_dir is not None and args.previous_state is not None:
+        parser.error('checkpoints are not supported for incremental audits')
+    if args.difference_table != 'full' and (args.save_state is not None or args.previous_state is not None):
+        parser.error('audit states require --difference-table full')
+    if (args.plan or args.max_pairs is not None or args.max_memory is not None) and (args.previous_state is not None or args.compare_search_modes):
+        parser.error('--plan and budgets are not supported for incremental audits or --compare-search-modes')
+    return args
+
+
+def run(args):
     start_time = time.time()
 
-    labels_file = sys.argv[1]
-    relations_file = sys.argv[2]
-    pos_tag_file = sys.argv[3]
-    output_inconsistency_file_reduced = sys.argv[4]
+    labels_file = args.labels_file
+    relations_file = args.relations_file
+    pos_tag_file = args.pos_tag_file
+    output_inconsistency_file_reduced = args.output_file
     
     #output_inconsistency_file = sys.argv[4]
     #output_inconsistency_file_reduced = sys.argv[4]
     #output_redundant_rels = sys.argv[6]
 
-    global closure_concept_dict
-
-    closure_concept_dict = compute_closure(labels_file, relations_file, pos_tag_file)
+    global closure_concept_dict, reachability_index
+
+    Instrumentation.reset_report(dict(vars(args)), count_checks=args.report is not None)
+
+    if args.tag_pos:
+        from Part_of_speech_tagging import update_pos_tags   # spaCy is only needed to tag labels
+        with Instrumentation.stage('pos_tagging'):
+            update_pos_tags(labels_file, pos_tag_file, cache_file=args.pos_cache_file)
+
+    if args.previous_state is not None:
+        from Incremental_audit import incremental_audit  # NumPy is only needed for audit states
+        with Instrumentation.stage('incremental_audit'):
+            incremental_audit(args.previous_state, labels_file, relations_file, pos_tag_file, output_inconsistency_file_reduced, args.save_state)
+        if args.report is not None:
+            Instrumentation.run_report.write(args.report)
+        print("Total time: {0:.2f} mins".format((time.time() - start_time) / 60))
+        return
+
+    with Instrumentation.stage('compute_closure'):
+        if args.snapshot_dir is not None:
+            closure_concept_dict = compute_closure(labels_file, relations_file, pos_tag_file, snapshot_dir=args.snapshot_dir)
+        elif args.closure_backend == 'compact':
+            from Compact_closure import compute_compact_closure   # NumPy is only needed for this backend
+            closure_concept_dict = compute_compact_closure(labels_file, relations_file, pos_tag_file)
+        else:
+            # the ancestors of all relations are only needed without the index, or to save the audit state
+            closure_concept_dict = compute_closure(labels_file, relations_file, pos_tag_file,
+                                                   find_all_ancestors=not args.reachability_index or args.save_state is not None)
 
     print('Closure computed!')
 
-    predictions = suggest_inconsistencies(None)
-
-    remove_redundant_relations(predictions, labels_file, relations_file, pos_tag_file, output_inconsistency_file_reduced)
+    reachability_index = None
+    if args.reachability_index:
+        from Reachability_index import ReachabilityIndex
+        with Instrumentation.stage('reachability_index'):
+            reachability_index = ReachabilityIndex(closure_concept_dict)
+        Instrumentation.add_counts({'reachability_index_bytes': reachability_index.nbytes()})
+
+    if args.compare_search_modes:
+        all_equal = compare_search_modes(args.compare_search_modes, args.workers, args.difference_table)
+        sys.exit(0 if all_equal else 1)
+
+    # the cost of the run is estimated from the closure and the lexical patterns, which the run then uses
+    search_mode, difference_table = args.search_mode, args.difference_table
+    pattern_dict = None
+    if args.plan or args.max_pairs is not None or args.max_memory is not None:
+        import Cost_estimator
+        with Instrumentation.stage('generate_patterns_existing_rels'):
+            pattern_dict = generate_patterns_existing_rels()
+        with Instrumentation.stage('plan'):
+            estimate = Cost_estimator.estimate_run(pattern_dict, (search_mode, 'index') if search_mode == 'pairwise' else (search_mode,),
+                                                   args.workers)
+        Cost_estimator.print_estimate(estimate)
+        Instrumentation.set_plan(estimate)
+
+        budget = None
+        if not args.plan:
+            budget = Cost_estimator.fit_budget(estimate, difference_table, search_mode, args.max_pairs, args.max_memory,
+                                               keep_difference_table=args.save_state is not None)
+            if budget is None:
+                print('The difference patterns are projected to exceed the memory budget: stopping before generating them.')
+        if budget is None:
+            if args.report is not None:
+                Instrumentation.run_report.write(args.report)
+            print("Total time: {0:.2f} mins".format((time.time() - start_time) / 60))
+            sys.exit(0 if args.plan else 1)
+        difference_table, search_mode = budget[:2]
+
+    checkpoint = None
+    if args.checkpoint_dir is not None:
+        from Checkpoint import RunCheckpoint, run_key
+        settings = {'search_mode': search_mode, 'difference_table': difference_table, 'closure_backend': args.closure_backend,
+                    'snapshot': args.snapshot_dir is not None, 'shard_sizes': (CONCEPT_SHARD_SIZE, PATTERN_SHARD_SIZE)}
+        checkpoint = RunCheckpoint(args.checkpoint_dir, run_key((labels_file, relations_file, pos_tag_file), settings),
+                                   args.resume, args.checkpoint_interval)
+
+    pattern_tables = None
+    if checkpoint is None or not checkpoint.search_complete or args.save_state is not None:
+        pattern_tables = generate_pattern_tables(args.workers, difference_table, pattern_dict)
+    predictions = suggest_inconsistencies(args.suggestions_file, search_mode, args.workers, pattern_tables,
+                                          args.suggestions_dir, output_format(output_inconsistency_file_reduced), checkpoint, args.max_pairs)
+
+    # whether the suggestions of a search stopped by the budget are redundant depends on the suggestions not found yet, so
+    # those checks are not recorded in the checkpoint
+    redundancy_checkpoint = checkpoint if checkpoint is None or checkpoint.search_complete else None
+    with Instrumentation.stage('remove_redundant_relations'):
+        inconsistencies = remove_redundant_relations(predictions, labels_file, relations_file, pos_tag_file, output_inconsistency_file_reduced,
+                                                     redundancy_checkpoint, args.reachability_index)
+    Instrumentation.add_counts({'inconsistencies': len(inconsistencies)})
     print('Redundant suggestions removed and inconsistencies written to file!')
+    if checkpoint is not None:
+        checkpoint.close()
+
+    if args.save_state is not None:
+        from Incremental_audit import save_audit_state
+        with Instrumentation.stage('save_audit_state'):
+            save_audit_state(args.save_state, labels_file, relations_file, pos_tag_file, closure_concept_dict, *pattern_tables,
+                             predictions, inconsistencies)
+
+    if args.report is not None:
+        Instrumentation.run_report.write(args.report)
 
     end_time = (time.time() - start_time) / 60
     print("Total time: {0:.2f} mins".format(end_time))
 
 
+def main():
+    args = parse_arguments(sys.argv[1:])
+    if args.profile is not None:
+        Instrumentation.run_profiled(lambda: run(args), args.profile, args.profile_output)
+    else:
+        run(args)
+
+
 
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    # run as the suggest_inconsistencies module, so that the modules importing it (e.g. Incremental_audit) share its pattern ids
+    import suggest_inconsistencies
+    suggest_inconsistencies.main()
\ No newline at end of file